@@ -0,0 +1,73 @@
+# analytics_counters.py
+"""Проверка и перестроение счётчиков аналитики (DepartmentStats, GroupStats).
+
+Счётчики поддерживают триггеры из миграции 6. Если есть подозрение, что они
+разошлись с данными (ручные правки в обход триггеров, восстановление из
+бэкапа), запустите:
+
+    python -m analytics_counters            # показать расхождения
+    python -m analytics_counters --rebuild  # пересчитать с нуля
+"""
+import asyncio
+import sys
+
+import asyncpg
+
+# Строки, где сохранённые счётчики расходятся с пересчитанными «с нуля».
+# Отсутствующая строка считается нулевой.
+_MISMATCHES_SQL = """
+    SELECT 'group' AS scope, department_id, group_name,
+           ARRAY[COALESCE(g.students, 0), COALESCE(g.students_reserved, 0),
+                 COALESCE(g.students_closed, 0)] AS stored,
+           ARRAY[COALESCE(e.students, 0), COALESCE(e.students_reserved, 0),
+                 COALESCE(e.students_closed, 0)] AS expected
+      FROM GroupStats g
+      FULL JOIN GroupStatsExpected e USING (department_id, group_name)
+     WHERE (COALESCE(g.students, 0), COALESCE(g.students_reserved, 0), COALESCE(g.students_closed, 0))
+        <> (COALESCE(e.students, 0), COALESCE(e.students_reserved, 0), COALESCE(e.students_closed, 0))
+    UNION ALL
+    SELECT 'department', department_id, NULL,
+           ARRAY[COALESCE(d.students, 0), COALESCE(d.students_reserved, 0),
+                 COALESCE(d.students_closed, 0), COALESCE(d.free_topics, 0)],
+           ARRAY[COALESCE(e.students, 0), COALESCE(e.students_reserved, 0),
+                 COALESCE(e.students_closed, 0), COALESCE(e.free_topics, 0)]
+      FROM DepartmentStats d
+      FULL JOIN DepartmentStatsExpected e USING (department_id)
+     WHERE (COALESCE(d.students, 0), COALESCE(d.students_reserved, 0),
+            COALESCE(d.students_closed, 0), COALESCE(d.free_topics, 0))
+        <> (COALESCE(e.students, 0), COALESCE(e.students_reserved, 0),
+            COALESCE(e.students_closed, 0), COALESCE(e.free_topics, 0))
+    ORDER BY 1, 2, 3
+"""
+
+
+async def check(conn) -> list:
+    """Возвращает расхождения; пустой список — счётчики согласованы."""
+    return await conn.fetch(_MISMATCHES_SQL)
+
+
+async def rebuild(conn):
+    async with conn.transaction():
+        await conn.execute("SELECT analytics_rebuild()")
+
+
+if __name__ == "__main__":
+    from config import POSTGRES_URI
+
+    async def _main():
+        conn = await asyncpg.connect(POSTGRES_URI)
+        try:
+            mismatches = await check(conn)
+            for r in mismatches:
+                group = f", группа «{r['group_name']}»" if r['group_name'] is not None else ""
+                print(f"{r['scope']}: кафедра {r['department_id']}{group}: "
+                      f"сохранено {list(r['stored'])}, должно быть {list(r['expected'])}")
+            if not mismatches:
+                print("Счётчики согласованы с данными.")
+            if "--rebuild" in sys.argv[1:]:
+                await rebuild(conn)
+                print(f"Счётчики пересчитаны (расхождений было: {len(mismatches)}).")
+        finally:
+            await conn.close()
+
+    asyncio.run(_main())
@@ -0,0 +1 @@
+# Нагрузочные замеры; запускаются из корня проекта: python -m benchmarks.<имя>
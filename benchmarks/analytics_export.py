@@ -0,0 +1,85 @@
+"""Память и время отчёта «Студенты без темы»: прежняя выборка всех строк
+в одно сообщение против выгрузки в CSV/XLSX серверным курсором.
+
+Пик памяти Python меряется tracemalloc и при выгрузке не должен расти с
+числом студентов. Для сравнения запустите с разным --students.
+
+Запуск из корня проекта на базе с накатанными миграциями:
+    python -m benchmarks.analytics_export --students 100000
+
+Студенты создаются на отдельной тестовой кафедре и удаляются в конце.
+"""
+import argparse
+import asyncio
+import os
+import time
+import tracemalloc
+
+from database import acquire, init_pool, close_pool
+import exports
+import migrations
+
+DEPARTMENT = "Кафедра теста выгрузки"
+
+
+async def _seed(n_students: int) -> int:
+    async with acquire() as conn:
+        await migrations.migrate(conn)
+        department_id = await conn.fetchval(
+            "INSERT INTO Departments(name) VALUES($1) RETURNING department_id", DEPARTMENT
+        )
+        await conn.execute(
+            """
+            INSERT INTO Students(name, group_name, department_id)
+            SELECT 'Студент Выгрузкин ' || i, 'ВЫ-' || (10 + i / 30), $1
+              FROM generate_series(1, $2) i
+            """,
+            department_id, n_students
+        )
+    return department_id
+
+
+async def _legacy() -> int:
+    # Прежний list_without_topic: все строки в память и в одну строку текста
+    async with acquire() as conn:
+        rows = await conn.fetch(exports.REPORTS['without_topic'].sql)
+    text = "👤 Студенты без темы:\n" + "\n".join(r['name'] for r in rows)
+    return len(text)
+
+
+async def _export(fmt: str) -> int:
+    async with exports.export('without_topic', fmt) as result:
+        return os.path.getsize(result.path)
+
+
+async def _measure(label: str, call):
+    tracemalloc.start()
+    started = time.perf_counter()
+    size = await call()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<32} {elapsed:7.2f} с   пик памяти {peak / 1024 / 1024:8.1f} МБ   результат {size / 1024:9.0f} КБ")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--students", type=int, default=100000)
+    args = parser.parse_args()
+
+    await init_pool()
+    department_id = await _seed(args.students)
+    try:
+        print(f"Добавлено студентов без темы: {args.students}\n")
+        await _measure("сообщение (все строки в память)", _legacy)
+        for fmt in exports.FORMATS:
+            await _measure(f"выгрузка {fmt.upper()}", lambda: _export(fmt))
+    finally:
+        async with acquire() as conn:
+            await conn.execute("DELETE FROM Students WHERE department_id = $1", department_id)
+            await conn.execute("DELETE FROM Departments WHERE department_id = $1", department_id)
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
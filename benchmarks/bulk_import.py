@@ -0,0 +1,151 @@
+"""Импорт тем и списка группы из CSV через bulk_import.run() против
+построчных INSERT, как их делают диалоги бота (по запросу на тему или
+студента).
+
+В файлах есть доля ошибочных строк и дубликатов — они проходят через
+проверку и попадают в отчёт, как у преподавателя.
+
+Запуск из корня проекта на базе с накатанными миграциями:
+    python -m benchmarks.bulk_import --rows 5000
+
+Данные создаются на отдельной тестовой кафедре и удаляются в конце.
+"""
+import argparse
+import asyncio
+import csv
+import io
+import random
+import time
+
+from database import acquire, init_pool, close_pool
+import bulk_import
+import migrations
+
+DEPARTMENT = "Кафедра теста импорта"
+WORDS = [
+    "анализ", "разработка", "модель", "система", "нейросети", "данные",
+    "управление", "алгоритмы", "оптимизация", "методы", "изображения", "тексты",
+]
+
+
+def _csv(header: list[str], rows) -> bytes:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    writer.writerow(header)
+    writer.writerows(rows)
+    return buffer.getvalue().encode('utf-8-sig')
+
+
+def _topic_rows(n: int, rnd: random.Random, bad_share: float) -> list[tuple]:
+    rows = []
+    for i in range(n):
+        title = f"Тестовый импорт {i}: " + " ".join(rnd.sample(WORDS, 3))
+        keywords = ", ".join(rnd.sample(WORDS, rnd.randint(1, 4)))
+        if rnd.random() < bad_share:
+            title, keywords = rnd.choice([("Тема", keywords), (title, "")])
+        rows.append((title, "Описание темы для нагрузочного импорта", keywords))
+    return rows
+
+
+def _student_rows(n: int, rnd: random.Random, bad_share: float) -> list[tuple]:
+    rows = []
+    for i in range(n):
+        group = f"ИМ-{10 + i // 30}"
+        email = f"import-bench-{i}@example.org"
+        if rnd.random() < bad_share:
+            group = "группа без номера"
+        rows.append((f"Студент Импортов {i}", group, email))
+    return rows
+
+
+async def _seed() -> int:
+    async with acquire() as conn:
+        await migrations.migrate(conn)
+        return await conn.fetchval(
+            "INSERT INTO Departments(name) VALUES($1) RETURNING department_id", DEPARTMENT
+        )
+
+
+async def _clear(department_id: int):
+    async with acquire() as conn:
+        await conn.execute("DELETE FROM Topics WHERE department_id = $1", department_id)
+        await conn.execute("DELETE FROM Students WHERE department_id = $1", department_id)
+
+
+async def _rowwise_topics(rows: list[tuple], department_id: int):
+    for title, description, keywords in rows:
+        async with acquire() as conn:
+            await conn.execute(
+                """
+                INSERT INTO Topics(title, description, keywords, status, department_id)
+                VALUES($1, $2, $3, 'free', $4)
+                """,
+                title, description, [k.strip() for k in keywords.split(',') if k.strip()], department_id
+            )
+
+
+async def _rowwise_students(rows: list[tuple], department_id: int):
+    for name, group, email in rows:
+        async with acquire() as conn:
+            await conn.execute(
+                "INSERT INTO Students(name, group_name, email, department_id) VALUES($1, $2, $3, $4)",
+                name, group, email, department_id
+            )
+
+
+def _print(label: str, elapsed: float, rows: int):
+    print(f"{label:<40} {elapsed:7.2f} с   {rows / elapsed:9.0f} строк/с")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--bad-share", type=float, default=0.02,
+                        help="доля строк с ошибками")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    topics = _topic_rows(args.rows, rnd, args.bad_share)
+    students = _student_rows(args.rows, rnd, args.bad_share)
+
+    await init_pool()
+    department_id = await _seed()
+    try:
+        print(f"Строк в файле: {args.rows}, с ошибками ~{args.bad_share:.0%}\n")
+        for kind, header, rows in (
+            ('topics', ["Название", "Описание", "Ключевые слова"], topics),
+            ('roster', ["ФИО", "Группа", "Email"], students),
+        ):
+            data = _csv(header, rows)
+            started = time.perf_counter()
+            result = await bulk_import.run(data, f"{kind}.csv", kind, None, department_id)
+            _print(f"{kind}: CSV → COPY → INSERT ... SELECT", time.perf_counter() - started, result.rows)
+            print(f"  добавлено {result.added}, ошибок {len(result.errors)}, "
+                  f"уже в базе {len(result.existing)}")
+
+            # Повторный импорт того же файла: всё уже в базе
+            started = time.perf_counter()
+            again = await bulk_import.run(data, f"{kind}.csv", kind, None, department_id)
+            _print(f"{kind}: повторный импорт", time.perf_counter() - started, again.rows)
+            print(f"  добавлено {again.added}, уже в базе {len(again.existing)}")
+            await _clear(department_id)
+
+        good_topics = [r for r in topics if len(r[0]) >= 5 and r[2]]
+        started = time.perf_counter()
+        await _rowwise_topics(good_topics, department_id)
+        _print("topics: INSERT на каждую строку", time.perf_counter() - started, len(good_topics))
+
+        good_students = [r for r in students if r[1] != "группа без номера"]
+        started = time.perf_counter()
+        await _rowwise_students(good_students, department_id)
+        _print("roster: INSERT на каждую строку", time.perf_counter() - started, len(good_students))
+    finally:
+        await _clear(department_id)
+        async with acquire() as conn:
+            await conn.execute("DELETE FROM Departments WHERE department_id = $1", department_id)
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,153 @@
+"""Поддельный Telegram Bot API для локальных замеров.
+
+Поднимает aiohttp-сервер, который отвечает на методы бота так, как нужно
+aiogram: getMe, getUpdates (long polling из внутренней очереди), sendMessage,
+editMessageText, sendPhoto, answerCallbackQuery, setWebhook и т.п. Каждый
+исходящий вызов бота записывается в api.calls с моментом получения.
+
+Бот подключается к нему через свой base_url:
+
+    api = FakeBotAPI()
+    await api.start()
+    bot = api.make_bot()
+"""
+import asyncio
+import itertools
+import json
+import time
+
+from aiohttp import web
+
+TOKEN = "123456:bench"
+
+
+class FakeBotAPI:
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0):
+        self.host = host
+        self.port = port
+        # Искусственная задержка ответа — имитация сети до api.telegram.org
+        self.latency = latency
+        self.calls: list[tuple[float, str, dict]] = []
+        self.on_call = None  # fn(method, params), вызывается на каждый запрос бота
+        self._updates: list[dict] = []
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1)
+        self._new_updates = asyncio.Event()
+        self._runner: web.AppRunner | None = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def make_bot(self, token: str = TOKEN):
+        from aiogram import Bot
+        from aiogram.client.session.aiohttp import AiohttpSession
+        from aiogram.client.telegram import TelegramAPIServer
+
+        session = AiohttpSession(api=TelegramAPIServer.from_base(self.base_url))
+        return Bot(token=token, session=session)
+
+    # ---- Синтетические обновления ----
+
+    def message_update(self, user_id: int, text: str, **user) -> dict:
+        from_user = {"id": user_id, "is_bot": False, "first_name": user.get("first_name", "Test"),
+                     "username": user.get("username", f"user{user_id}")}
+        return {
+            "update_id": next(self._update_ids),
+            "message": {
+                "message_id": next(self._message_ids),
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": from_user,
+                "text": text,
+            },
+        }
+
+    def callback_update(self, user_id: int, data: str, message_id: int = 1) -> dict:
+        from_user = {"id": user_id, "is_bot": False, "first_name": "Test"}
+        return {
+            "update_id": next(self._update_ids),
+            "callback_query": {
+                "id": str(next(self._message_ids)),
+                "from": from_user,
+                "chat_instance": str(user_id),
+                "data": data,
+                "message": {
+                    "message_id": message_id,
+                    "date": int(time.time()),
+                    "chat": {"id": user_id, "type": "private"},
+                    "text": "…",
+                },
+            },
+        }
+
+    def push_update(self, update: dict):
+        """Обновление, которое бот заберёт через getUpdates."""
+        self._updates.append(update)
+        self._new_updates.set()
+
+    # ---- Методы Bot API ----
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        for key, value in params.items():
+            if isinstance(value, str) and value[:1] in "[{":
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    pass
+        self.calls.append((time.perf_counter(), method, params))
+        if self.on_call is not None:
+            self.on_call(method, params)
+
+        if method == "getUpdates":
+            result = await self._get_updates(params)
+        else:
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            result = self._result(method, params)
+        return web.json_response({"ok": True, "result": result})
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset", 0) or 0)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout=float(params.get("timeout", 0) or 0))
+            except asyncio.TimeoutError:
+                pass
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        limit = int(params.get("limit", 100) or 100)
+        return self._updates[:limit]
+
+    def _result(self, method: str, params: dict):
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "Bench", "username": "bench_bot"}
+        if method in ("sendMessage", "sendPhoto", "editMessageText", "sendDocument"):
+            chat_id = int(params.get("chat_id", 0) or 0)
+            message = {
+                "message_id": int(params.get("message_id", 0) or next(self._message_ids)),
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+            }
+            if "text" in params:
+                message["text"] = params["text"]
+            return message
+        # setWebhook, deleteWebhook, answerCallbackQuery и прочие — просто True
+        return True
@@ -0,0 +1,462 @@
+"""Нагрузочный прогон всего бота без настоящего токена.
+
+Диспетчер собирается так же, как в bot.py (bot.create_dispatcher()), со
+всеми middleware и хэндлерами, и работает с локальной PostgreSQL. Бот
+ходит в поддельный Bot API (fake_bot_api.py), который записывает
+sendMessage/sendPhoto. Виртуальные пользователи проходят сценарии:
+
+  registration — /start и регистрация студента до конца;
+  search       — поиск по ключевым словам, по названию и везде;
+  reserve      — выбор темы студентом и одобрение преподавателем (callback);
+  analytics    — отчёт по группе и список студентов с темой (с --charts ещё
+                 гистограмма — графики строятся в процессах charts.py).
+
+Сессии стартуют с заданной частотой (--rate сессий в секунду) в пропорциях
+--mix. По каждому хэндлеру печатаются p50/p95/p99 времени обработки
+обновления, число запросов к БД на обновление и ошибки, в конце — общая
+пропускная способность.
+
+Запуск из корня проекта:
+    python -m benchmarks.load --sessions 500 --rate 50
+    python -m benchmarks.load --sessions 500 --rate 50 --save baseline.json
+    python -m benchmarks.load --sessions 500 --rate 50 --baseline baseline.json
+
+С --baseline прогон сравнивается с сохранённым: если p95 или среднее число
+запросов какого-то хэндлера выросло больше чем на --tolerance, хэндлер
+превысил --max-p95 или --max-queries, сценарий не дошёл до конца или
+хэндлер упал, код выхода 1 — так прогон годится как проверка на регрессию.
+Запросы считает querytrace; столбец «повторы» — обновления, где один и тот
+же запрос выполнялся несколько раз.
+
+Тестовые кафедра, преподаватели, студенты и темы создаются в рабочих
+таблицах и удаляются в конце.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass
+
+import bot as bot_app
+import charts
+import database
+from database import acquire
+import eventlog
+import keyword_index
+import querytrace
+import refdata
+from benchmarks.fake_bot_api import FakeBotAPI
+
+# Telegram id тестовых пользователей: 12 цифр, у настоящих пользователей таких нет
+BASE_ID = 770_000_000_000
+SUPERVISOR_ID = BASE_ID
+TEACHERS_FROM = BASE_ID + 100_000
+STUDENTS_FROM = BASE_ID + 200_000
+NEWCOMERS_FROM = BASE_ID + 300_000
+ID_PATTERN = "770000______"
+
+DEPARTMENT = "Кафедра нагрузочного теста"
+GROUP = "НТ-01"
+WORDS = [
+    "анализ", "разработка", "модель", "система", "нейронных", "сетей", "данных",
+    "управления", "алгоритмы", "оптимизация", "исследование", "методы", "обработки",
+    "изображений", "текстов", "прогнозирования", "распределённых", "вычислений",
+]
+NO_HANDLER = "<нет хэндлера>"
+
+
+# ---- Пользователи и сценарии ----
+
+class ScriptFailed(Exception):
+    pass
+
+
+class Harness:
+    def __init__(self, api: FakeBotAPI, bot, dp):
+        self.api = api
+        self.bot = bot
+        self.dp = dp
+        # chat_id -> ответы бота (параметры sendMessage/sendPhoto)
+        self.replies: dict[int, list[dict]] = defaultdict(list)
+        # хэндлер -> [(время, запросы, время в БД, был ли повтор запроса)]
+        self.samples: dict[str, list[tuple[float, int, float, bool]]] = defaultdict(list)
+        self.errors: dict[str, int] = defaultdict(int)
+        self.failures: dict[str, list[str]] = defaultdict(list)
+        self.sessions: dict[str, list[float]] = defaultdict(list)
+        # Названия тестовых тем (см. _seed)
+        self.titles: set[str] = set()
+        api.on_call = self._on_call
+
+    def _on_call(self, method: str, params: dict):
+        if method in ("sendMessage", "sendPhoto", "sendDocument") and params.get("chat_id"):
+            self.replies[int(params["chat_id"])].append(params)
+
+    async def feed(self, update: dict):
+        # Трассировку обновления внутри открывает querytrace, её итог попадает сюда
+        failed = False
+        started = time.perf_counter()
+        with querytrace.trace() as result:
+            try:
+                await self.dp.feed_raw_update(self.bot, update)
+            except Exception:
+                failed = True
+        elapsed = time.perf_counter() - started
+        handler = result.label or NO_HANDLER
+        if failed:
+            self.errors[handler] += 1
+        self.samples[handler].append((elapsed, result.queries, result.time, bool(result.repeated(2))))
+
+    def take_callback(self, chat_id: int, prefix: str, suffix: str = "") -> str | None:
+        """Забирает из чата chat_id сообщение с inline-кнопкой prefix…suffix."""
+        messages = self.replies[chat_id]
+        for i, params in enumerate(messages):
+            for row in (params.get("reply_markup") or {}).get("inline_keyboard", []):
+                for button in row:
+                    data = button.get("callback_data", "")
+                    if data.startswith(prefix) and data.endswith(suffix):
+                        del messages[i]
+                        return data
+        return None
+
+
+class User:
+    def __init__(self, harness: Harness, user_id: int, think: float):
+        self.h = harness
+        self.user_id = user_id
+        self.think = think
+
+    async def send(self, text: str, expect: str | None = None) -> list[dict]:
+        """Отправляет сообщение и возвращает ответы бота; expect — что должно быть в ответе."""
+        if self.think:
+            await asyncio.sleep(self.think)
+        await self.h.feed(self.h.api.message_update(self.user_id, text))
+        replies, self.h.replies[self.user_id] = self.h.replies[self.user_id], []
+        if expect is not None and not any(expect in (r.get("text") or r.get("caption") or "") for r in replies):
+            got = [(r.get("text") or r.get("caption") or "")[:60] for r in replies]
+            raise ScriptFailed(f"{text!r}: ждали «{expect}», получили {got}")
+        return replies
+
+
+def buttons(replies: list[dict]) -> list[str]:
+    labels = []
+    for params in replies:
+        for row in (params.get("reply_markup") or {}).get("keyboard", []):
+            labels += [b["text"] for b in row if b["text"] != "❌ Отмена"]
+    return labels
+
+
+async def script_registration(u: User, rnd: random.Random, args):
+    await u.send("/start", expect="выберите вашу роль")
+    await u.send("🎓 Студент", expect="ФИО")
+    await u.send(f"Нагрузочный Студент {u.user_id}", expect="email")
+    await u.send("Пропустить", expect="телефона")
+    await u.send("Пропустить", expect="группы")
+    await u.send(GROUP, expect="кафедру")
+    await u.send(DEPARTMENT, expect="Регистрация студента завершена")
+
+
+async def script_search(u: User, rnd: random.Random, args):
+    await u.send("🔍 Поиск темы")
+    await u.send("🔎 По ключевым словам")
+    await u.send(", ".join(rnd.sample(WORDS, 2)))
+    await u.send("🔍 Поиск темы")
+    await u.send("📖 По названию")
+    await u.send(rnd.choice(WORDS))
+    await u.send("🔍 Поиск темы")
+    await u.send("🔎 Искать везде")
+    await u.send(rnd.choice(WORDS))
+
+
+async def script_reserve(u: User, rnd: random.Random, args):
+    # В списке и настоящие темы из базы — их не трогаем
+    titles = [t for t in buttons(await u.send("🎯 Выбираю тему", expect="Выберите тему")) if t in u.h.titles]
+    if not titles:
+        raise ScriptFailed("нет свободных тем для выбора")
+    await u.send(rnd.choice(titles), expect="отправлен преподавателю")
+    # Запросы всех студентов приходят одному преподавателю — берём свой
+    data = u.h.take_callback(SUPERVISOR_ID, "approve_choose:", f":{u.user_id}")
+    if data is None:
+        raise ScriptFailed("преподаватель не получил запрос на одобрение")
+    # Ответы преподавателю не забираем: там ждут запросы других студентов
+    await u.h.feed(u.h.api.callback_update(SUPERVISOR_ID, data))
+    await u.send("📚 Свободные темы")
+
+
+async def script_analytics(u: User, rnd: random.Random, args):
+    await u.send("📈 Аналитика", expect="отчёт")
+    await u.send("🗂 Категоризация", expect="кафедру")
+    groups = buttons(await u.send(DEPARTMENT, expect="группу"))
+    if not groups:
+        raise ScriptFailed("в кафедре нет групп")
+    await u.send(groups[0], expect="Список студентов")
+    await u.send("📈 Аналитика")
+    await u.send("👥 Студенты с темой")
+    if args.charts:
+        await u.send("📈 Аналитика")
+        await u.send("📈 Гистограмма по группам")
+
+
+SCRIPTS = {
+    "registration": script_registration,
+    "search": script_search,
+    "reserve": script_reserve,
+    "analytics": script_analytics,
+}
+
+
+# ---- Тестовые данные ----
+
+@dataclass
+class Plan:
+    scripts: list[str]
+    topics: int
+
+    def users(self, name: str) -> list[int]:
+        return [i for i, s in enumerate(self.scripts) if s == name]
+
+
+def _user_id(index: int, script: str) -> int:
+    if script == "registration":
+        return NEWCOMERS_FROM + index
+    if script == "analytics":
+        return TEACHERS_FROM + index
+    return STUDENTS_FROM + index
+
+
+async def _seed(plan: Plan, rnd: random.Random) -> set[str]:
+    async with acquire() as conn:
+        dept_id = await conn.fetchval(
+            "INSERT INTO Departments(name) VALUES($1) RETURNING department_id", DEPARTMENT
+        )
+        teachers = [(f"Преподаватель {i}", str(_user_id(i, "analytics")), dept_id) for i in plan.users("analytics")]
+        teachers.append(("Научный руководитель", str(SUPERVISOR_ID), dept_id))
+        await conn.executemany(
+            "INSERT INTO Teachers(name, telegram_id, department_id) VALUES($1, $2, $3)", teachers
+        )
+        supervisor = await conn.fetchval(
+            "SELECT teacher_id FROM Teachers WHERE telegram_id = $1", str(SUPERVISOR_ID)
+        )
+        students = [
+            (f"Студент {i}", str(_user_id(i, s)), GROUP, dept_id)
+            for i, s in enumerate(plan.scripts) if s in ("search", "reserve")
+        ]
+        await conn.executemany(
+            "INSERT INTO Students(name, telegram_id, group_name, department_id) VALUES($1, $2, $3, $4)",
+            students
+        )
+        topics = []
+        for i in range(plan.topics):
+            keywords = rnd.sample(WORDS, 3)
+            title = f"{' '.join(rnd.sample(WORDS, 4)).capitalize()} №{i}"
+            topics.append((title, keywords, "free", supervisor, dept_id))
+        await conn.executemany(
+            "INSERT INTO Topics(title, keywords, status, teacher_id, department_id) VALUES($1, $2, $3, $4, $5)",
+            topics
+        )
+    return {t[0] for t in topics}
+
+
+async def _cleanup():
+    async with acquire() as conn:
+        async with conn.transaction():
+            # Журналы и связи с пользователями удаляются каскадом, темы — с кафедрой
+            await conn.execute("DELETE FROM Students WHERE telegram_id LIKE $1", ID_PATTERN)
+            await conn.execute("DELETE FROM Teachers WHERE telegram_id LIKE $1", ID_PATTERN)
+            await conn.execute("DELETE FROM Departments WHERE name = $1", DEPARTMENT)
+            await conn.execute("DELETE FROM Logs WHERE user_id LIKE $1", ID_PATTERN)
+            await conn.execute(
+                "DELETE FROM FsmStates WHERE user_id BETWEEN $1 AND $2", BASE_ID, BASE_ID + 999_999
+            )
+
+
+# ---- Прогон ----
+
+async def _session(h: Harness, index: int, name: str, args):
+    rnd = random.Random(args.seed * 100_003 + index)
+    user = User(h, _user_id(index, name), args.think)
+    started = time.perf_counter()
+    try:
+        await SCRIPTS[name](user, rnd, args)
+    except ScriptFailed as e:
+        h.failures[name].append(str(e))
+        return
+    h.sessions[name].append(time.perf_counter() - started)
+
+
+async def run(args, plan: Plan, titles: set[str]) -> tuple[Harness, float]:
+    api = FakeBotAPI(latency=args.api_latency)
+    await api.start()
+    bot = api.make_bot()
+    dp = bot_app.create_dispatcher()
+    h = Harness(api, bot, dp)
+    h.titles = titles
+
+    await keyword_index.build()
+    await refdata.load()
+    await eventlog.start()
+    charts.start()
+    try:
+        started = time.perf_counter()
+        tasks = []
+        for i, name in enumerate(plan.scripts):
+            tasks.append(asyncio.create_task(_session(h, i, name, args)))
+            # Сессии приходят равномерным потоком, не дожидаясь предыдущих
+            delay = started + (i + 1) / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        await asyncio.gather(*tasks)
+        elapsed = time.perf_counter() - started
+    finally:
+        charts.stop()
+        await eventlog.stop()
+        await bot.session.close()
+        await api.stop()
+    return h, elapsed
+
+
+def _quantiles(values: list[float]) -> tuple[float, float, float]:
+    if len(values) < 2:
+        v = values[0] if values else 0.0
+        return v, v, v
+    q = statistics.quantiles(values, n=100)
+    return q[49], q[94], q[98]
+
+
+def summarize(h: Harness, elapsed: float) -> dict:
+    handlers = {}
+    for name, samples in h.samples.items():
+        p50, p95, p99 = _quantiles([s[0] * 1000 for s in samples])
+        queries = [s[1] for s in samples]
+        handlers[name] = {
+            "n": len(samples), "p50": p50, "p95": p95, "p99": p99,
+            "queries": statistics.fmean(queries), "max_queries": max(queries),
+            "db_ms": statistics.fmean(s[2] * 1000 for s in samples),
+            # обновления, где один и тот же запрос выполнялся больше одного раза
+            "repeats": sum(s[3] for s in samples),
+            "errors": h.errors.get(name, 0),
+        }
+    updates = sum(len(s) for s in h.samples.values())
+    return {
+        "handlers": handlers,
+        "updates": updates,
+        "updates_per_sec": updates / elapsed,
+        "queries_per_update": sum(v["queries"] * v["n"] for v in handlers.values()) / max(updates, 1),
+        "sessions": {name: len(v) for name, v in h.sessions.items()},
+        "failures": {name: len(v) for name, v in h.failures.items()},
+    }
+
+
+def report(summary: dict, h: Harness, elapsed: float):
+    rows = sorted(summary["handlers"].items(), key=lambda kv: kv[1]["p95"], reverse=True)
+    width = max((len(name) for name, _ in rows), default=10)
+    print(f"{'хэндлер':<{width}}  {'n':>6}  {'p50, мс':>8}  {'p95, мс':>8}  {'p99, мс':>8}  "
+          f"{'БД, мс':>7}  {'запр./обн.':>10}  {'макс.':>5}  {'повторы':>7}  {'ошибки':>6}")
+    for name, v in rows:
+        print(f"{name:<{width}}  {v['n']:>6}  {v['p50']:>8.1f}  {v['p95']:>8.1f}  {v['p99']:>8.1f}  "
+              f"{v['db_ms']:>7.1f}  {v['queries']:>10.2f}  {v['max_queries']:>5}  {v['repeats']:>7}  {v['errors']:>6}")
+    print()
+    for name, durations in sorted(h.sessions.items()):
+        p50, p95, _ = _quantiles([d * 1000 for d in durations])
+        print(f"сценарий {name:<13} завершено {len(durations):>5}  "
+              f"p50 {p50:8.1f} мс  p95 {p95:8.1f} мс  сорвано {len(h.failures.get(name, []))}")
+    for name, messages in h.failures.items():
+        for message in messages[:3]:
+            print(f"  {name}: {message}")
+    print(f"\nобновлений {summary['updates']} за {elapsed:.1f} с — {summary['updates_per_sec']:.1f} обн./с, "
+          f"запросов к БД на обновление {summary['queries_per_update']:.2f}")
+
+
+def compare(summary: dict, baseline: dict, args) -> list[str]:
+    """Причины провала проверки на регрессию (пустой список — всё хорошо)."""
+    problems = []
+    for name, v in summary["handlers"].items():
+        if v["errors"]:
+            problems.append(f"{name}: ошибок {v['errors']}")
+        if args.max_p95 is not None and v["p95"] > args.max_p95:
+            problems.append(f"{name}: p95 {v['p95']:.1f} мс больше --max-p95 {args.max_p95}")
+        if args.max_queries is not None and v["max_queries"] > args.max_queries:
+            problems.append(f"{name}: {v['max_queries']} запросов к БД за обновление, "
+                            f"больше --max-queries {args.max_queries}")
+        base = baseline.get("handlers", {}).get(name)
+        if base is None or min(v["n"], base["n"]) < args.min_samples:
+            continue
+        if v["p95"] > base["p95"] * (1 + args.tolerance):
+            problems.append(f"{name}: p95 {v['p95']:.1f} мс, было {base['p95']:.1f} мс")
+        if v["queries"] > base["queries"] * (1 + args.tolerance):
+            problems.append(f"{name}: запросов на обновление {v['queries']:.2f}, было {base['queries']:.2f}")
+    for name, failed in summary["failures"].items():
+        if failed:
+            problems.append(f"сценарий {name}: сорвано {failed}")
+    return problems
+
+
+def _parse_mix(text: str) -> dict[str, float]:
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name not in SCRIPTS:
+            raise argparse.ArgumentTypeError(f"неизвестный сценарий {name!r}, есть: {', '.join(SCRIPTS)}")
+        mix[name] = float(weight or 1)
+    return mix
+
+
+async def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=500, help="сколько сессий пользователей")
+    parser.add_argument("--rate", type=float, default=50, help="новых сессий в секунду")
+    parser.add_argument("--mix", type=_parse_mix, default="registration=1,search=4,reserve=2,analytics=1",
+                        help="сценарии и их веса")
+    parser.add_argument("--topics", type=int, default=1000, help="свободных тем в тестовой кафедре")
+    parser.add_argument("--think", type=float, default=0.0, help="пауза пользователя между сообщениями, с")
+    parser.add_argument("--api-latency", type=float, default=0.0,
+                        help="задержка ответа поддельного Bot API, с")
+    parser.add_argument("--charts", action="store_true", help="строить гистограммы в сценарии analytics")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--save", help="сохранить результат в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого прогона для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="допустимый рост p95 и запросов")
+    parser.add_argument("--max-p95", type=float, help="предельный p95 любого хэндлера, мс")
+    parser.add_argument("--max-queries", type=int, help="предельное число запросов к БД за обновление")
+    parser.add_argument("--min-samples", type=int, default=20,
+                        help="хэндлеры с меньшим числом обновлений не сравниваются")
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    names, weights = zip(*args.mix.items())
+    plan = Plan(rnd.choices(names, weights, k=args.sessions), args.topics)
+
+    await database.init_pool(connection_class=querytrace.TracedConnection)
+    try:
+        await database.init_db()
+        await _cleanup()
+        titles = await _seed(plan, rnd)
+        h, elapsed = await run(args, plan, titles)
+    finally:
+        await _cleanup()
+        await database.close_pool()
+
+    summary = summarize(h, elapsed)
+    report(summary, h, elapsed)
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    problems = compare(summary, baseline, args)
+    if problems:
+        print("\nПроверка не пройдена:")
+        for problem in problems:
+            print(f"  {problem}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,64 @@
+"""Сколько добавляют middleware metrics.py к обработке одного обновления.
+
+Цепочка «внешний middleware на update → внутренний на событии → хэндлер»
+вызывается напрямую, без диспетчера и сети: замеряется только учёт метрик.
+Хэндлер ничего не делает, поэтому разница с голой цепочкой — и есть
+накладные расходы на обновление.
+
+Запуск из корня проекта:
+    python -m benchmarks.metrics_overhead --updates 200000
+"""
+import argparse
+import asyncio
+import time
+
+import metrics
+
+
+class _Handler:
+    callback = staticmethod(lambda: None)
+
+
+async def _noop(event, data):
+    return True
+
+
+async def _bare(n: int) -> float:
+    data = {"handler": _Handler(), "raw_state": "SearchStates:WAITING_QUERY"}
+    started = time.perf_counter()
+    for _ in range(n):
+        await _noop(None, data)
+    return time.perf_counter() - started
+
+
+async def _instrumented(n: int) -> float:
+    outer = metrics.UpdateMetricsMiddleware()
+    inner = metrics.HandlerMetricsMiddleware()
+    data = {"handler": _Handler(), "raw_state": "SearchStates:WAITING_QUERY"}
+
+    async def event_chain(event, data):
+        return await inner(_noop, event, data)
+
+    started = time.perf_counter()
+    for _ in range(n):
+        await outer(event_chain, None, data)
+    return time.perf_counter() - started
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=200_000)
+    args = parser.parse_args()
+
+    await _instrumented(1000)  # прогрев
+    bare = await _bare(args.updates)
+    instrumented = await _instrumented(args.updates)
+    per_update = (instrumented - bare) / args.updates * 1e6
+    print(f"без метрик   {bare / args.updates * 1e6:6.2f} мкс/обновление")
+    print(f"с метриками  {instrumented / args.updates * 1e6:6.2f} мкс/обновление")
+    print(f"накладные    {per_update:6.2f} мкс/обновление")
+    print(f"размер /metrics: {len(metrics.render())} байт")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,180 @@
+"""Замер подготовленных запросов: разбор и планирование на каждый вызов
+против кэша asyncpg и реестра statements.py, плюс динамический текст
+«LIKE $1 OR LIKE $2 ...» против одного параметра-массива.
+
+Запуск из корня проекта:
+    python -m benchmarks.prepared_statements --topics 20000 --runs 500
+
+Показывает время вызова с клиента и «Planning Time» сервера из
+EXPLAIN (ANALYZE) для текстового запроса и для EXECUTE подготовленного.
+Данные создаются в отдельной схеме bench_prepared и удаляются в конце.
+"""
+import argparse
+import asyncio
+import json
+import random
+import statistics
+import time
+
+import asyncpg
+
+from config import POSTGRES_URI
+from database import Connection
+import statements
+
+SCHEMA = "bench_prepared"
+
+WORDS = [
+    "анализ", "разработка", "модель", "система", "нейросети", "данные",
+    "управление", "алгоритмы", "оптимизация", "методы", "изображения", "тексты",
+    "прогнозирование", "вычисления", "безопасность", "протоколы", "интерфейс",
+    "платформа", "приложение", "графы", "python", "базы", "сети", "робототехника",
+]
+
+# Карточка темы — типичный горячий запрос: соединения, один ключ
+CARD_SQL = """
+    SELECT t.title, t.keywords, t.status, COALESCE(te.name, 'Не назначен') AS teacher_name
+      FROM topics t
+      LEFT JOIN teachers te ON te.teacher_id = t.teacher_id
+     WHERE t.topic_id = $1
+"""
+# Поиск по ключевым словам: текст зависит от их числа
+KEYWORDS_DYNAMIC = """
+    SELECT t.topic_id, t.title FROM topics t
+     WHERE EXISTS (SELECT 1 FROM unnest(t.keywords) kw WHERE {conditions})
+     ORDER BY t.title LIMIT 50
+"""
+# Тот же поиск с одним параметром-массивом: один текст на любое число слов
+KEYWORDS_FIXED = """
+    SELECT t.topic_id, t.title FROM topics t
+     WHERE EXISTS (SELECT 1 FROM unnest(t.keywords) kw WHERE kw ILIKE ANY($1::text[]))
+     ORDER BY t.title LIMIT 50
+"""
+
+
+def _dynamic(patterns: list[str]) -> str:
+    conditions = " OR ".join(f"kw ILIKE ${i}" for i in range(1, len(patterns) + 1))
+    return KEYWORDS_DYNAMIC.format(conditions=conditions)
+
+
+async def _seed(conn, n_topics: int, rnd: random.Random):
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+    await conn.execute(f"SET search_path TO {SCHEMA}, public")
+    await conn.execute("CREATE TABLE teachers (teacher_id SERIAL PRIMARY KEY, name TEXT NOT NULL)")
+    await conn.execute("""
+        CREATE TABLE topics (topic_id SERIAL PRIMARY KEY, title TEXT NOT NULL,
+                             keywords TEXT[], status TEXT NOT NULL, teacher_id INT)
+    """)
+    await conn.copy_records_to_table(
+        "teachers", records=[(f"Преподаватель {i}",) for i in range(200)],
+        columns=["name"], schema_name=SCHEMA
+    )
+    topics = [
+        (" ".join(rnd.sample(WORDS, 4)).capitalize(), rnd.sample(WORDS, rnd.randint(2, 5)),
+         rnd.choice(("free", "free", "reserved", "closed")), rnd.randint(1, 200))
+        for _ in range(n_topics)
+    ]
+    await conn.copy_records_to_table(
+        "topics", records=topics, columns=["title", "keywords", "status", "teacher_id"],
+        schema_name=SCHEMA
+    )
+    await conn.execute("ANALYZE teachers; ANALYZE topics")
+
+
+async def _connect(**kwargs):
+    conn = await asyncpg.connect(POSTGRES_URI, connection_class=Connection, **kwargs)
+    await conn.execute(f"SET search_path TO {SCHEMA}, public")
+    return conn
+
+
+async def _measure(call, args_list) -> list[float]:
+    timings = []
+    for args in args_list:
+        start = time.perf_counter()
+        await call(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def _report(label: str, timings: list[float]):
+    timings = sorted(timings)
+    p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+    print(f"{label:<48} median {statistics.median(timings):7.3f} ms   p95 {p95:7.3f} ms")
+
+
+async def _planning_ms(conn, sql: str) -> float:
+    plan = json.loads(await conn.fetchval(f"EXPLAIN (ANALYZE, FORMAT JSON) {sql}"))
+    return plan[0]["Planning Time"]
+
+
+async def _report_planning(conn, ids: list[int]):
+    """Planning Time сервера: текст запроса каждый раз против EXECUTE подготовленного."""
+    text = CARD_SQL.replace("$1", "{}")
+    await conn.execute(f"PREPARE bench_card(int) AS {CARD_SQL}")
+    try:
+        adhoc = [await _planning_ms(conn, text.format(i)) for i in ids]
+        prepared = [await _planning_ms(conn, f"EXECUTE bench_card({i})") for i in ids]
+    finally:
+        await conn.execute("DEALLOCATE bench_card")
+    print("\nPlanning Time сервера, карточка темы:")
+    _report("  текст запроса", adhoc)
+    # Первые пять EXECUTE планируются заново, дальше — общий план из кэша
+    _report("  EXECUTE подготовленного", prepared[5:] or prepared)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--topics", type=int, default=20000)
+    parser.add_argument("--runs", type=int, default=500)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    setup = await _connect()
+    try:
+        await _seed(setup, args.topics, rnd)
+        ids = [rnd.randint(1, args.topics) for _ in range(args.runs)]
+        keyword_sets = [
+            [f"%{w}%" for w in rnd.sample(WORDS, rnd.randint(1, 6))] for _ in range(args.runs)
+        ]
+        # Реестр в процессе бенчмарка свой: имена не пересекаются с ботом
+        card = statements.register("bench.card", CARD_SQL)
+        keywords = statements.register("bench.keywords", KEYWORDS_FIXED)
+
+        print(f"Темы: {args.topics}, вызовов на замер: {args.runs}, "
+              f"разных текстов динамического поиска: {len({len(k) for k in keyword_sets})}\n")
+
+        # statement_cache_size=0: каждый вызов заново разбирается и планируется
+        adhoc = await _connect(statement_cache_size=0)
+        cached = await _connect()
+        registry = await _connect()
+        try:
+            for conn in (adhoc, cached, registry):
+                await conn.fetch(CARD_SQL, 1)  # прогрев соединения
+
+            print("Карточка темы:")
+            _report("  без подготовки", await _measure(lambda i: adhoc.fetch(CARD_SQL, i), [(i,) for i in ids]))
+            _report("  кэш asyncpg", await _measure(lambda i: cached.fetch(CARD_SQL, i), [(i,) for i in ids]))
+            _report("  реестр statements", await _measure(lambda i: card.fetch(registry, i), [(i,) for i in ids]))
+
+            print("\nПоиск по ключевым словам:")
+            _report("  LIKE $1 OR $2 ..., без подготовки",
+                    await _measure(lambda k: adhoc.fetch(_dynamic(k), *k), [(k,) for k in keyword_sets]))
+            _report("  LIKE $1 OR $2 ..., кэш asyncpg",
+                    await _measure(lambda k: cached.fetch(_dynamic(k), *k), [(k,) for k in keyword_sets]))
+            _report("  LIKE ANY($1), без подготовки",
+                    await _measure(lambda k: adhoc.fetch(KEYWORDS_FIXED, k), [(k,) for k in keyword_sets]))
+            _report("  LIKE ANY($1), реестр statements",
+                    await _measure(lambda k: keywords.fetch(registry, k), [(k,) for k in keyword_sets]))
+
+            await _report_planning(adhoc, ids[:min(len(ids), 100)])
+        finally:
+            for conn in (adhoc, cached, registry):
+                await conn.close()
+    finally:
+        await setup.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await setup.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,159 @@
+"""Гонка за одну тему: сотни студентов одновременно закрепляют её через
+reservations.claim().
+
+Каждый раунд тема освобождается, и все студенты разом отправляют заявку.
+Проверяется, что победитель ровно один, в Topics записан именно он, в
+Interactions — ровно одна запись, а все проигравшие получили 'taken' с его
+именем. Печатаются задержки заявок и пропускная способность.
+
+С --legacy те же раунды идут по старой схеме из main.py (проверка, UPDATE,
+запись в журнал — три обращения к БД) для сравнения.
+
+Запуск из корня проекта на базе с накатанными миграциями:
+    python -m benchmarks.reservation_race --students 300 --rounds 20
+    python -m benchmarks.reservation_race --students 300 --rounds 20 --legacy
+
+Тестовые студенты и тема создаются в рабочих таблицах и удаляются в конце.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import asyncpg
+
+from database import acquire, init_pool, close_pool
+import migrations
+import reservations
+
+PREFIX = "bench-race"
+TITLE = f"{PREFIX} topic"
+
+
+async def _seed(n_students: int) -> tuple[list[int], int]:
+    async with acquire() as conn:
+        await migrations.migrate(conn)
+        students = await conn.fetch(
+            """
+            INSERT INTO Students(name, telegram_id)
+            SELECT 'Студент ' || i, $1 || '-' || i FROM generate_series(1, $2) i
+            RETURNING student_id
+            """,
+            PREFIX, n_students
+        )
+        topic_id = await conn.fetchval(
+            "INSERT INTO Topics(title, status) VALUES($1, 'free') RETURNING topic_id", TITLE
+        )
+    return [r['student_id'] for r in students], topic_id
+
+
+async def _cleanup():
+    async with acquire() as conn:
+        await conn.execute(
+            "DELETE FROM Interactions WHERE topic_id IN (SELECT topic_id FROM Topics WHERE title = $1)",
+            TITLE
+        )
+        await conn.execute("DELETE FROM Topics WHERE title = $1", TITLE)
+        await conn.execute("DELETE FROM Students WHERE telegram_id LIKE $1", f"{PREFIX}-%")
+
+
+async def _reset(topic_id: int):
+    async with acquire() as conn:
+        await conn.execute(
+            "UPDATE Topics SET status = 'free', student_id = NULL WHERE topic_id = $1", topic_id
+        )
+        await conn.execute("DELETE FROM Interactions WHERE topic_id = $1", topic_id)
+
+
+async def _claim_legacy(student_id: int) -> str:
+    # Прежний process_reserve_title: три обращения, журнал отдельно
+    async with acquire() as conn:
+        existing = await conn.fetchval("SELECT COUNT(*) FROM Topics WHERE student_id=$1", student_id)
+        if existing:
+            return 'has_topic'
+        try:
+            updated = await conn.fetchrow(
+                """
+                UPDATE Topics SET status='reserved', student_id=$1
+                 WHERE title=$2 AND status='free'
+                RETURNING topic_id
+                """,
+                student_id, TITLE
+            )
+        except asyncpg.UniqueViolationError:
+            return 'has_topic'
+        if updated is None:
+            return 'taken'
+        await conn.execute(
+            "INSERT INTO Interactions(student_id, topic_id, user_role, action) "
+            "VALUES($1, $2, 'student', 'reserved')",
+            student_id, updated['topic_id']
+        )
+    return 'claimed'
+
+
+async def _name(student_id: int) -> str:
+    async with acquire() as conn:
+        return await conn.fetchval("SELECT name FROM Students WHERE student_id = $1", student_id)
+
+
+async def _timed(coro) -> tuple[object, float]:
+    started = time.perf_counter()
+    result = await coro
+    return result, time.perf_counter() - started
+
+
+async def _round(students: list[int], topic_id: int, legacy: bool) -> list[float]:
+    await _reset(topic_id)
+    if legacy:
+        calls = [_claim_legacy(s) for s in students]
+    else:
+        calls = [reservations.claim(s, title=TITLE) for s in students]
+    results = await asyncio.gather(*(_timed(c) for c in calls))
+
+    outcomes = [r if legacy else r.outcome for r, _ in results]
+    winners = [s for s, o in zip(students, outcomes) if o == 'claimed']
+    assert len(winners) == 1, f"победителей {len(winners)}"
+    async with acquire() as conn:
+        holder = await conn.fetchval("SELECT student_id FROM Topics WHERE topic_id = $1", topic_id)
+        logged = await conn.fetchval("SELECT count(*) FROM Interactions WHERE topic_id = $1", topic_id)
+    assert holder == winners[0], f"в Topics {holder}, победил {winners[0]}"
+    assert logged == 1, f"записей в журнале {logged}"
+    if not legacy:
+        winner_name = await _name(holder)
+        for r, _ in results:
+            assert r.outcome == 'claimed' or (r.outcome == 'taken' and r.holder_id == holder), r
+            assert r.outcome == 'claimed' or r.holder_name == winner_name, r
+    return [t for _, t in results]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--students", type=int, default=300, help="заявок в раунде")
+    parser.add_argument("--rounds", type=int, default=20)
+    parser.add_argument("--legacy", action="store_true", help="старая схема из трёх запросов")
+    args = parser.parse_args()
+
+    await init_pool()
+    try:
+        await _cleanup()
+        students, topic_id = await _seed(args.students)
+        timings = []
+        started = time.perf_counter()
+        for _ in range(args.rounds):
+            timings += await _round(students, topic_id, args.legacy)
+        elapsed = time.perf_counter() - started
+
+        ms = sorted(t * 1000 for t in timings)
+        q = statistics.quantiles(ms, n=100)
+        name = "legacy" if args.legacy else "claim"
+        print(f"{name}: раундов {args.rounds} по {args.students} заявок, в каждом ровно один победитель")
+        print(f"p50={q[49]:7.1f} мс  p95={q[94]:7.1f} мс  p99={q[98]:7.1f} мс  "
+              f"max={ms[-1]:7.1f} мс  {len(ms) / elapsed:7.1f} заявок/с")
+    finally:
+        await _cleanup()
+        await close_pool()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
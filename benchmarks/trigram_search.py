@@ -0,0 +1,139 @@
+"""Замер поиска по названию темы и фамилии преподавателя: ILIKE '%...%' без
+индекса против триграммных GIN-индексов pg_trgm (подстрока и опечатки).
+
+Запуск из корня проекта:
+    python -m benchmarks.trigram_search --topics 50000 --teachers 2000 --runs 50
+
+Данные создаются в отдельной схеме bench_trgm и удаляются в конце.
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import asyncpg
+
+from config import POSTGRES_URI
+
+SCHEMA = "bench_trgm"
+
+SYLLABLES = [
+    "ма", "ло", "ви", "ра", "кон", "тре", "ни", "ков", "сер", "гей", "ев",
+    "ан", "дре", "пет", "ро", "ва", "ли", "ки", "на", "ми", "хай", "лов",
+]
+WORDS = [
+    "анализ", "разработка", "модель", "система", "нейронных", "сетей", "данных",
+    "управления", "алгоритмы", "оптимизация", "исследование", "методы", "обработки",
+    "изображений", "текстов", "прогнозирования", "распределённых", "вычислений",
+    "безопасности", "протоколов", "интерфейса", "платформы", "мобильного", "приложения",
+]
+
+TITLE_PLAIN = "SELECT topic_id FROM topics WHERE title ILIKE $1 LIMIT 50"
+TITLE_TRGM = """
+    SELECT topic_id FROM topics
+     WHERE title ILIKE $1 OR $2 <% title
+     ORDER BY title ILIKE $1 DESC, word_similarity($2, title) DESC
+     LIMIT 50
+"""
+TEACHER_PLAIN = "SELECT teacher_id FROM teachers WHERE name ILIKE $1 LIMIT 50"
+TEACHER_TRGM = """
+    SELECT teacher_id FROM teachers
+     WHERE name ILIKE $1 OR $2 <% name
+     ORDER BY name ILIKE $1 DESC, word_similarity($2, name) DESC
+     LIMIT 50
+"""
+
+
+def _surname(rnd: random.Random) -> str:
+    return "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4))).capitalize() + "ов"
+
+
+def _title(rnd: random.Random) -> str:
+    return " ".join(rnd.choice(WORDS) for _ in range(rnd.randint(3, 7))).capitalize()
+
+
+def _typo(word: str, rnd: random.Random) -> str:
+    if len(word) < 4:
+        return word
+    i = rnd.randrange(1, len(word) - 1)
+    return word[:i] + word[i + 1:]
+
+
+async def _seed(conn, n_topics: int, n_teachers: int, rnd: random.Random):
+    await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE; CREATE SCHEMA {SCHEMA}")
+    await conn.execute(f"SET search_path TO {SCHEMA}, public")
+    await conn.execute("CREATE TABLE teachers (teacher_id SERIAL PRIMARY KEY, name TEXT NOT NULL)")
+    await conn.execute("CREATE TABLE topics (topic_id SERIAL PRIMARY KEY, title TEXT NOT NULL, teacher_id INT)")
+    teachers = [(f"{_surname(rnd)} {rnd.choice('АБВГДЕИКЛМНОПРС')}.",) for _ in range(n_teachers)]
+    await conn.copy_records_to_table("teachers", records=teachers, columns=["name"], schema_name=SCHEMA)
+    topics = [(_title(rnd), rnd.randint(1, n_teachers)) for _ in range(n_topics)]
+    await conn.copy_records_to_table("topics", records=topics, columns=["title", "teacher_id"], schema_name=SCHEMA)
+    await conn.execute("ANALYZE teachers; ANALYZE topics")
+    return [t[0] for t in teachers], [t[0] for t in topics]
+
+
+async def _measure(conn, sql: str, args_list) -> list[float]:
+    timings = []
+    for args in args_list:
+        start = time.perf_counter()
+        await conn.fetch(sql, *args)
+        timings.append((time.perf_counter() - start) * 1000)
+    return timings
+
+
+def _report(label: str, timings: list[float]):
+    timings = sorted(timings)
+    p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+    print(f"{label:<44} median {statistics.median(timings):8.2f} ms   p95 {p95:8.2f} ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--topics", type=int, default=50000)
+    parser.add_argument("--teachers", type=int, default=2000)
+    parser.add_argument("--runs", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    conn = await asyncpg.connect(POSTGRES_URI)
+    try:
+        await conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+        teachers, titles = await _seed(conn, args.topics, args.teachers, rnd)
+
+        # Запросы — куски реальных значений, как их набирают пользователи
+        title_terms = [rnd.choice(rnd.choice(titles).split()).lower() for _ in range(args.runs)]
+        teacher_terms = [rnd.choice(teachers).split()[0][:6].lower() for _ in range(args.runs)]
+        title_typos = [_typo(t, rnd) for t in title_terms]
+        teacher_typos = [_typo(t, rnd) for t in teacher_terms]
+
+        print(f"Темы: {args.topics}, преподаватели: {args.teachers}, запросов на замер: {args.runs}\n")
+        _report("название, ILIKE без индекса",
+                await _measure(conn, TITLE_PLAIN, [(f"%{t}%",) for t in title_terms]))
+        _report("преподаватель, ILIKE без индекса",
+                await _measure(conn, TEACHER_PLAIN, [(f"%{t}%",) for t in teacher_terms]))
+
+        await conn.execute("CREATE INDEX ON topics USING GIN (title gin_trgm_ops)")
+        await conn.execute("CREATE INDEX ON teachers USING GIN (name gin_trgm_ops)")
+        await conn.execute("ANALYZE teachers; ANALYZE topics")
+
+        _report("название, ILIKE + триграммный индекс",
+                await _measure(conn, TITLE_PLAIN, [(f"%{t}%",) for t in title_terms]))
+        _report("название, подстрока или сходство",
+                await _measure(conn, TITLE_TRGM, [(f"%{t}%", t) for t in title_terms]))
+        _report("название с опечаткой, сходство",
+                await _measure(conn, TITLE_TRGM, [(f"%{t}%", t) for t in title_typos]))
+        _report("преподаватель, ILIKE + триграммный индекс",
+                await _measure(conn, TEACHER_PLAIN, [(f"%{t}%",) for t in teacher_terms]))
+        _report("преподаватель, подстрока или сходство",
+                await _measure(conn, TEACHER_TRGM, [(f"%{t}%", t) for t in teacher_terms]))
+        _report("преподаватель с опечаткой, сходство",
+                await _measure(conn, TEACHER_TRGM, [(f"%{t}%", t) for t in teacher_typos]))
+    finally:
+        await conn.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await conn.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,152 @@
+"""Задержка от появления обновления до ответа бота: long polling против webhook.
+
+Бот с эхо-хэндлером работает против поддельного Bot API (fake_bot_api.py).
+Для polling обновления кладутся в очередь getUpdates, для webhook —
+отправляются POST-запросом на webhook.create_app() с секретным токеном.
+Задержка — от момента появления обновления до прихода sendMessage с ответом.
+
+Запуск из корня проекта:
+    python -m benchmarks.webhook_latency --updates 2000 --users 200 --rate 200 --api-latency 0.03
+
+--api-latency имитирует сетевую задержку до api.telegram.org: при polling её
+проходит и getUpdates, и ответ, при webhook — только ответ.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import aiohttp
+from aiohttp import web
+from aiogram import Dispatcher
+from aiogram.types import Message
+
+import webhook
+from benchmarks.fake_bot_api import FakeBotAPI
+
+SECRET = "bench-secret"
+
+
+def _make_dispatcher() -> Dispatcher:
+    dp = Dispatcher()
+
+    @dp.message()
+    async def echo(message: Message):
+        await message.answer(message.text)
+
+    return dp
+
+
+class _Tracker:
+    def __init__(self, expected: int):
+        self.expected = expected
+        self.sent_at: dict[str, float] = {}
+        self.latencies: list[float] = []
+        self.done = asyncio.Event()
+
+    def on_call(self, method: str, params: dict):
+        if method != "sendMessage":
+            return
+        started = self.sent_at.pop(params.get("text"), None)
+        if started is not None:
+            self.latencies.append(time.perf_counter() - started)
+            if len(self.latencies) >= self.expected:
+                self.done.set()
+
+
+async def _drive(tracker: _Tracker, api: FakeBotAPI, args, deliver):
+    interval = 1 / args.rate
+    started = time.perf_counter()
+    pending = []
+    for i in range(args.updates):
+        text = f"ping {i}"
+        update = api.message_update(1000 + i % args.users, text)
+        tracker.sent_at[text] = time.perf_counter()
+        pending.append(asyncio.create_task(deliver(update)))
+        # Равномерный поток обновлений с заданной частотой
+        delay = started + (i + 1) * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+    await asyncio.gather(*pending)
+    await asyncio.wait_for(tracker.done.wait(), timeout=60)
+    return time.perf_counter() - started
+
+
+async def bench_polling(args) -> tuple[list[float], float]:
+    api = FakeBotAPI(latency=args.api_latency)
+    await api.start()
+    tracker = _Tracker(args.updates)
+    api.on_call = tracker.on_call
+    bot = api.make_bot()
+    dp = _make_dispatcher()
+    polling = asyncio.create_task(dp.start_polling(bot, handle_signals=False, polling_timeout=10))
+
+    async def deliver(update):
+        api.push_update(update)
+
+    try:
+        elapsed = await _drive(tracker, api, args, deliver)
+    finally:
+        await dp.stop_polling()
+        await asyncio.gather(polling, return_exceptions=True)
+        await api.stop()
+    return tracker.latencies, elapsed
+
+
+async def bench_webhook(args) -> tuple[list[float], float]:
+    api = FakeBotAPI(latency=args.api_latency)
+    await api.start()
+    tracker = _Tracker(args.updates)
+    api.on_call = tracker.on_call
+    bot = api.make_bot()
+    dp = _make_dispatcher()
+
+    queue = webhook.UpdateQueue(bot, dp, workers=args.workers, size=args.updates)
+    queue.start()
+    runner = web.AppRunner(webhook.create_app(bot, queue, path="/webhook", secret=SECRET))
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    url = f"http://127.0.0.1:{site._server.sockets[0].getsockname()[1]}/webhook"
+
+    # Telegram держит до max_connections соединений к webhook
+    limit = aiohttp.TCPConnector(limit=40)
+    async with aiohttp.ClientSession(connector=limit) as http:
+        async def deliver(update):
+            async with http.post(url, json=update,
+                                 headers={webhook.SECRET_HEADER: SECRET}) as resp:
+                assert resp.status == 200, resp.status
+
+        try:
+            elapsed = await _drive(tracker, api, args, deliver)
+        finally:
+            await runner.cleanup()
+            await queue.stop()
+            await bot.session.close()
+            await api.stop()
+    return tracker.latencies, elapsed
+
+
+def _report(name: str, latencies: list[float], elapsed: float):
+    ms = sorted(x * 1000 for x in latencies)
+    q = statistics.quantiles(ms, n=100)
+    print(f"{name:<8} n={len(ms):<6} p50={q[49]:7.1f} мс  p95={q[94]:7.1f} мс  "
+          f"p99={q[98]:7.1f} мс  max={ms[-1]:7.1f} мс  {len(ms) / elapsed:7.1f} обн./с")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--rate", type=float, default=200, help="обновлений в секунду")
+    parser.add_argument("--workers", type=int, default=16, help="обработчиков webhook")
+    parser.add_argument("--api-latency", type=float, default=0.03,
+                        help="задержка ответа поддельного Bot API, с")
+    args = parser.parse_args()
+
+    _report("polling", *await bench_polling(args))
+    _report("webhook", *await bench_webhook(args))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -1,31 +1,133 @@
 # bot.py
+import startup  # первым: от него отсчитывается время запуска
+
+import argparse
 import asyncio
-from aiogram import Bot, Dispatcher
-from config import API_TOKEN
-import keyboards
+import multiprocessing
 
-# Импортируем ваши пакеты-обработчики
-from handlers import registration, topics, search, misc, analytics, categories, choose_topic
+with startup.phase("import aiogram"):
+    from aiogram import Bot, Dispatcher
 
-async def main():
-    # Инициализируем бота и диспетчера
-    bot = Bot(token=API_TOKEN)
-    dp = Dispatcher()
+with startup.phase("import config"):
+    from config import API_TOKEN, BOT_MODE
+
+# Тяжёлые зависимости сюда не попадают: matplotlib импортируется только
+# в процессах построения графиков (charts.py) при первом графике
+database = startup.import_module("database")
+broadcaster = startup.import_module("broadcaster")
+eventlog = startup.import_module("eventlog")
+keyword_index = startup.import_module("keyword_index")
+refdata = startup.import_module("refdata")
+charts = startup.import_module("charts")
+keyboards = startup.import_module("keyboards")
+fsm_storage = startup.import_module("fsm_storage")
+identity = startup.import_module("identity")
+metrics = startup.import_module("metrics")
+querytrace = startup.import_module("querytrace")
+
+# Пакеты-обработчики. Порядок важен: хэндлеры регистрируются в нём же.
+# Модули перечислены строками — при сборке PyInstaller их нужно указать
+# в hiddenimports (см. bot.spec).
+HANDLER_MODULES = (
+    "handlers.registration",
+    "handlers.topics",
+    "handlers.search",
+    "handlers.categories",
+    "handlers.misc",
+    "handlers.analytics",
+    "handlers.choose_topic",
+    "handlers.pagination",
+    "handlers.broadcast",
+    "handlers.imports",
+)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Telegram-бот выбора тем НИР")
+    parser.add_argument(
+        "--startup-profile", action="store_true",
+        help="напечатать время импорта и инициализации по модулям"
+    )
+    return parser.parse_args()
 
-    # При желании можно настроить middleware, фильтры и т.п.
+
+def create_dispatcher() -> Dispatcher:
+    """Диспетчер со всеми middleware и хэндлерами бота (его же берёт benchmarks/load.py)."""
+    # Состояния диалогов хранятся в БД — несколько процессов бота
+    # обслуживают одних и тех же пользователей
+    dp = Dispatcher(storage=fsm_storage.make_storage())
+
+    startup.setup(dp)
+    # Запросы к БД за обновление: медленные, повторяющиеся (N+1), сверх бюджета
+    querytrace.setup(dp)
     keyboards.setup(dp)
 
     # Регистрируем хэндлеры из модулей
-    registration.register_handlers(dp)
-    topics.register_handlers(dp)
-    search.register_handlers(dp)
-    categories.register_handlers(dp)
-    misc.register_handlers(dp)
-    analytics.register_handlers(dp)
-    choose_topic.register_handlers(dp)
+    for name in HANDLER_MODULES:
+        module = startup.import_module(name)
+        with startup.phase(f"register {name}"):
+            module.register_handlers(dp)
+    return dp
+
+
+async def main():
+    # Инициализируем бота и диспетчера
+    bot = Bot(token=API_TOKEN)
+    dp = create_dispatcher()
+    # Время, хэндлер и исход каждого обновления — на METRICS_PORT/metrics
+    metrics.setup(dp, bot)
+
+    # Общий пул соединений с БД живёт всё время работы бота
+    with startup.phase("database.init_pool"):
+        await database.init_pool(connection_class=querytrace.TracedConnection)
+    try:
+        with startup.phase("database.init_db"):
+            await database.init_db()
+        # Индекс ключевых слов для поиска строится один раз и дальше обновляется
+        # хэндлерами и по NOTIFY от других процессов
+        with startup.phase("keyword_index.build"):
+            await keyword_index.build()
+        # Кафедры и категории с готовыми клавиатурами; дальше обновляются по NOTIFY
+        with startup.phase("refdata.load"):
+            await refdata.load()
+        # Изменения тем и пользователей из других процессов бота
+        refdata.subscribe('topic', keyword_index.topic_changed)
+        refdata.subscribe('user', identity.user_changed)
+        refdata.subscribe('student', identity.student_changed)
+        refdata.start()
+        # Журналы пишутся в фоне пачками, хэндлеры только ставят события в очередь
+        await eventlog.start()
+        # Брошенные диалоги периодически удаляются из FsmStates
+        fsm_storage.start()
+        # Графики аналитики строятся в отдельных процессах; сами процессы
+        # запускаются при первом графике
+        charts.start()
+        await metrics.start()
+        # Рассылки, прерванные прошлой остановкой, продолжаются с неотправленных
+        await broadcaster.resume(bot)
 
-    # Стартуем лонг-поллинг
-    await dp.start_polling(bot)
+        # Стартуем лонг-поллинг или webhook-сервер
+        try:
+            if BOT_MODE == 'webhook':
+                webhook = startup.import_module("webhook")
+                await webhook.run(bot, dp)
+            else:
+                # После работы в режиме webhook getUpdates вернёт Conflict, пока он не снят
+                await bot.delete_webhook()
+                await dp.start_polling(bot)
+        finally:
+            await broadcaster.stop()
+            charts.stop()
+            await eventlog.stop()
+            await fsm_storage.stop()
+            await refdata.stop()
+            await metrics.stop()
+    finally:
+        await database.close_pool()
 
 if __name__ == '__main__':
+    # Нужно для процессов charts.py в сборке PyInstaller
+    multiprocessing.freeze_support()
+    if parse_args().startup_profile:
+        startup.enable()
     asyncio.run(main())
@@ -6,11 +6,39 @@ a = Analysis(
     pathex=[],
     binaries=[],
     datas=[],
-    hiddenimports=[],
+    # bot.py импортирует хэндлеры по именам из HANDLER_MODULES, webhook — по BOT_MODE
+    hiddenimports=[
+        'handlers.registration',
+        'handlers.topics',
+        'handlers.search',
+        'handlers.categories',
+        'handlers.misc',
+        'handlers.analytics',
+        'handlers.choose_topic',
+        'handlers.pagination',
+        'handlers.broadcast',
+        'handlers.imports',
+        'webhook',
+        'fsm_storage',
+        'metrics',
+        'querytrace',
+        'matplotlib.backends.backend_agg',
+    ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    # pyplot и GUI-бэкенды не используются (графики строит Agg в charts.py);
+    # чем меньше архив one-file, тем быстрее он распаковывается при запуске
+    excludes=[
+        'tkinter',
+        'matplotlib.pyplot',
+        'matplotlib.backends.backend_tkagg',
+        'matplotlib.backends.backend_qtagg',
+        'matplotlib.backends.backend_qt5agg',
+        'matplotlib.backends.backend_gtk3agg',
+        'matplotlib.backends.backend_wxagg',
+        'IPython',
+    ],
     noarchive=False,
     optimize=0,
 )
@@ -0,0 +1,494 @@
+# broadcaster.py
+"""Массовые рассылки с соблюдением лимитов Telegram.
+
+Рассылка создаётся одной транзакцией: запись в Broadcasts и список
+получателей из запроса аудитории в BroadcastRecipients. Дальше её отправляет
+фоновая задача: общее ведро токенов ограничивает скорость бота, отдельный
+интервал — скорость в один чат, на RetryAfter ведро ставится на паузу.
+Статусы получателей пишутся в БД пачками, поэтому после перезапуска бота
+resume() продолжает с неотправленных. Сообщения, отправленные в последние
+секунды перед падением, могут уйти повторно.
+
+Рассылку отправляет один процесс бота — тот, за кем она записана (owner).
+Он продлевает аренду (lease_until) каждые BROADCAST_LEASE / 3 секунд и
+снимает её при остановке; рассылки без владельца или с истёкшей арендой
+resume() забирает одним UPDATE, так что при нескольких процессах каждая
+рассылка идёт ровно в одном.
+"""
+import asyncio
+import logging
+import os
+import secrets
+import socket
+import time
+from dataclasses import dataclass, field
+
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramNetworkError,
+    TelegramRetryAfter,
+    TelegramServerError,
+)
+
+from config import (
+    BROADCAST_RATE,
+    BROADCAST_PER_CHAT_INTERVAL,
+    BROADCAST_CONCURRENCY,
+    BROADCAST_MAX_ATTEMPTS,
+    BROADCAST_PROGRESS_INTERVAL,
+    BROADCAST_LEASE,
+)
+from database import acquire
+
+logger = logging.getLogger(__name__)
+
+_NUMERIC_TG = "telegram_id ~ '^[0-9]+$'"
+
+# Этот процесс как владелец рассылок в Broadcasts.owner
+OWNER = f"{socket.gethostname()}:{os.getpid()}:{secrets.token_hex(3)}"
+
+# Аудитории: название -> (подпись, запрос chat_id). $1 — параметр аудитории:
+# department_id для 'department', название группы для 'group'
+AUDIENCES = {
+    'students_without_topic': (
+        "👤 Студенты без темы",
+        f"""
+        SELECT s.telegram_id::bigint AS chat_id FROM Students s
+         WHERE s.{_NUMERIC_TG}
+           AND NOT EXISTS (SELECT 1 FROM Topics t WHERE t.student_id = s.student_id)
+        """,
+    ),
+    'students_reserved': (
+        "🟡 Студенты с неодобренной темой",
+        f"""
+        SELECT DISTINCT s.telegram_id::bigint AS chat_id FROM Students s
+          JOIN Topics t ON t.student_id = s.student_id AND t.status = 'reserved'
+         WHERE s.{_NUMERIC_TG}
+        """,
+    ),
+    'all_students': (
+        "🎓 Все студенты",
+        f"SELECT telegram_id::bigint AS chat_id FROM Students WHERE {_NUMERIC_TG}",
+    ),
+    'department': (
+        "🏛 Студенты кафедры",
+        f"SELECT telegram_id::bigint AS chat_id FROM Students WHERE department_id = $1 AND {_NUMERIC_TG}",
+    ),
+    'group': (
+        "👥 Студенты группы",
+        f"SELECT telegram_id::bigint AS chat_id FROM Students WHERE group_name = $1 AND {_NUMERIC_TG}",
+    ),
+    'teachers': (
+        "👨🏫 Преподаватели",
+        f"SELECT telegram_id::bigint AS chat_id FROM Teachers WHERE {_NUMERIC_TG}",
+    ),
+}
+
+
+class TokenBucket:
+    """Не больше rate событий в секунду в среднем, всплеск до capacity."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """Останавливает выдачу токенов (Telegram ответил RetryAfter)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+# Лимиты общие для всех рассылок: Telegram считает их на бота, а не на рассылку
+_bucket: TokenBucket | None = None
+# chat_id -> момент, раньше которого в этот чат писать нельзя
+_chat_next: dict[int, float] = {}
+
+
+def _global_bucket() -> TokenBucket:
+    global _bucket
+    if _bucket is None:
+        _bucket = TokenBucket(BROADCAST_RATE)
+    return _bucket
+
+
+async def _wait_chat(chat_id: int):
+    now = time.monotonic()
+    wait = _chat_next.get(chat_id, 0) - now
+    if wait > 0:
+        await asyncio.sleep(wait)
+        now = time.monotonic()
+    _chat_next[chat_id] = now + BROADCAST_PER_CHAT_INTERVAL
+    if len(_chat_next) > 10000:
+        for key in [k for k, t in _chat_next.items() if t <= now]:
+            del _chat_next[key]
+
+
+async def send_limited(bot: Bot, chat_id: int, text: str, **kwargs):
+    """Одно сообщение в пределах лимитов. Исключения Telegram пробрасываются."""
+    await _wait_chat(chat_id)
+    await _global_bucket().acquire()
+    return await bot.send_message(chat_id, text, **kwargs)
+
+
+@dataclass
+class Progress:
+    broadcast_id: int
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    retry_after: int = 0
+    # Сколько было обработано до этого запуска (рассылка продолжена после перезапуска)
+    resumed_from: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def done(self) -> int:
+        return self.sent + self.failed
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return (self.done - self.resumed_from) / elapsed if elapsed > 0 else 0.0
+
+    def report(self, final: bool = False) -> str:
+        head = "✅ Рассылка завершена" if final else "📣 Рассылка идёт"
+        lines = [
+            f"{head} (#{self.broadcast_id})",
+            f"Отправлено: {self.sent} из {self.total}",
+            f"Не доставлено: {self.failed}",
+        ]
+        if final:
+            lines.append(f"Время: {time.monotonic() - self.started:.1f} с, "
+                         f"скорость: {self.rate():.1f} сообщ./с")
+            lines.append(f"Пауз по RetryAfter: {self.retry_after}")
+        return "\n".join(lines)
+
+
+# broadcast_id -> задача отправки
+_tasks: dict[int, asyncio.Task] = {}
+_progress: dict[int, Progress] = {}
+# Периодически забирает рассылки упавших процессов (см. resume)
+_claimer: asyncio.Task | None = None
+
+
+async def audience_size(audience: str, param=None) -> int:
+    _, sql = AUDIENCES[audience]
+    args = [param] if '$1' in sql else []
+    async with acquire() as conn:
+        return await conn.fetchval(f"SELECT count(*) FROM ({sql}) a", *args)
+
+
+async def create(audience: str, text: str, created_by: int, param=None) -> tuple[int, int]:
+    """Создаёт рассылку и фиксирует получателей. Возвращает (broadcast_id, число получателей)."""
+    _, sql = AUDIENCES[audience]
+    args = [param] if '$1' in sql else []
+    label = audience if param is None else f"{audience}:{param}"
+    async with acquire() as conn, conn.transaction():
+        # Рассылку отправит создавший её процесс (start() сразу после create())
+        broadcast_id = await conn.fetchval(
+            """
+            INSERT INTO Broadcasts(audience, text, created_by, owner, lease_until)
+            VALUES($1, $2, $3, $4, now() + $5 * interval '1 second')
+            RETURNING broadcast_id
+            """,
+            label, text, created_by, OWNER, BROADCAST_LEASE
+        )
+        # Параметр аудитории сдвигается на $2: $1 — broadcast_id
+        total = await conn.fetchval(
+            f"""
+            WITH inserted AS (
+                INSERT INTO BroadcastRecipients(broadcast_id, chat_id)
+                SELECT DISTINCT $1::int, a.chat_id FROM ({sql.replace('$1', '$2')}) a
+                ON CONFLICT DO NOTHING
+                RETURNING 1
+            )
+            SELECT count(*) FROM inserted
+            """,
+            broadcast_id, *args
+        )
+    return broadcast_id, total
+
+
+def start(bot: Bot, broadcast_id: int) -> Progress:
+    """Запускает отправку в фоне (или возвращает прогресс уже идущей)."""
+    if broadcast_id not in _tasks:
+        _progress[broadcast_id] = Progress(broadcast_id)
+        task = asyncio.create_task(_run(bot, broadcast_id))
+        _tasks[broadcast_id] = task
+        task.add_done_callback(lambda _: _tasks.pop(broadcast_id, None))
+    return _progress[broadcast_id]
+
+
+def progress(broadcast_id: int) -> Progress | None:
+    return _progress.get(broadcast_id)
+
+
+async def cancel(broadcast_id: int):
+    async with acquire() as conn:
+        await conn.execute(
+            "UPDATE Broadcasts SET status='cancelled', finished_at=now() "
+            "WHERE broadcast_id=$1 AND status='running'",
+            broadcast_id
+        )
+    task = _tasks.get(broadcast_id)
+    if task is not None:
+        task.cancel()
+
+
+async def _claim(bot: Bot):
+    # Параллельный UPDATE другого процесса ждёт блокировки строки и
+    # перепроверяет условие, поэтому рассылку забирает только один
+    async with acquire() as conn:
+        rows = await conn.fetch(
+            """
+            UPDATE Broadcasts
+               SET owner = $1, lease_until = now() + $2 * interval '1 second'
+             WHERE status = 'running' AND (owner IS NULL OR lease_until < now())
+            RETURNING broadcast_id
+            """,
+            OWNER, BROADCAST_LEASE
+        )
+    for r in rows:
+        logger.info("Продолжаем рассылку #%s", r['broadcast_id'])
+        start(bot, r['broadcast_id'])
+
+
+async def _claim_loop(bot: Bot):
+    while True:
+        await asyncio.sleep(BROADCAST_LEASE)
+        try:
+            await _claim(bot)
+        except Exception:
+            logger.exception("Не удалось проверить брошенные рассылки")
+
+
+async def resume(bot: Bot):
+    """Продолжает рассылки, прерванные остановкой или падением процесса бота.
+
+    Вызывается при старте; дальше раз в BROADCAST_LEASE секунд забирает
+    рассылки процессов, которые перестали продлевать аренду.
+    """
+    global _claimer
+    await _claim(bot)
+    if _claimer is None:
+        _claimer = asyncio.create_task(_claim_loop(bot))
+
+
+async def _renew(broadcast_id: int) -> bool:
+    """Продлевает аренду; False — рассылку отменили или забрал другой процесс."""
+    async with acquire() as conn:
+        renewed = await conn.fetchval(
+            """
+            UPDATE Broadcasts SET lease_until = now() + $3 * interval '1 second'
+             WHERE broadcast_id = $1 AND owner = $2 AND status = 'running'
+            RETURNING true
+            """,
+            broadcast_id, OWNER, BROADCAST_LEASE
+        )
+    return bool(renewed)
+
+
+async def stop():
+    """Останавливает отправку при выключении бота; статус 'running' остаётся для resume().
+
+    Аренда снимается, чтобы рассылки сразу продолжил другой процесс.
+    """
+    global _claimer
+    if _claimer is not None:
+        _claimer.cancel()
+        await asyncio.gather(_claimer, return_exceptions=True)
+        _claimer = None
+    tasks = list(_tasks.values())
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    try:
+        async with acquire() as conn:
+            await conn.execute(
+                "UPDATE Broadcasts SET owner = NULL, lease_until = NULL "
+                "WHERE owner = $1 AND status = 'running'",
+                OWNER
+            )
+    except Exception:
+        # Не страшно: рассылки заберут после истечения аренды
+        logger.exception("Не удалось снять аренду рассылок")
+
+
+async def _deliver(bot: Bot, chat_id: int, text: str, p: Progress) -> tuple[str, str | None]:
+    error = None
+    for attempt in range(BROADCAST_MAX_ATTEMPTS):
+        try:
+            await send_limited(bot, chat_id, text)
+            return 'sent', None
+        except TelegramRetryAfter as e:
+            p.retry_after += 1
+            _global_bucket().pause(e.retry_after)
+            error = str(e)
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # Бот заблокирован или чат не существует — повтор не поможет
+            return 'failed', str(e)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            error = str(e)
+            await asyncio.sleep(min(2 ** attempt, 30))
+    return 'failed', error
+
+
+async def _save(broadcast_id: int, results: list[tuple[str, str | None, int]]):
+    async with acquire() as conn:
+        await conn.executemany(
+            """
+            UPDATE BroadcastRecipients
+               SET status = $1, error = $2, attempts = attempts + 1,
+                   sent_at = CASE WHEN $1 = 'sent' THEN now() END
+             WHERE broadcast_id = $3 AND chat_id = $4
+            """,
+            [(status, error, broadcast_id, chat_id) for status, error, chat_id in results]
+        )
+
+
+async def _report(bot: Bot, chat_id: int | None, message_id: int | None, text: str) -> int | None:
+    """Создаёт или обновляет сообщение с прогрессом у автора рассылки."""
+    if chat_id is None:
+        return None
+    try:
+        if message_id is None:
+            return (await send_limited(bot, chat_id, text)).message_id
+        await _global_bucket().acquire()
+        await bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+    except Exception as e:
+        logger.warning("Не удалось обновить прогресс рассылки: %s", e)
+    return message_id
+
+
+async def _run(bot: Bot, broadcast_id: int):
+    p = _progress[broadcast_id]
+    async with acquire() as conn:
+        b = await conn.fetchrow(
+            "SELECT text, created_by FROM Broadcasts WHERE broadcast_id=$1", broadcast_id
+        )
+        counts = await conn.fetchrow(
+            """
+            SELECT count(*) AS total,
+                   count(*) FILTER (WHERE status = 'sent') AS sent,
+                   count(*) FILTER (WHERE status = 'failed') AS failed
+              FROM BroadcastRecipients WHERE broadcast_id = $1
+            """,
+            broadcast_id
+        )
+    p.total, p.sent, p.failed = counts['total'], counts['sent'], counts['failed']
+    p.resumed_from = p.done
+
+    queue: asyncio.Queue = asyncio.Queue(maxsize=BROADCAST_CONCURRENCY * 2)
+    results: list[tuple[str, str | None, int]] = []
+
+    async def producer():
+        last = -1
+        while True:
+            async with acquire() as conn:
+                rows = await conn.fetch(
+                    """
+                    SELECT chat_id FROM BroadcastRecipients
+                     WHERE broadcast_id = $1 AND status = 'pending' AND chat_id > $2
+                     ORDER BY chat_id LIMIT 500
+                    """,
+                    broadcast_id, last
+                )
+            if not rows:
+                break
+            for r in rows:
+                await queue.put(r['chat_id'])
+            last = rows[-1]['chat_id']
+        for _ in range(BROADCAST_CONCURRENCY):
+            await queue.put(None)
+
+    async def worker():
+        while (chat_id := await queue.get()) is not None:
+            status, error = await _deliver(bot, chat_id, b['text'], p)
+            if status == 'sent':
+                p.sent += 1
+            else:
+                p.failed += 1
+            results.append((status, error, chat_id))
+
+    async def flush():
+        batch = results[:]
+        del results[:]
+        try:
+            await _save(broadcast_id, batch)
+        except BaseException:
+            # В том числе при отмене: пачка возвращается в очередь на запись,
+            # иначе эти получатели остались бы 'pending' и получили бы повтор
+            results[:0] = batch
+            raise
+
+    run_task = asyncio.current_task()
+
+    async def saver():
+        message_id = None
+        last_report = 0.0
+        last_renew = time.monotonic()
+        while True:
+            await asyncio.sleep(1)
+            if time.monotonic() - last_renew >= BROADCAST_LEASE / 3:
+                try:
+                    renewed = await _renew(broadcast_id)
+                except Exception:
+                    logger.exception("Рассылка #%s: не удалось продлить аренду", broadcast_id)
+                else:
+                    last_renew = time.monotonic()
+                    if not renewed:
+                        logger.warning("Рассылка #%s отменена или продолжена другим процессом", broadcast_id)
+                        run_task.cancel()
+                        return
+            if results:
+                try:
+                    await flush()
+                except Exception:
+                    # Например, нет свободного соединения: попробуем в следующий раз
+                    logger.exception("Рассылка #%s: не удалось сохранить статусы", broadcast_id)
+            if time.monotonic() - last_report >= BROADCAST_PROGRESS_INTERVAL:
+                message_id = await _report(bot, b['created_by'], message_id, p.report())
+                last_report = time.monotonic()
+
+    saver_task = asyncio.create_task(saver())
+    try:
+        await asyncio.gather(producer(), *(worker() for _ in range(BROADCAST_CONCURRENCY)))
+    finally:
+        saver_task.cancel()
+        await asyncio.gather(saver_task, return_exceptions=True)
+        # Сохраняем последние результаты и при отмене: иначе после перезапуска
+        # эти сообщения ушли бы повторно
+        if results:
+            try:
+                await asyncio.shield(flush())
+            except Exception:
+                logger.exception("Рассылка #%s: не сохранены статусы %s получателей",
+                                 broadcast_id, len(results))
+
+    async with acquire() as conn:
+        await conn.execute(
+            "UPDATE Broadcasts SET status='done', finished_at=now() "
+            "WHERE broadcast_id=$1 AND status='running'",
+            broadcast_id
+        )
+    logger.info("Рассылка #%s: %s", broadcast_id, p.report(final=True).replace("\n", "; "))
+    await _report(bot, b['created_by'], None, p.report(final=True))
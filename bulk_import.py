@@ -0,0 +1,294 @@
+# bulk_import.py
+"""Массовый импорт тем и списков групп из CSV/XLSX.
+
+Файл читается построчно: каждая строка проверяется теми же правилами, что и
+в диалогах бота (handlers/topics.py, handlers/registration.py), ошибки
+запоминаются с номером строки, а правильные строки сразу уходят через COPY
+во временную таблицу. Затем в той же транзакции один INSERT ... SELECT
+переносит их в Topics или Students. Уже имеющиеся в базе записи (тема с тем
+же названием, студент с тем же email или ФИО в той же группе) пропускаются,
+ошибка в одной строке не мешает загрузить остальные.
+
+Первая строка файла — заголовки столбцов (см. COLUMNS), порядок любой,
+лишние столбцы игнорируются. CSV — в UTF-8 или Windows-1251, с разделителем
+«,», «;» или табуляцией; XLSX читается, если установлен openpyxl.
+"""
+import csv
+import io
+import re
+from dataclasses import dataclass, field
+from typing import Iterator
+
+try:
+    import openpyxl
+except ImportError:
+    # Необязательная зависимость: без неё принимаются только CSV
+    openpyxl = None
+
+from config import IMPORT_MAX_ROWS
+from database import acquire
+from handlers.registration import validate_email, validate_group, validate_phone
+import keyword_index
+import refdata
+
+KINDS = ('topics', 'roster')
+
+# Вид импорта -> заголовок столбца (в нижнем регистре) -> поле
+COLUMNS = {
+    'topics': {
+        'название': 'title', 'тема': 'title', 'title': 'title',
+        'описание': 'description', 'description': 'description',
+        'ключевые слова': 'keywords', 'keywords': 'keywords',
+        'кафедра': 'department', 'department': 'department',
+    },
+    'roster': {
+        'фио': 'name', 'студент': 'name', 'name': 'name',
+        'группа': 'group', 'group': 'group',
+        'email': 'email', 'почта': 'email',
+        'телефон': 'phone', 'phone': 'phone',
+        'кафедра': 'department', 'department': 'department',
+    },
+}
+REQUIRED = {
+    'topics': ('title', 'keywords'),
+    'roster': ('name', 'group'),
+}
+
+
+class ImportFileError(Exception):
+    """Файл нельзя импортировать целиком (формат, заголовки, размер)."""
+
+
+@dataclass
+class RowError:
+    line: int
+    message: str
+
+
+@dataclass
+class ImportResult:
+    kind: str
+    rows: int = 0                  # непустых строк данных в файле
+    added: int = 0
+    existing: list[int] = field(default_factory=list)  # номера строк, уже бывших в базе
+    errors: list[RowError] = field(default_factory=list)
+
+
+# ---- Чтение файла ----
+
+def _decode(data: bytes) -> str:
+    try:
+        return data.decode('utf-8-sig')
+    except UnicodeDecodeError:
+        # Excel с русской локалью сохраняет CSV в Windows-1251
+        return data.decode('cp1251')
+
+
+def _csv_rows(data: bytes) -> Iterator[list[str]]:
+    text = _decode(data)
+    try:
+        header = next((line for line in text[:4096].splitlines() if line.strip()), '')
+        dialect = csv.Sniffer().sniff(header, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel
+    for row in csv.reader(io.StringIO(text), dialect):
+        yield [value.strip() for value in row]
+
+
+def _xlsx_rows(data: bytes) -> Iterator[list[str]]:
+    if openpyxl is None:
+        raise ImportFileError("XLSX на сервере не поддерживается (нет openpyxl) — сохраните файл как CSV.")
+    try:
+        workbook = openpyxl.load_workbook(io.BytesIO(data), read_only=True, data_only=True)
+    except Exception as e:
+        raise ImportFileError(f"Не удалось открыть XLSX: {e}") from e
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            yield ["" if value is None else str(value).strip() for value in row]
+    finally:
+        workbook.close()
+
+
+def _read(data: bytes, filename: str) -> Iterator[tuple[int, list[str]]]:
+    """(номер строки, значения) — нумерация как в редакторе таблиц, с 1."""
+    name = filename.lower()
+    if name.endswith('.xlsx'):
+        return enumerate(_xlsx_rows(data), start=1)
+    if name.endswith(('.csv', '.txt')):
+        return enumerate(_csv_rows(data), start=1)
+    raise ImportFileError("Поддерживаются файлы .csv и .xlsx.")
+
+
+# ---- Проверка строк ----
+
+def _department(values: dict, default: int | None) -> int:
+    name = values.get('department')
+    if not name:
+        if default is None:
+            raise ValueError("не указана кафедра")
+        return default
+    department_id = refdata.department_id(name)
+    if department_id is None:
+        raise ValueError(f"неизвестная кафедра «{name}»")
+    return department_id
+
+
+def _topic(values: dict, default_department: int | None, seen: set) -> tuple:
+    title = values.get('title', '')
+    if len(title) < 5:
+        raise ValueError("название короче 5 символов")
+    description = values.get('description') or None
+    if description is not None and len(description) < 10:
+        raise ValueError("описание короче 10 символов")
+    keywords = [k.strip() for k in re.split(r'[,;]', values.get('keywords', '')) if k.strip()]
+    if not keywords:
+        raise ValueError("нет ключевых слов")
+    department_id = _department(values, default_department)
+    if title.casefold() in seen:
+        raise ValueError("тема с таким названием уже есть выше в файле")
+    seen.add(title.casefold())
+    return title, description, keywords, department_id
+
+
+def _student(values: dict, default_department: int | None, seen: set) -> tuple:
+    name = values.get('name', '')
+    if len(name) < 2:
+        raise ValueError("ФИО короче 2 символов")
+    group = values.get('group', '')
+    if not validate_group(group):
+        raise ValueError(f"неверный формат группы «{group}» (пример: КС-46)")
+    email = values.get('email') or None
+    if email is not None and not validate_email(email):
+        raise ValueError(f"некорректный email «{email}»")
+    phone = values.get('phone') or None
+    if phone is not None and not validate_phone(phone):
+        raise ValueError(f"некорректный телефон «{phone}» (формат +79991234567)")
+    department_id = _department(values, default_department)
+    keys = {('name', name.casefold(), group)} | ({('email', email.lower())} if email else set())
+    if keys & seen:
+        raise ValueError("этот студент уже есть выше в файле")
+    seen.update(keys)
+    return name, group, email, phone, department_id
+
+
+_ROW_BUILDERS = {'topics': _topic, 'roster': _student}
+
+
+def _header(rows: Iterator[tuple[int, list[str]]], kind: str) -> list[str | None]:
+    """Поля по номерам столбцов; None — столбец не нужен."""
+    for _, header in rows:
+        if any(header):
+            break
+    else:
+        raise ImportFileError("Файл пустой.")
+    aliases = COLUMNS[kind]
+    fields = [aliases.get(' '.join(h.lower().split())) for h in header]
+    missing = [f for f in REQUIRED[kind] if f not in fields]
+    if missing:
+        names = {f: h for h, f in reversed(aliases.items())}
+        raise ImportFileError(
+            "Нет обязательных столбцов: " + ", ".join(f"«{names[f]}»" for f in missing)
+            + ". Первая строка файла — заголовки."
+        )
+    return fields
+
+
+def _valid_rows(rows: Iterator[tuple[int, list[str]]], fields: list[str | None], kind: str,
+                default_department: int | None, result: ImportResult) -> Iterator[tuple]:
+    """Строки для COPY: (номер строки, поля...); ошибки копятся в result.errors."""
+    build = _ROW_BUILDERS[kind]
+    seen: set = set()
+    for line, row in rows:
+        if not any(row):
+            continue
+        result.rows += 1
+        if result.rows > IMPORT_MAX_ROWS:
+            raise ImportFileError(f"В файле больше {IMPORT_MAX_ROWS} строк — разбейте его на части.")
+        values = {f: v for f, v in zip(fields, row) if f is not None and v}
+        try:
+            record = build(values, default_department, seen)
+        except ValueError as e:
+            result.errors.append(RowError(line, str(e)))
+            continue
+        yield (line, *record)
+
+
+# ---- Загрузка ----
+
+# Вид -> (временная таблица, столбцы для COPY, их объявление,
+#        запрос строк «уже в базе», перенос в основную таблицу)
+_STAGING = {
+    'topics': (
+        "import_topics",
+        ("line", "title", "description", "keywords", "department_id"),
+        "line INTEGER, title TEXT, description TEXT, keywords TEXT[], department_id INTEGER",
+        """
+        SELECT i.line FROM import_topics i
+         WHERE EXISTS (SELECT 1 FROM Topics t WHERE lower(t.title) = lower(i.title))
+         ORDER BY i.line
+        """,
+        # $1 — преподаватель, который импортирует темы
+        """
+        INSERT INTO Topics(title, description, keywords, status, teacher_id, department_id)
+        SELECT i.title, i.description, i.keywords, 'free', $1, i.department_id
+          FROM import_topics i
+         WHERE NOT EXISTS (SELECT 1 FROM Topics t WHERE lower(t.title) = lower(i.title))
+         ORDER BY i.line
+        RETURNING topic_id, keywords
+        """,
+    ),
+    'roster': (
+        "import_students",
+        ("line", "name", "group_name", "email", "phone", "department_id"),
+        "line INTEGER, name TEXT, group_name TEXT, email TEXT, phone TEXT, department_id INTEGER",
+        """
+        SELECT i.line FROM import_students i
+         WHERE EXISTS (SELECT 1 FROM Students s WHERE s.email = i.email)
+            OR EXISTS (SELECT 1 FROM Students s
+                        WHERE s.department_id = i.department_id AND s.group_name = i.group_name
+                          AND lower(s.name) = lower(i.name))
+         ORDER BY i.line
+        """,
+        # Студенты без telegram_id: аккаунт привяжется при регистрации в боте
+        # с тем же email (handlers/registration.py)
+        """
+        INSERT INTO Students(name, group_name, email, phone, department_id)
+        SELECT i.name, i.group_name, i.email, i.phone, i.department_id
+          FROM import_students i
+         WHERE NOT EXISTS (SELECT 1 FROM Students s WHERE s.email = i.email)
+           AND NOT EXISTS (SELECT 1 FROM Students s
+                            WHERE s.department_id = i.department_id AND s.group_name = i.group_name
+                              AND lower(s.name) = lower(i.name))
+         ORDER BY i.line
+        RETURNING student_id
+        """,
+    ),
+}
+
+
+async def run(data: bytes, filename: str, kind: str, teacher_id: int | None,
+              default_department: int | None) -> ImportResult:
+    """Импортирует файл; ImportFileError — если файл не подходит целиком."""
+    if kind not in KINDS:
+        raise ValueError(f"Неизвестный вид импорта: {kind}")
+    rows = _read(data, filename)
+    fields = _header(rows, kind)
+    table, columns, columns_sql, existing_sql, merge_sql = _STAGING[kind]
+    result = ImportResult(kind)
+
+    async with acquire() as conn:
+        async with conn.transaction():
+            await conn.execute(f"CREATE TEMP TABLE {table} ({columns_sql}) ON COMMIT DROP")
+            await conn.copy_records_to_table(
+                table, records=_valid_rows(rows, fields, kind, default_department, result),
+                columns=columns
+            )
+            result.existing = [r['line'] for r in await conn.fetch(existing_sql)]
+            args = (teacher_id,) if kind == 'topics' else ()
+            inserted = await conn.fetch(merge_sql, *args)
+
+    result.added = len(inserted)
+    if kind == 'topics':
+        for r in inserted:
+            keyword_index.add(r['topic_id'], r['keywords'], 'free')
+    return result
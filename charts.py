@@ -0,0 +1,253 @@
+# charts.py
+"""Построение графиков аналитики вне цикла событий.
+
+Фигура собирается и кодируется в PNG в отдельном процессе (пул ограниченного
+размера), хэндлер получает готовые байты. Пока строится график, бот продолжает
+отвечать остальным пользователям.
+
+Готовые PNG кэшируются по виду графика и отпечатку данных: если агрегаты не
+изменились, повторное нажатие отдаёт те же байты без построения.
+"""
+import asyncio
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from config import (
+    CHART_WORKERS,
+    CHART_MAX_CONCURRENT,
+    CHART_TIMEOUT,
+    CHART_CACHE_MAX_BYTES,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ChartError(Exception):
+    """График не удалось построить: очередь занята, истёк таймаут или упал процесс."""
+
+
+# Оформление графиков по видам; данные (подписи и значения) передаются в render()
+CHARTS = {
+    'departments': {
+        'title': "Распределение студентов по кафедрам",
+        'xlabel': "Номер кафедры",
+        'ylabel': "Количество студентов",
+        'numbered': True,
+        'width': 0.6,
+        'grid': True,
+    },
+    'groups': {
+        'title': "Студенты с одобренными темами по группам",
+        'xlabel': "Номер группы",
+        'ylabel': "Количество студентов",
+        'numbered': True,
+        'rotation': 45,
+    },
+    'group_sizes': {
+        'title': "Распределение студентов по группам",
+        'xlabel': "Группа",
+        'ylabel': "Число студентов",
+        'figsize': (8, 4),
+    },
+}
+
+_executor: ProcessPoolExecutor | None = None
+_slots: asyncio.Semaphore | None = None
+
+# (вид, отпечаток данных) -> PNG; порядок — от давно не использованных к свежим
+_cache: OrderedDict[tuple[str, str], bytes] = OrderedDict()
+_cache_bytes = 0
+# Построения, которые уже идут: одинаковые запросы ждут один результат
+_pending: dict[tuple[str, str], asyncio.Future] = {}
+
+_stats = {
+    'hits': 0,
+    'misses': 0,
+    'evictions': 0,
+}
+
+
+def _worker_init():
+    # В сборке PyInstaller matplotlib по умолчанию кладёт кэш шрифтов во временный
+    # каталог и перестраивает его при каждом запуске; держим его постоянным
+    if getattr(sys, 'frozen', False):
+        cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'nir_bot', 'matplotlib')
+        os.makedirs(cache_dir, exist_ok=True)
+        os.environ['MPLCONFIGDIR'] = cache_dir
+    # Импорт matplotlib занимает заметное время — делаем его один раз при старте процесса
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.figure  # noqa: F401
+
+
+def _render_bar(kind: str, labels: list, values: list) -> bytes:
+    """Выполняется в дочернем процессе. Без pyplot: у каждой фигуры свой холст."""
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+    from matplotlib.ticker import MaxNLocator
+
+    opts = CHARTS[kind]
+    fig = Figure(figsize=opts.get('figsize'))
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    if opts.get('numbered'):
+        # Длинные названия выносятся в текстовую расшифровку под графиком
+        x = list(range(1, len(labels) + 1))
+        ax.bar(x, values, width=opts.get('width', 0.8))
+        ax.set_xticks(x)
+        ax.set_xticklabels(x, rotation=opts.get('rotation', 0))
+    else:
+        ax.bar([str(label) for label in labels], values)
+    ax.set_title(opts['title'])
+    ax.set_xlabel(opts['xlabel'])
+    ax.set_ylabel(opts['ylabel'])
+    ax.yaxis.set_major_locator(MaxNLocator(integer=True))
+    if opts.get('grid'):
+        ax.grid(axis='y', linestyle='--', alpha=0.5)
+    fig.tight_layout()
+
+    buf = io.BytesIO()
+    fig.savefig(buf, format='png')
+    return buf.getvalue()
+
+
+def start():
+    """Запускает пул процессов. Вызывается при старте бота, повторный вызов ничего не делает."""
+    global _executor, _slots
+    if _executor is None:
+        # spawn: дочерние процессы не наследуют состояние цикла событий и соединения
+        _executor = ProcessPoolExecutor(
+            max_workers=CHART_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_worker_init,
+        )
+    if _slots is None:
+        _slots = asyncio.Semaphore(CHART_MAX_CONCURRENT)
+
+
+def stop():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def fingerprint(labels, values) -> str:
+    payload = json.dumps([list(labels), list(values)], ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def _cache_get(key) -> bytes | None:
+    png = _cache.get(key)
+    if png is not None:
+        _cache.move_to_end(key)
+    return png
+
+
+def _cache_put(key, png: bytes):
+    global _cache_bytes
+    if len(png) > CHART_CACHE_MAX_BYTES:
+        return
+    # Старый график того же вида с другими данными больше не понадобится
+    for old in [k for k in _cache if k[0] == key[0]]:
+        _cache_bytes -= len(_cache.pop(old))
+    _cache[key] = png
+    _cache_bytes += len(png)
+    while _cache_bytes > CHART_CACHE_MAX_BYTES:
+        _, evicted = _cache.popitem(last=False)
+        _cache_bytes -= len(evicted)
+        _stats['evictions'] += 1
+
+
+def clear_cache():
+    global _cache_bytes
+    _cache.clear()
+    _cache_bytes = 0
+
+
+def stats() -> dict:
+    return {**_stats, 'entries': len(_cache), 'bytes': _cache_bytes}
+
+
+async def render(kind: str, labels, values) -> bytes:
+    """Возвращает PNG столбчатой диаграммы вида kind: из кэша или построив заново.
+
+    Бросает ChartError, если свободного места в очереди не дождались или
+    построение не уложилось в CHART_TIMEOUT.
+    """
+    if kind not in CHARTS:
+        raise ValueError(f"Неизвестный вид графика: {kind}")
+    labels, values = list(labels), list(values)
+    key = (kind, fingerprint(labels, values))
+
+    png = _cache_get(key)
+    if png is not None:
+        _stats['hits'] += 1
+        return png
+    pending = _pending.get(key)
+    if pending is not None:
+        _stats['hits'] += 1
+        return await asyncio.shield(pending)
+
+    _stats['misses'] += 1
+    future = asyncio.get_running_loop().create_future()
+    _pending[key] = future
+    try:
+        png = await _render(kind, labels, values)
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        # Ошибку получат только те, кто ждёт; иначе asyncio предупредит о ней в лог
+        future.exception()
+        raise
+    else:
+        _cache_put(key, png)
+        future.set_result(png)
+        return png
+    finally:
+        _pending.pop(key, None)
+
+
+async def _render(kind: str, labels: list, values: list) -> bytes:
+    start()
+    loop = asyncio.get_running_loop()
+
+    try:
+        await asyncio.wait_for(_slots.acquire(), timeout=CHART_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise ChartError("очередь построения графиков занята") from None
+
+    try:
+        future = loop.run_in_executor(_executor, _render_bar, kind, labels, values)
+    except BrokenProcessPool:
+        _slots.release()
+        _restart()
+        raise ChartError("пул процессов перезапущен")
+    # Место освобождается, когда процесс действительно закончил работу,
+    # а не когда мы перестали ждать, иначе таймауты переполнят пул
+    future.add_done_callback(lambda _: _slots.release())
+
+    try:
+        return await asyncio.wait_for(asyncio.shield(future), timeout=CHART_TIMEOUT)
+    except asyncio.TimeoutError:
+        raise ChartError("построение графика заняло слишком много времени") from None
+    except BrokenProcessPool:
+        _restart()
+        raise ChartError("процесс построения графика завершился аварийно") from None
+
+
+def _restart():
+    logger.warning("Пул построения графиков сломан, создаём заново")
+    stop()
+    start()
@@ -6,4 +6,99 @@ load_dotenv()
 
 API_TOKEN = os.getenv("API_TOKEN")
 POSTGRES_URI = f"postgresql://{os.getenv('POSTGRES_USER')}:{os.getenv('POSTGRES_PASSWORD')}@{os.getenv('POSTGRES_HOST')}/{os.getenv('POSTGRES_DB')}"
-TEACHER_ACCESS_CODE = "prof_code_123"
\ No newline at end of file
+TEACHER_ACCESS_CODE = "prof_code_123"
+
+# Пул соединений с PostgreSQL
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+DB_POOL_ACQUIRE_TIMEOUT = float(os.getenv("DB_POOL_ACQUIRE_TIMEOUT", "5"))
+DB_POOL_MAX_INACTIVE_LIFETIME = float(os.getenv("DB_POOL_MAX_INACTIVE_LIFETIME", "300"))
+
+# Кэш «кто пишет боту» (identity.py)
+IDENTITY_CACHE_TTL = float(os.getenv("IDENTITY_CACHE_TTL", "60"))
+IDENTITY_CACHE_MAX_SIZE = int(os.getenv("IDENTITY_CACHE_MAX_SIZE", "10000"))
+
+# Фоновая запись журналов Logs / Interactions / SearchLogs (eventlog.py)
+EVENTLOG_QUEUE_SIZE = int(os.getenv("EVENTLOG_QUEUE_SIZE", "10000"))
+EVENTLOG_BATCH_SIZE = int(os.getenv("EVENTLOG_BATCH_SIZE", "500"))
+EVENTLOG_FLUSH_INTERVAL = float(os.getenv("EVENTLOG_FLUSH_INTERVAL", "1"))
+# Что выбрасывать при переполнении очереди: 'oldest' или 'newest'
+EVENTLOG_DROP_POLICY = os.getenv("EVENTLOG_DROP_POLICY", "oldest")
+# Сколько ждать места в полной очереди там, где событие терять нельзя
+EVENTLOG_PUT_TIMEOUT = float(os.getenv("EVENTLOG_PUT_TIMEOUT", "5"))
+# Предел паузы между повторами записи, если БД недоступна
+EVENTLOG_MAX_RETRY_DELAY = float(os.getenv("EVENTLOG_MAX_RETRY_DELAY", "30"))
+
+# Построение графиков в отдельных процессах (charts.py)
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", "2"))
+# Сколько графиков может строиться или ждать очереди одновременно
+CHART_MAX_CONCURRENT = int(os.getenv("CHART_MAX_CONCURRENT", "4"))
+CHART_TIMEOUT = float(os.getenv("CHART_TIMEOUT", "15"))
+# Сколько байт PNG держать в кэше готовых графиков
+CHART_CACHE_MAX_BYTES = int(os.getenv("CHART_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+
+# Постраничный просмотр тем (handlers/pagination.py)
+TOPICS_PAGE_SIZE = int(os.getenv("TOPICS_PAGE_SIZE", "10"))
+# Сколько хранить найденные темы для листания результатов поиска (таблица SearchResults)
+SEARCH_RESULTS_TTL = float(os.getenv("SEARCH_RESULTS_TTL", "1800"))
+
+# Рассылки (broadcaster.py). Лимиты Telegram: около 30 сообщений в секунду
+# на бота и не чаще раза в секунду в один чат
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", "25"))
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL", "1"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "8"))
+BROADCAST_MAX_ATTEMPTS = int(os.getenv("BROADCAST_MAX_ATTEMPTS", "5"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))
+# Сколько секунд рассылка числится за процессом без продления; после этого
+# (процесс упал) её подхватывает другой
+BROADCAST_LEASE = float(os.getenv("BROADCAST_LEASE", "60"))
+
+# Способ получения обновлений: 'polling' или 'webhook' (webhook.py)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+# Публичный адрес, по которому Telegram достучится до бота, например https://bot.example.org.
+# Пустой — webhook не регистрируется (его выставляет балансировщик или другая реплика)
+WEBHOOK_BASE_URL = os.getenv("WEBHOOK_BASE_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+# Одинаковый у всех реплик; пустой — выводится из API_TOKEN
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+# Обработчиков обновлений и общий размер их очередей
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", "16"))
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", "1000"))
+# Сколько ждать места в очереди, прежде чем ответить Telegram 503 (он повторит позже)
+WEBHOOK_ENQUEUE_TIMEOUT = float(os.getenv("WEBHOOK_ENQUEUE_TIMEOUT", "5"))
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+
+# Хранилище состояний диалогов: 'postgres' (общее для нескольких процессов бота)
+# или 'memory' (только один процесс, теряется при перезапуске)
+FSM_STORAGE = os.getenv("FSM_STORAGE", "postgres")
+# Формат данных диалога в FsmStates: 'json' или 'marshal' (быстрее, но только
+# если все процессы бота на одной версии Python)
+FSM_SERIALIZER = os.getenv("FSM_SERIALIZER", "json")
+# Через сколько секунд без действий брошенный диалог сбрасывается
+FSM_STATE_TTL = float(os.getenv("FSM_STATE_TTL", "86400"))
+FSM_PURGE_INTERVAL = float(os.getenv("FSM_PURGE_INTERVAL", "600"))
+
+# Метрики обработки обновлений в формате Prometheus (metrics.py).
+# Порт лучше не публиковать наружу: метрики читает локальный сборщик
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "1") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Учёт запросов к БД за обновление (querytrace.py)
+# Запросы дольше стольких миллисекунд пишутся в лог
+SQL_SLOW_MS = float(os.getenv("SQL_SLOW_MS", "200"))
+# Один и тот же запрос столько раз за обновление — предупреждение о N+1
+SQL_REPEAT_WARN = int(os.getenv("SQL_REPEAT_WARN", "3"))
+# Больше стольких обращений к БД за обновление — предупреждение (0 — не проверять)
+SQL_QUERY_BUDGET = int(os.getenv("SQL_QUERY_BUDGET", "0"))
+
+# Импорт тем и списков групп из CSV/XLSX (bulk_import.py)
+IMPORT_MAX_ROWS = int(os.getenv("IMPORT_MAX_ROWS", "10000"))
+# Размер файла в байтах; Bot API отдаёт ботам файлы до 20 МБ
+IMPORT_MAX_FILE_SIZE = int(os.getenv("IMPORT_MAX_FILE_SIZE", str(5 * 1024 * 1024)))
+
+# Отчёты аналитики: сколько строк показывать в чате и порция курсора при выгрузке в файл (exports.py)
+ANALYTICS_PREVIEW_ROWS = int(os.getenv("ANALYTICS_PREVIEW_ROWS", "30"))
+EXPORT_PREFETCH = int(os.getenv("EXPORT_PREFETCH", "1000"))
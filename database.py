@@ -1,105 +1,163 @@
 # database.py
+import asyncio
+from contextlib import asynccontextmanager
+
 import asyncpg
-from config import POSTGRES_URI
 
-async def init_db():
-    conn = await asyncpg.connect(POSTGRES_URI)
+import migrations
+from config import (
+    POSTGRES_URI,
+    DB_POOL_MIN_SIZE,
+    DB_POOL_MAX_SIZE,
+    DB_POOL_ACQUIRE_TIMEOUT,
+    DB_POOL_MAX_INACTIVE_LIFETIME,
+)
+
+
+class PoolTimeoutError(Exception):
+    """Не удалось получить соединение из пула за отведённое время."""
+
+
+# Общий пул соединений: создаётся один раз в bot.main() и закрывается при остановке
+_pool: asyncpg.Pool | None = None
+
+# Хуки, которые выполняются для каждого нового соединения пула
+_init_hooks = []
+
+# Есть ли pg_trgm и триграммные индексы (определяется в init_db)
+trigram_enabled = False
+
+# Счётчики для pool_stats()
+_waiters = 0
+_acquired_total = 0
+_timeouts_total = 0
+
+
+class Connection(asyncpg.Connection):
+    """Соединение пула; хранит свои подготовленные запросы statements.py."""
+
+    def prepared_statements(self) -> dict:
+        # asyncpg.Connection объявляет __slots__, у подкласса есть __dict__
+        try:
+            cache = self._prepared_statements
+        except AttributeError:
+            cache = self._prepared_statements = {}
+            self._prepared_generation = self._pool_release_ctr
+        if self._prepared_generation != self._pool_release_ctr:
+            # asyncpg привязывает PreparedStatement к одной выдаче соединения
+            # из пула и после release() отказывает в вызове, хотя запрос на
+            # сервере живёт вместе с соединением. Перепривязываем к текущей
+            # выдаче (внутренности asyncpg: версия закреплена в requirements.txt)
+            for statement in cache.values():
+                statement._con_release_ctr = self._pool_release_ctr
+            self._prepared_generation = self._pool_release_ctr
+        return cache
+
+
+def register_connection_init(hook):
+    """Регистрирует корутину hook(conn), вызываемую при создании соединения пула.
+
+    Можно использовать как декоратор. Хуки нужно регистрировать до init_pool().
+    """
+    _init_hooks.append(hook)
+    return hook
+
+
+async def _init_connection(conn):
+    for hook in _init_hooks:
+        await hook(conn)
+
+
+async def init_pool(connection_class: type[Connection] = Connection):
+    """Создаёт общий пул. connection_class — подкласс Connection,
+    например querytrace.TracedConnection."""
+    global _pool
+    if _pool is None:
+        _pool = await asyncpg.create_pool(
+            POSTGRES_URI,
+            connection_class=connection_class,
+            min_size=DB_POOL_MIN_SIZE,
+            max_size=DB_POOL_MAX_SIZE,
+            max_inactive_connection_lifetime=DB_POOL_MAX_INACTIVE_LIFETIME,
+            init=_init_connection,
+        )
+    return _pool
+
+
+async def close_pool():
+    global _pool
+    if _pool is not None:
+        pool, _pool = _pool, None
+        await pool.close()
+
+
+async def connect() -> asyncpg.Connection:
+    """Отдельное соединение вне пула, например для LISTEN. Закрывает вызывающий."""
+    return await asyncpg.connect(POSTGRES_URI)
+
+
+def get_pool() -> asyncpg.Pool:
+    if _pool is None:
+        raise RuntimeError("Пул соединений не инициализирован: вызовите init_pool()")
+    return _pool
+
+
+@asynccontextmanager
+async def acquire(timeout: float | None = None):
+    """Берёт соединение из общего пула и возвращает его по выходу из блока.
+
+    Если свободного соединения нет дольше timeout (по умолчанию
+    DB_POOL_ACQUIRE_TIMEOUT), бросает PoolTimeoutError.
+    """
+    global _waiters, _acquired_total, _timeouts_total
+    pool = get_pool()
+    if timeout is None:
+        timeout = DB_POOL_ACQUIRE_TIMEOUT
+    _waiters += 1
+    try:
+        conn = await pool.acquire(timeout=timeout)
+    except asyncio.TimeoutError as e:
+        _timeouts_total += 1
+        raise PoolTimeoutError(
+            f"Нет свободных соединений с БД в течение {timeout} с"
+        ) from e
+    finally:
+        _waiters -= 1
+    _acquired_total += 1
     try:
-        # Используем транзакцию для обеспечения атомарности
-        async with conn.transaction():
-            # Таблицы предметной области
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS Departments (
-                    department_id SERIAL PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    description TEXT
-                );
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS Students (
-                    student_id SERIAL PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    email TEXT UNIQUE,
-                    phone TEXT,
-                    telegram_id TEXT UNIQUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    group_name TEXT,
-                    department_id INTEGER REFERENCES Departments(department_id) ON DELETE SET NULL
-                );
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS Teachers (
-                    teacher_id SERIAL PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    email TEXT UNIQUE,
-                    phone TEXT,
-                    telegram_id TEXT UNIQUE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    department_id INTEGER REFERENCES Departments(department_id) ON DELETE SET NULL
-                );
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS Topics (
-                    topic_id SERIAL PRIMARY KEY,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    keywords TEXT[],
-                    status TEXT CHECK (status IN ('free', 'reserved', 'closed')),
-                    teacher_id INTEGER REFERENCES Teachers(teacher_id) ON DELETE SET NULL,
-                    student_id INTEGER REFERENCES Students(student_id) ON DELETE SET NULL,
-                    department_id INTEGER REFERENCES Departments(department_id) ON DELETE CASCADE
-                );
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS Suggestions (
-                    suggestion_id SERIAL PRIMARY KEY,
-                    title TEXT NOT NULL,
-                    description TEXT,
-                    student_id INTEGER REFERENCES Students(student_id) ON DELETE CASCADE,
-                    status TEXT CHECK (status IN ('pending', 'approved', 'rejected')),
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            ''')
-            # Обновлённая лог‑таблица действий
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS Interactions (
-                    interaction_id SERIAL PRIMARY KEY,
-                    teacher_id   INTEGER REFERENCES Teachers(teacher_id) ON DELETE CASCADE,
-                    student_id   INTEGER REFERENCES Students(student_id) ON DELETE CASCADE,
-                    topic_id     INTEGER REFERENCES Topics(topic_id)   ON DELETE CASCADE,
-                    user_role    TEXT CHECK(user_role IN ('student','teacher')),
-                    action       TEXT NOT NULL,
-                    timestamp    TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                );
-            ''')
-            # Категории и связь с темами
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS Categories (
-                    category_id SERIAL PRIMARY KEY,
-                    name TEXT NOT NULL,
-                    parent_id INTEGER REFERENCES Categories(category_id) ON DELETE CASCADE
-                );
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS TopicCategories (
-                    topic_id INTEGER REFERENCES Topics(topic_id) ON DELETE CASCADE,
-                    category_id INTEGER REFERENCES Categories(category_id) ON DELETE CASCADE,
-                    PRIMARY KEY(topic_id, category_id)
-                );
-            ''')
-            await conn.execute('''
-                CREATE TABLE IF NOT EXISTS SearchLogs (
-                    log_id SERIAL PRIMARY KEY,
-                    student_id INTEGER REFERENCES Students(student_id) ON DELETE CASCADE,
-                    query TEXT NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-);
-
-                        ''')
-    except Exception as e:
-        print(f"Ошибка при инициализации базы данных: {e}")
+        yield conn
     finally:
-        await conn.close()
+        await pool.release(conn)
+
+
+def pool_stats() -> dict:
+    """Текущее состояние пула: сколько соединений занято, свободно и сколько ждут."""
+    if _pool is None:
+        return {
+            "size": 0, "min_size": DB_POOL_MIN_SIZE, "max_size": DB_POOL_MAX_SIZE,
+            "in_use": 0, "idle": 0, "waiters": _waiters,
+            "acquired_total": _acquired_total, "timeouts_total": _timeouts_total,
+        }
+    size = _pool.get_size()
+    idle = _pool.get_idle_size()
+    return {
+        "size": size,
+        "min_size": _pool.get_min_size(),
+        "max_size": _pool.get_max_size(),
+        "in_use": size - idle,
+        "idle": idle,
+        "waiters": _waiters,
+        "acquired_total": _acquired_total,
+        "timeouts_total": _timeouts_total,
+    }
+
+
+async def init_db():
+    """Приводит схему БД к последней версии (см. migrations.py).
 
-async def create_db_connection():
-    return await asyncpg.connect(POSTGRES_URI)
\ No newline at end of file
+    Если схема уже актуальна, это один запрос без DDL.
+    """
+    global trigram_enabled
+    async with acquire() as conn:
+        state = await migrations.migrate(conn)
+    trigram_enabled = state["trigram"] and state["trigram_indexes"]
@@ -0,0 +1,228 @@
+# eventlog.py
+import asyncio
+import json
+import logging
+from collections import deque
+from datetime import datetime
+
+import asyncpg
+
+from config import (
+    EVENTLOG_QUEUE_SIZE,
+    EVENTLOG_BATCH_SIZE,
+    EVENTLOG_FLUSH_INTERVAL,
+    EVENTLOG_DROP_POLICY,
+    EVENTLOG_PUT_TIMEOUT,
+    EVENTLOG_MAX_RETRY_DELAY,
+)
+from database import acquire
+
+logger = logging.getLogger(__name__)
+
+# Таблица -> колонки, в которые пишет COPY
+# Ошибки самих данных: такую строку пропускаем. Всё остальное (обрыв
+# соединения, недоступная БД) — повод вернуть события в очередь
+_BAD_DATA = (asyncpg.IntegrityConstraintViolationError, asyncpg.DataError)
+
+_COLUMNS = {
+    'logs': ('user_id', 'action', 'details', 'created_at'),
+    'interactions': ('teacher_id', 'student_id', 'topic_id', 'user_role', 'action', 'timestamp'),
+    'searchlogs': ('student_id', 'query', 'timestamp'),
+}
+
+# Очередь событий (таблица, запись). Хэндлеры только кладут в неё,
+# запись в БД делает фоновая задача пачками.
+_queue: deque = deque()
+_wakeup: asyncio.Event | None = None
+# Выставляется, когда в очереди освободилось место (см. wait_for_room)
+_room: asyncio.Event | None = None
+_flusher: asyncio.Task | None = None
+_stopping = False
+# Пауза перед повтором после ошибки БД; 0 — ошибок не было
+_retry_delay = 0.0
+
+_stats = {
+    'enqueued': 0,
+    'written': 0,
+    'dropped': 0,
+    'failed': 0,
+    'retries': 0,
+    'flushes': 0,
+}
+
+
+def _trim():
+    # Переполнение разрешается по EVENTLOG_DROP_POLICY
+    while len(_queue) > EVENTLOG_QUEUE_SIZE:
+        _stats['dropped'] += 1
+        if EVENTLOG_DROP_POLICY == 'newest':
+            _queue.pop()
+        else:
+            _queue.popleft()
+
+
+def _enqueue(table: str, record: tuple):
+    if len(_queue) >= EVENTLOG_QUEUE_SIZE:
+        _stats['dropped'] += 1
+        if EVENTLOG_DROP_POLICY == 'newest':
+            return
+        _queue.popleft()
+    _queue.append((table, record))
+    _stats['enqueued'] += 1
+    # Набралась целая пачка — не ждём таймера (но после ошибки БД ждём паузу)
+    if _wakeup is not None and not _retry_delay and len(_queue) >= EVENTLOG_BATCH_SIZE:
+        _wakeup.set()
+
+
+async def wait_for_room(timeout: float | None = None) -> bool:
+    """Ждёт места в очереди не дольше timeout (по умолчанию EVENTLOG_PUT_TIMEOUT).
+
+    Для событий, которые нельзя терять: вызвать перед log_*(). Между
+    проверкой и log_*() нет await, поэтому место не займут. False — места
+    так и не появилось, и событие пойдёт по EVENTLOG_DROP_POLICY.
+    """
+    if timeout is None:
+        timeout = EVENTLOG_PUT_TIMEOUT
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while len(_queue) >= EVENTLOG_QUEUE_SIZE:
+        remaining = deadline - loop.time()
+        if _room is None or remaining <= 0:
+            return False
+        _room.clear()
+        try:
+            await asyncio.wait_for(_room.wait(), timeout=remaining)
+        except asyncio.TimeoutError:
+            return False
+    return True
+
+
+def log_action(user_id, action: str, details: dict | None = None):
+    """Действие пользователя в таблицу Logs. Не блокирует и не обращается к БД."""
+    _enqueue('logs', (
+        str(user_id) if user_id is not None else None,
+        action,
+        json.dumps(details or {}, ensure_ascii=False),
+        datetime.now(),
+    ))
+
+
+def log_interaction(action: str, user_role: str, student_id=None, teacher_id=None, topic_id=None):
+    """Событие по теме (закрепление, открепление и т.п.) в таблицу Interactions."""
+    _enqueue('interactions', (teacher_id, student_id, topic_id, user_role, action, datetime.now()))
+
+
+def log_search(student_id, query: str):
+    """Поисковый запрос студента в таблицу SearchLogs."""
+    if student_id is None:
+        return
+    _enqueue('searchlogs', (student_id, query, datetime.now()))
+
+
+def stats() -> dict:
+    return {**_stats, 'queued': len(_queue)}
+
+
+def _take_batch() -> list[tuple[str, tuple]]:
+    items = [_queue.popleft() for _ in range(min(EVENTLOG_BATCH_SIZE, len(_queue)))]
+    if _room is not None:
+        _room.set()
+    return items
+
+
+def _requeue(items: list[tuple[str, tuple]]):
+    """Возвращает несохранённую пачку в голову очереди: она старше остальных событий."""
+    _queue.extendleft(reversed(items))
+    _trim()
+
+
+async def _write_rows_individually(conn, table: str, records: list[tuple]):
+    # Запасной путь: одна «плохая» строка (например, студент уже удалён
+    # и нарушается внешний ключ) не должна терять всю пачку
+    columns = _COLUMNS[table]
+    placeholders = ', '.join(f'${i}' for i in range(1, len(columns) + 1))
+    sql = f"INSERT INTO {table}({', '.join(columns)}) VALUES({placeholders})"
+    done = 0
+    try:
+        for record in records:
+            try:
+                await conn.execute(sql, *record)
+                _stats['written'] += 1
+            except _BAD_DATA as e:
+                _stats['failed'] += 1
+                logger.warning("Не удалось записать событие в %s: %s", table, e)
+            done += 1
+    finally:
+        # В records остаются только необработанные — их вернут в очередь
+        del records[:done]
+
+
+async def flush() -> bool:
+    """Записывает накопленные события в БД, по одному COPY на таблицу.
+
+    Если БД недоступна, пачка возвращается в очередь и flush() отдаёт False.
+    """
+    while _queue:
+        # Таблица -> ещё не записанные события; записанная таблица удаляется,
+        # чтобы при ошибке на следующей её события не ушли в БД дважды
+        pending: dict[str, list[tuple]] = {}
+        for table, record in _take_batch():
+            pending.setdefault(table, []).append(record)
+        try:
+            async with acquire() as conn:
+                for table in list(pending):
+                    records = pending[table]
+                    try:
+                        await conn.copy_records_to_table(
+                            table, records=records, columns=_COLUMNS[table]
+                        )
+                        _stats['written'] += len(records)
+                    except _BAD_DATA as e:
+                        logger.warning("COPY в %s не удался (%s), пишем построчно", table, e)
+                        await _write_rows_individually(conn, table, records)
+                    del pending[table]
+        except Exception:
+            # Нет соединения или БД недоступна: незаписанное вернётся в БД
+            # со следующей попыткой
+            _requeue([(table, record) for table, records in pending.items() for record in records])
+            _stats['retries'] += 1
+            logger.exception("Не удалось сбросить журнал событий, повторим")
+            return False
+        _stats['flushes'] += 1
+    return True
+
+
+async def _flush_loop():
+    global _retry_delay
+    while not _stopping:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=_retry_delay or EVENTLOG_FLUSH_INTERVAL)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        if await flush():
+            _retry_delay = 0.0
+        else:
+            _retry_delay = min(max(_retry_delay * 2, EVENTLOG_FLUSH_INTERVAL), EVENTLOG_MAX_RETRY_DELAY)
+
+
+async def start():
+    global _wakeup, _room, _flusher, _stopping
+    if _flusher is None:
+        _stopping = False
+        _wakeup = asyncio.Event()
+        _room = asyncio.Event()
+        _flusher = asyncio.create_task(_flush_loop())
+
+
+async def stop():
+    """Останавливает фоновую запись и сбрасывает в БД всё, что осталось в очереди."""
+    global _flusher, _stopping
+    if _flusher is not None:
+        _stopping = True
+        _wakeup.set()
+        await _flusher
+        _flusher = None
+    if not await flush():
+        _stats['failed'] += len(_queue)
+        logger.error("При остановке не записано событий журнала: %s", len(_queue))
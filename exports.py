@@ -0,0 +1,168 @@
+# exports.py
+"""Выгрузка отчётов аналитики в CSV/XLSX.
+
+Строки читаются серверным курсором порциями по EXPORT_PREFETCH и сразу
+пишутся во временный файл, поэтому память не зависит от размера кафедры.
+На цикле событий остаётся только чтение курсора: порция форматируется и
+пишется в файл в потоке (asyncio.to_thread), пока читается следующая.
+XLSX пишется в потоковом режиме openpyxl (write_only) и доступен, только
+если openpyxl установлен.
+
+    async with exports.export('without_topic', 'xlsx') as result:
+        await message.answer_document(FSInputFile(result.path, filename=result.filename))
+
+Временный файл удаляется при выходе из блока.
+"""
+import asyncio
+import csv
+import os
+import tempfile
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from datetime import date
+
+try:
+    import openpyxl
+except ImportError:
+    # Необязательная зависимость: без неё выгрузка только в CSV
+    openpyxl = None
+
+from config import EXPORT_PREFETCH
+from database import acquire
+
+FORMATS = ('csv', 'xlsx') if openpyxl is not None else ('csv',)
+
+
+@dataclass(frozen=True)
+class Report:
+    title: str                  # заголовок в чате и имя листа XLSX
+    filename: str               # имя файла без даты и расширения
+    columns: tuple[str, ...]    # заголовки столбцов файла
+    sql: str
+
+
+# Первые столбцы каждого запроса — те, что показываются в чате
+REPORTS = {
+    'with_topic': Report(
+        "Студенты с темой", "students_with_topic", ("Студент", "Тема", "Группа"),
+        """
+        SELECT s.name, t.title, s.group_name
+          FROM Students s
+          JOIN Topics t ON s.student_id = t.student_id
+         WHERE t.status = 'closed'
+         ORDER BY s.name
+        """,
+    ),
+    'without_topic': Report(
+        "Студенты без темы", "students_without_topic", ("Студент", "Группа"),
+        """
+        SELECT s.name, s.group_name
+          FROM Students s
+          LEFT JOIN Topics t ON s.student_id = t.student_id
+         WHERE t.student_id IS NULL
+         ORDER BY s.name
+        """,
+    ),
+    # $1 — department_id, $2 — группа
+    'group': Report(
+        "Студенты группы и их темы", "group_topics", ("Студент", "Тема"),
+        """
+        SELECT s.name, COALESCE(t.title, '—') AS title
+          FROM Students s
+          LEFT JOIN Topics t ON s.student_id = t.student_id
+         WHERE s.department_id = $1 AND s.group_name = $2
+         ORDER BY s.name
+        """,
+    ),
+}
+
+
+@dataclass(frozen=True)
+class Export:
+    path: str
+    filename: str
+    rows: int
+
+
+async def preview(report: str, *args, limit: int) -> list:
+    """Первые limit + 1 строк отчёта: лишняя показывает, что есть ещё."""
+    async with acquire() as conn:
+        return await conn.fetch(f"{REPORTS[report].sql} LIMIT {int(limit) + 1}", *args)
+
+
+class _CsvWriter:
+    def __init__(self, path: str, spec: Report):
+        # BOM — чтобы Excel открыл файл в UTF-8; «;» — разделитель русского Excel
+        self.file = open(path, 'w', encoding='utf-8-sig', newline='')
+        self.writer = csv.writer(self.file, delimiter=';')
+        self.writer.writerow(spec.columns)
+
+    def write(self, records: list):
+        self.writer.writerows(tuple(r) for r in records)
+
+    def close(self):
+        self.file.close()
+
+
+class _XlsxWriter:
+    def __init__(self, path: str, spec: Report):
+        self.path = path
+        self.workbook = openpyxl.Workbook(write_only=True)
+        # Имя листа в Excel — не длиннее 31 символа
+        self.sheet = self.workbook.create_sheet(spec.title[:31])
+        self.sheet.append(spec.columns)
+
+    def write(self, records: list):
+        for record in records:
+            self.sheet.append(tuple(record))
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+_WRITERS = {'csv': _CsvWriter, 'xlsx': _XlsxWriter}
+
+
+async def _write(writer, cursor) -> int:
+    """Читает курсор порциями и пишет каждую в потоке, пока читается следующая."""
+    rows = 0
+    pending = None
+    try:
+        while True:
+            records = await cursor.fetch(EXPORT_PREFETCH)
+            if pending is not None:
+                await pending
+                pending = None
+            if not records:
+                break
+            rows += len(records)
+            pending = asyncio.ensure_future(asyncio.to_thread(writer.write, records))
+    finally:
+        if pending is not None:
+            # Ошибка чтения: дождаться записи, чтобы не закрыть файл под потоком
+            await asyncio.gather(pending, return_exceptions=True)
+    return rows
+
+
+@asynccontextmanager
+async def export(report: str, fmt: str, *args):
+    """Пишет отчёт во временный файл; параметры запроса — как в REPORTS."""
+    if fmt not in FORMATS:
+        raise ValueError(f"Формат {fmt} недоступен")
+    spec = REPORTS[report]
+    fd, path = tempfile.mkstemp(prefix=f"{spec.filename}-", suffix=f".{fmt}")
+    os.close(fd)
+    try:
+        writer = await asyncio.to_thread(_WRITERS[fmt], path, spec)
+        try:
+            async with acquire() as conn:
+                # Курсор живёт только внутри транзакции
+                async with conn.transaction(readonly=True):
+                    cursor = await conn.cursor(spec.sql, *args)
+                    rows = await _write(writer, cursor)
+        finally:
+            # Для XLSX здесь собирается и сжимается весь файл
+            await asyncio.to_thread(writer.close)
+        yield Export(path, f"{spec.filename}_{date.today():%Y-%m-%d}.{fmt}", rows)
+    finally:
+        os.remove(path)
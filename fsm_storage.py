@@ -0,0 +1,215 @@
+# fsm_storage.py
+"""Хранилище состояний FSM в PostgreSQL (FSM_STORAGE=postgres).
+
+Состояние и данные диалога лежат в таблице FsmStates, поэтому несколько
+процессов бота обслуживают одних и тех же пользователей, а перезапуск не
+обрывает начатые диалоги. Данные хранятся в JSON (FSM_SERIALIZER=json);
+marshal включается явно и пишет в запись метку версии Python. Брошенный
+диалог живёт FSM_STATE_TTL
+секунд с последнего изменения, потом считается пустым и удаляется фоновой
+очисткой.
+"""
+import asyncio
+import json
+import logging
+import marshal
+import sys
+from typing import Any, Dict, Optional, Protocol
+
+from aiogram import Dispatcher
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from config import FSM_STORAGE, FSM_SERIALIZER, FSM_STATE_TTL, FSM_PURGE_INTERVAL
+from database import acquire
+import statements
+
+logger = logging.getLogger(__name__)
+
+
+class Serializer(Protocol):
+    def dumps(self, data: Dict[str, Any]) -> bytes: ...
+    def loads(self, raw: bytes) -> Dict[str, Any]: ...
+
+
+class JsonSerializer:
+    """Формат по умолчанию: не зависит от версии Python на процессах бота.
+
+    Кортежи читаются обратно списками, ключи словарей — строками.
+    """
+    def dumps(self, data: Dict[str, Any]) -> bytes:
+        return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode()
+
+    def loads(self, raw: bytes) -> Dict[str, Any]:
+        return json.loads(raw)
+
+
+class MarshalSerializer:
+    """Бинарный формат для dict/list/tuple/set/str/int/float/bool/None.
+
+    Формат marshal меняется между версиями Python, поэтому запись начинается
+    с метки b'M' + major, minor интерпретатора + версия формата. Запись с
+    чужой меткой не читается (ValueError) — включайте, только если все
+    процессы бота работают на одной версии Python.
+    """
+    version = 4
+
+    @property
+    def tag(self) -> bytes:
+        return b'M' + bytes((*sys.version_info[:2], self.version))
+
+    def dumps(self, data: Dict[str, Any]) -> bytes:
+        return self.tag + marshal.dumps(data, self.version)
+
+    def loads(self, raw: bytes) -> Dict[str, Any]:
+        tag = self.tag
+        if raw[:len(tag)] != tag:
+            raise ValueError(f"Данные FSM записаны другим форматом: {bytes(raw[:4])!r}")
+        return marshal.loads(raw[len(tag):])
+
+
+SERIALIZERS = {'json': JsonSerializer, 'marshal': MarshalSerializer}
+
+
+_KEY = "bot_id = $1 AND chat_id = $2 AND user_id = $3 AND thread_id = $4 AND destiny = $5"
+
+# Запросы идут на каждое обновление — подготовлены на соединениях пула
+_CLEAR_STATE = statements.register(
+    "fsm.clear_state", f"UPDATE FsmStates SET state = NULL WHERE {_KEY}"
+)
+_SET_STATE = statements.register("fsm.set_state", """
+    INSERT INTO FsmStates(bot_id, chat_id, user_id, thread_id, destiny, state, expires_at)
+    VALUES($1, $2, $3, $4, $5, $6, now() + make_interval(secs => $7))
+    ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny) DO UPDATE SET
+        state = EXCLUDED.state,
+        -- у просроченной записи данные уже недействительны
+        data = CASE WHEN FsmStates.expires_at > now() THEN FsmStates.data END,
+        expires_at = EXCLUDED.expires_at
+""")
+_GET_STATE = statements.register(
+    "fsm.get_state", f"SELECT state FROM FsmStates WHERE {_KEY} AND expires_at > now()"
+)
+_CLEAR_DATA = statements.register(
+    "fsm.clear_data", f"UPDATE FsmStates SET data = NULL WHERE {_KEY}"
+)
+_SET_DATA = statements.register("fsm.set_data", """
+    INSERT INTO FsmStates(bot_id, chat_id, user_id, thread_id, destiny, data, expires_at)
+    VALUES($1, $2, $3, $4, $5, $6, now() + make_interval(secs => $7))
+    ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny) DO UPDATE SET
+        state = CASE WHEN FsmStates.expires_at > now() THEN FsmStates.state END,
+        data = EXCLUDED.data,
+        expires_at = EXCLUDED.expires_at
+""")
+_GET_DATA = statements.register(
+    "fsm.get_data", f"SELECT data FROM FsmStates WHERE {_KEY} AND expires_at > now()"
+)
+
+
+class PostgresStorage(BaseStorage):
+    def __init__(self, serializer: Serializer | None = None, ttl: float = FSM_STATE_TTL):
+        self.serializer = serializer or JsonSerializer()
+        self.ttl = ttl
+
+    @staticmethod
+    def _key(key: StorageKey) -> tuple:
+        return key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        state = state.state if isinstance(state, State) else state
+        async with acquire() as conn:
+            if state is None:
+                # Сброс не создаёт записей; опустевшие удалит очистка
+                await _CLEAR_STATE.execute(conn, *self._key(key))
+                return
+            await _SET_STATE.execute(conn, *self._key(key), state, self.ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        async with acquire() as conn:
+            return await _GET_STATE.fetchval(conn, *self._key(key))
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        async with acquire() as conn:
+            if not data:
+                await _CLEAR_DATA.execute(conn, *self._key(key))
+                return
+            await _SET_DATA.execute(conn, *self._key(key), self.serializer.dumps(data), self.ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        async with acquire() as conn:
+            raw = await _GET_DATA.fetchval(conn, *self._key(key))
+        if raw is None:
+            return {}
+        try:
+            return self.serializer.loads(raw)
+        except ValueError:
+            # Запись другого формата (смена FSM_SERIALIZER или версии Python):
+            # диалог начинается заново, а не падает на каждом сообщении
+            logger.warning("Не удалось прочитать данные FSM для %s, сброшены", key)
+            return {}
+
+    async def close(self) -> None:
+        # Пулом соединений владеет database.py
+        pass
+
+
+async def purge_expired() -> int:
+    """Удаляет просроченные и опустевшие диалоги, возвращает их число."""
+    async with acquire() as conn:
+        result = await conn.execute(
+            "DELETE FROM FsmStates WHERE expires_at <= now() OR (state IS NULL AND data IS NULL)"
+        )
+    return int(result.split()[-1])
+
+
+async def _purge_loop():
+    while True:
+        await asyncio.sleep(FSM_PURGE_INTERVAL)
+        try:
+            removed = await purge_expired()
+            if removed:
+                logger.info("Удалено просроченных диалогов FSM: %s", removed)
+        except Exception:
+            logger.exception("Не удалось очистить FsmStates")
+
+
+_purger: asyncio.Task | None = None
+
+
+def start():
+    """Запускает фоновую очистку FsmStates (только для FSM_STORAGE=postgres)."""
+    global _purger
+    if FSM_STORAGE == 'postgres' and _purger is None:
+        _purger = asyncio.create_task(_purge_loop())
+
+
+async def stop():
+    global _purger
+    if _purger is not None:
+        _purger.cancel()
+        await asyncio.gather(_purger, return_exceptions=True)
+        _purger = None
+
+
+def make_storage() -> BaseStorage:
+    """Хранилище по FSM_STORAGE: 'postgres' или 'memory' (один процесс, без БД)."""
+    if FSM_STORAGE == 'memory':
+        return MemoryStorage()
+    return PostgresStorage(SERIALIZERS[FSM_SERIALIZER]())
+
+
+def outer_middleware(dp: Dispatcher, middleware):
+    """Регистрирует внешний middleware на dp.update снаружи FSMContextMiddleware.
+
+    Dispatcher ставит FSMContextMiddleware в __init__, и обычный
+    dp.update.outer_middleware() оказывается внутри него: чтение состояния
+    из FsmStates прошло бы мимо трассировки запросов и метрик обновления.
+    """
+    chain = dp.update.outer_middleware
+    if dp.fsm in chain:
+        chain.unregister(dp.fsm)
+        chain.register(middleware)
+        chain.register(dp.fsm)
+    else:
+        chain.register(middleware)
+    return middleware
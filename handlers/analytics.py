@@ -1,21 +1,39 @@
 # handlers/analytics.py
-import io
-import matplotlib
-matplotlib.use('Agg')
-import matplotlib.pyplot as plt
+import html
 
-from aiogram import F
+from aiogram.filters.callback_data import CallbackData
 from aiogram.types import (
     Message,
+    CallbackQuery,
     ReplyKeyboardMarkup,
     KeyboardButton,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
     BufferedInputFile,
+    FSInputFile,
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from database import create_db_connection
+import charts
+from config import ANALYTICS_PREVIEW_ROWS
+from database import acquire
+import exports
+from identity import Identity
 import keyboards
+import refdata
+import text_router
+
+_CHART_FAILED = "⚠️ Не удалось построить график, попробуйте позже."
+# Запас до лимита Telegram в 4096 символов на сообщение
+_PREVIEW_MAX_CHARS = 3500
+
+
+class ExportCallback(CallbackData, prefix="exp"):
+    report: str               # ключ из exports.REPORTS
+    fmt: str                  # 'csv' или 'xlsx'
+    department_id: int = 0    # для отчёта по группе
+    group: str = ""
 
 
 class AnalyticsStates(StatesGroup):
@@ -25,30 +43,24 @@ class AnalyticsStates(StatesGroup):
 
 
 def register_handlers(dp):
-    dp.message(F.text == '📈 Аналитика')(analytics_menu)
-    dp.message(F.text == '❌ Отмена', AnalyticsStates.CHOOSING)(cancel)
+    routes = text_router.get(dp)
+    routes.add('📈 Аналитика', analytics_menu)
+    routes.add('❌ Отмена', cancel, AnalyticsStates.CHOOSING)
 
-    dp.message(F.text == '🗂 Категоризация')(analytics_start)
-    dp.message(F.text == '📈 Гистограмма по кафедрам')(histogram_departments)
-    dp.message(F.text == '📈 Гистограмма по группам')(histogram_groups)
-    dp.message(F.text == '👥 Студенты с темой')(list_with_topic)
-    dp.message(F.text == '👤 Студенты без темы')(list_without_topic)
+    routes.add('🗂 Категоризация', analytics_start)
+    routes.add('📈 Гистограмма по кафедрам', histogram_departments)
+    routes.add('📈 Гистограмма по группам', histogram_groups)
+    routes.add('👥 Студенты с темой', list_with_topic)
+    routes.add('👤 Студенты без темы', list_without_topic)
 
-    dp.message(AnalyticsStates.WAITING_DEPARTMENT)(process_department)
-    dp.message(AnalyticsStates.WAITING_GROUP)(process_group)
+    routes.fallback(AnalyticsStates.WAITING_DEPARTMENT, process_department)
+    routes.fallback(AnalyticsStates.WAITING_GROUP, process_group)
 
+    dp.callback_query(ExportCallback.filter())(export_report)
 
-async def analytics_menu(message: Message, state: FSMContext):
-    conn = await create_db_connection()
-    try:
-        is_teacher = await conn.fetchval(
-            "SELECT 1 FROM Teachers WHERE telegram_id = $1",
-            str(message.from_user.id),
-        )
-    finally:
-        await conn.close()
 
-    if not is_teacher:
+async def analytics_menu(message: Message, state: FSMContext, identity: Identity):
+    if not identity.is_teacher:
         await message.answer("⚠️ Доступно только преподавателям!")
         return
 
@@ -73,33 +85,22 @@ async def cancel(message: Message, state: FSMContext):
 
 
 async def analytics_start(message: Message, state: FSMContext):
-    conn = await create_db_connection()
-    try:
-        rows = await conn.fetch("SELECT name FROM Departments ORDER BY name")
-    finally:
-        await conn.close()
-
-    buttons = [[KeyboardButton(text=r['name'])] for r in rows]
-    buttons.append([KeyboardButton(text='❌ Отмена')])
-    kb = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
-
-    await message.answer("Выберите кафедру для фильтрации:", reply_markup=kb)
+    await message.answer("Выберите кафедру для фильтрации:", reply_markup=refdata.departments_kb())
     await state.set_state(AnalyticsStates.WAITING_DEPARTMENT)
 
 
 async def process_department(message: Message, state: FSMContext):
-    dept = message.text.strip()
-    await state.update_data(department=dept)
+    dept_id = refdata.department_id(message.text.strip())
+    if dept_id is None:
+        await message.answer("Выберите кафедру кнопкой.", reply_markup=refdata.departments_kb())
+        return
+    await state.update_data(department_id=dept_id)
 
-    conn = await create_db_connection()
-    try:
+    async with acquire() as conn:
         rows = await conn.fetch(
-            "SELECT DISTINCT group_name FROM Students "
-            "WHERE department_id = (SELECT department_id FROM Departments WHERE name = $1)",
-            dept
+            "SELECT DISTINCT group_name FROM Students WHERE department_id = $1",
+            dept_id
         )
-    finally:
-        await conn.close()
 
     buttons = [[KeyboardButton(text=r['group_name'])] for r in rows]
     buttons.append([KeyboardButton(text='❌ Отмена')])
@@ -111,82 +112,46 @@ async def process_department(message: Message, state: FSMContext):
 
 async def process_group(message: Message, state: FSMContext):
     data = await state.get_data()
-    dept = data['department']
+    dept_id = data['department_id']
     grp  = message.text.strip()
 
-    conn = await create_db_connection()
-    try:
-        rows = await conn.fetch(
-            """
-            SELECT s.name AS student_name,
-                   COALESCE(t.title, '—') AS topic_title
-            FROM Students s
-            LEFT JOIN Topics t ON s.student_id = t.student_id
-            WHERE s.department_id = (
-                SELECT department_id FROM Departments WHERE name = $1
-            ) AND s.group_name = $2
-            ORDER BY s.name
-            """,
-            dept, grp
-        )
-    finally:
-        await conn.close()
-
+    rows = await exports.preview('group', dept_id, grp, limit=ANALYTICS_PREVIEW_ROWS)
     if not rows:
         await message.answer("❌ Студентов с темами не найдено.", reply_markup=keyboards.teacher_kb)
     else:
-        text = "👥 <b>Список студентов и их тем:</b>\n" + "\n".join(
-            f"{r['student_name']} — {r['topic_title']}" for r in rows
-        )
-        await message.answer(text, parse_mode="HTML", reply_markup=keyboards.teacher_kb)
+        lines = [f"{html.escape(r['name'])} — {html.escape(r['title'])}" for r in rows]
+        await _send_preview(message, "👥 <b>Список студентов и их тем:</b>", lines,
+                            'group', department_id=dept_id, group=grp)
 
     await state.clear()
 
 
-async def histogram_departments(message: Message):
-    conn = await create_db_connection()
-    try:
-        is_teacher = await conn.fetchval(
-            "SELECT 1 FROM Teachers WHERE telegram_id = $1",
-            str(message.from_user.id)
-        )
-        if not is_teacher:
-            await message.answer("⚠️ Только для преподавателей!")
-            return
+async def histogram_departments(message: Message, identity: Identity):
+    if not identity.is_teacher:
+        await message.answer("⚠️ Только для преподавателей!")
+        return
 
+    async with acquire() as conn:
         rows = await conn.fetch(
             """
-            SELECT d.name AS dept, COUNT(s.student_id) AS cnt
+            SELECT d.name AS dept, COALESCE(ds.students, 0) AS cnt
             FROM Departments d
-            LEFT JOIN Students s ON d.department_id = s.department_id
-            GROUP BY d.name
+            LEFT JOIN DepartmentStats ds ON ds.department_id = d.department_id
             ORDER BY cnt DESC
             """
         )
-    finally:
-        await conn.close()
 
     names  = [r['dept'] for r in rows]
     counts = [r['cnt']  for r in rows]
     idx    = list(range(1, len(names) + 1))
 
-    fig, ax = plt.subplots()
-    ax.bar(idx, counts, width=0.6)
-    ax.set_title("Распределение студентов по кафедрам")
-    ax.set_xlabel("Номер кафедры")
-    ax.set_ylabel("Количество студентов")
-    ax.set_xticks(idx)
-    ax.set_xticklabels(idx)
-    ax.set_yticks(range(0, max(counts) + 1))
-    ax.grid(axis='y', linestyle='--', alpha=0.5)
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close(fig)
-
-    photo = BufferedInputFile(buf.getvalue(), filename="depts.png")
+    try:
+        png = await charts.render('departments', names, counts)
+    except charts.ChartError:
+        await message.answer(_CHART_FAILED, reply_markup=keyboards.teacher_kb)
+        return
+
+    photo = BufferedInputFile(png, filename="depts.png")
     await message.answer_photo(photo, caption="📊 Студентов по кафедрам", reply_markup=keyboards.teacher_kb)
 
     legend = "🔢 Расшифровка:\n" + "\n".join(f"{i} — {n}: {c}" for i,n,c in zip(idx, names, counts))
@@ -194,40 +159,28 @@ async def histogram_departments(message: Message):
 
 
 async def histogram_groups(message: Message):
-    conn = await create_db_connection()
-    try:
+    async with acquire() as conn:
         rows = await conn.fetch(
             """
-            SELECT s.group_name AS grp, COUNT(*) AS cnt
-            FROM Students s
-            JOIN Topics t ON s.student_id = t.student_id
-            WHERE t.status = 'closed'
-            GROUP BY s.group_name
+            SELECT NULLIF(group_name, '') AS grp, SUM(students_closed) AS cnt
+            FROM GroupStats
+            WHERE students_closed > 0
+            GROUP BY grp
             ORDER BY cnt DESC
             """
         )
-    finally:
-        await conn.close()
 
     groups = [r['grp'] for r in rows]
     counts = [r['cnt'] for r in rows]
     idx    = list(range(1, len(groups) + 1))
 
-    fig, ax = plt.subplots()
-    ax.bar(idx, counts)
-    ax.set_title("Студенты с одобренными темами по группам")
-    ax.set_xlabel("Номер группы")
-    ax.set_ylabel("Количество студентов")
-    ax.set_xticks(idx)
-    ax.set_xticklabels(idx, rotation=45)
-    plt.tight_layout()
-
-    buf = io.BytesIO()
-    fig.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close(fig)
-
-    photo = BufferedInputFile(buf.getvalue(), filename="groups.png")
+    try:
+        png = await charts.render('groups', groups, counts)
+    except charts.ChartError:
+        await message.answer(_CHART_FAILED, reply_markup=keyboards.teacher_kb)
+        return
+
+    photo = BufferedInputFile(png, filename="groups.png")
     await message.answer_photo(photo, caption="📊 Студентов по группам", reply_markup=keyboards.teacher_kb)
 
     legend = "🔢 Расшифровка:\n" + "\n".join(f"{i} — {g}: {c}" for i,g,c in zip(idx, groups, counts))
@@ -235,44 +188,69 @@ async def histogram_groups(message: Message):
 
 
 async def list_with_topic(message: Message):
-    conn = await create_db_connection()
-    try:
-        rows = await conn.fetch(
-            """
-            SELECT s.name, t.title
-            FROM Students s
-            JOIN Topics t ON s.student_id = t.student_id
-            WHERE t.status = 'closed'
-            ORDER BY s.name
-            """
-        )
-    finally:
-        await conn.close()
-
+    rows = await exports.preview('with_topic', limit=ANALYTICS_PREVIEW_ROWS)
     if not rows:
         await message.answer("Нет студентов с одобренными темами.", reply_markup=keyboards.teacher_kb)
     else:
-        text = "👥 Студенты с темой:\n" + "\n".join(f"{r['name']} — «{r['title']}»" for r in rows)
-        await message.answer(text, reply_markup=keyboards.teacher_kb)
+        lines = [f"{html.escape(r['name'])} — «{html.escape(r['title'])}»" for r in rows]
+        await _send_preview(message, "👥 Студенты с темой:", lines, 'with_topic')
 
 
 async def list_without_topic(message: Message):
-    conn = await create_db_connection()
-    try:
-        rows = await conn.fetch(
-            """
-            SELECT s.name
-            FROM Students s
-            LEFT JOIN Topics t ON s.student_id = t.student_id
-            WHERE t.student_id IS NULL
-            ORDER BY s.name
-            """
-        )
-    finally:
-        await conn.close()
-
+    rows = await exports.preview('without_topic', limit=ANALYTICS_PREVIEW_ROWS)
     if not rows:
         await message.answer("Все студенты выбрали темы.", reply_markup=keyboards.teacher_kb)
     else:
-        text = "👤 Студенты без темы:\n" + "\n".join(r['name'] for r in rows)
-        await message.answer(text, reply_markup=keyboards.teacher_kb)
+        lines = [html.escape(r['name']) for r in rows]
+        await _send_preview(message, "👤 Студенты без темы:", lines, 'without_topic')
+
+
+# ---- Выгрузка в файл ----
+
+async def _send_preview(message: Message, header: str, lines: list[str], report: str,
+                        department_id: int = 0, group: str = ""):
+    """Первые строки отчёта в чат и кнопки выгрузки полного списка файлом.
+
+    lines — ANALYTICS_PREVIEW_ROWS + 1 строк от exports.preview(), уже в HTML.
+    """
+    shown = []
+    size = len(header)
+    for line in lines[:ANALYTICS_PREVIEW_ROWS]:
+        size += len(line) + 1
+        if size > _PREVIEW_MAX_CHARS:
+            break
+        shown.append(line)
+    text = "\n".join([header] + shown)
+    if len(shown) < len(lines):
+        text += f"\n… показаны первые {len(shown)}, полный список — в файле"
+    await message.answer(text, parse_mode="HTML", reply_markup=keyboards.teacher_kb)
+
+    try:
+        kb = InlineKeyboardMarkup(inline_keyboard=[[
+            InlineKeyboardButton(
+                text=f"⬇️ {fmt.upper()}",
+                callback_data=ExportCallback(report=report, fmt=fmt, department_id=department_id,
+                                             group=group).pack()
+            )
+            for fmt in exports.FORMATS
+        ]])
+    except ValueError:
+        # Название группы не помещается в callback_data (64 байта) или содержит «:»
+        return
+    await message.answer("Выгрузить полный список:", reply_markup=kb)
+
+
+async def export_report(query: CallbackQuery, callback_data: ExportCallback, identity: Identity):
+    if not identity.is_teacher:
+        return await query.answer("⚠️ Доступно только преподавателям!", show_alert=True)
+    if callback_data.report not in exports.REPORTS or callback_data.fmt not in exports.FORMATS:
+        return await query.answer("Этот отчёт больше недоступен.", show_alert=True)
+    await query.answer("⏳ Готовлю файл…")
+
+    args = ((callback_data.department_id, callback_data.group)
+            if callback_data.report == 'group' else ())
+    async with exports.export(callback_data.report, callback_data.fmt, *args) as result:
+        await query.message.answer_document(
+            FSInputFile(result.path, filename=result.filename),
+            caption=f"{exports.REPORTS[callback_data.report].title}: {result.rows} строк"
+        )
@@ -0,0 +1,139 @@
+# handlers/broadcast.py
+from aiogram.filters import Command, CommandObject
+from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+
+import broadcaster
+from identity import Identity
+import keyboards
+import text_router
+
+
+class BroadcastStates(StatesGroup):
+    WAITING_AUDIENCE = State()
+    WAITING_GROUP = State()
+    WAITING_TEXT = State()
+    WAITING_CONFIRM = State()
+
+
+# Подпись кнопки -> аудитория из broadcaster.AUDIENCES
+_AUDIENCE_BUTTONS = {
+    broadcaster.AUDIENCES[name][0]: name
+    for name in ('students_without_topic', 'students_reserved', 'department',
+                 'group', 'all_students', 'teachers')
+}
+
+
+def register_handlers(dp):
+    routes = text_router.get(dp)
+    routes.add('📣 Рассылка', broadcast_start)
+    routes.add('❌ Отмена', cancel_broadcast, BroadcastStates)
+    routes.fallback(BroadcastStates.WAITING_AUDIENCE, process_audience)
+    routes.fallback(BroadcastStates.WAITING_GROUP, process_group)
+    routes.fallback(BroadcastStates.WAITING_TEXT, process_text)
+    routes.fallback(BroadcastStates.WAITING_CONFIRM, process_confirm)
+
+    dp.message(Command("stop_broadcast"))(stop_broadcast)
+
+
+async def broadcast_start(message: Message, state: FSMContext, identity: Identity):
+    if not identity.is_teacher:
+        await message.answer("⚠️ Доступно только преподавателям!")
+        return
+
+    buttons = [[KeyboardButton(text=label)] for label in _AUDIENCE_BUTTONS]
+    buttons.append([KeyboardButton(text='❌ Отмена')])
+    kb = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+    await message.answer("Кому отправить сообщение?", reply_markup=kb)
+    await state.set_state(BroadcastStates.WAITING_AUDIENCE)
+
+
+async def cancel_broadcast(message: Message, state: FSMContext):
+    await state.clear()
+    await message.answer("Рассылка отменена.", reply_markup=keyboards.teacher_kb)
+
+
+async def _ask_text(message: Message, state: FSMContext, audience: str, param=None):
+    size = await broadcaster.audience_size(audience, param)
+    if not size:
+        await state.clear()
+        await message.answer("В этой аудитории нет получателей.", reply_markup=keyboards.teacher_kb)
+        return
+    await state.update_data(audience=audience, param=param, size=size)
+    await message.answer(
+        f"Получателей: {size}. Введите текст сообщения:",
+        reply_markup=keyboards.cancel_kb
+    )
+    await state.set_state(BroadcastStates.WAITING_TEXT)
+
+
+async def process_audience(message: Message, state: FSMContext, identity: Identity):
+    audience = _AUDIENCE_BUTTONS.get(message.text)
+    if audience is None:
+        return await message.answer("Выберите аудиторию кнопкой.")
+
+    if audience == 'group':
+        await message.answer("Введите название группы:", reply_markup=keyboards.cancel_kb)
+        await state.set_state(BroadcastStates.WAITING_GROUP)
+    elif audience == 'department':
+        # Кафедра преподавателя, который делает рассылку
+        if identity.department_id is None:
+            await state.clear()
+            return await message.answer("У вас не указана кафедра.", reply_markup=keyboards.teacher_kb)
+        await _ask_text(message, state, audience, identity.department_id)
+    else:
+        await _ask_text(message, state, audience)
+
+
+async def process_group(message: Message, state: FSMContext):
+    await _ask_text(message, state, 'group', message.text.strip())
+
+
+async def process_text(message: Message, state: FSMContext):
+    text = (message.text or '').strip()
+    if not text:
+        return await message.answer("Введите текст сообщения:")
+    data = await state.update_data(text=text)
+
+    kb = ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text='✅ Отправить')],
+            [KeyboardButton(text='❌ Отмена')],
+        ],
+        resize_keyboard=True
+    )
+    await message.answer(
+        f"Сообщение получат {data['size']} чел.:\n\n{text}\n\nОтправить?",
+        reply_markup=kb
+    )
+    await state.set_state(BroadcastStates.WAITING_CONFIRM)
+
+
+async def process_confirm(message: Message, state: FSMContext):
+    if message.text != '✅ Отправить':
+        return await message.answer("Нажмите «✅ Отправить» или «❌ Отмена».")
+    data = await state.get_data()
+    await state.clear()
+
+    broadcast_id, total = await broadcaster.create(
+        data['audience'], data['text'], message.chat.id, data['param']
+    )
+    broadcaster.start(message.bot, broadcast_id)
+    await message.answer(
+        f"📣 Рассылка #{broadcast_id} запущена: {total} получателей.\n"
+        f"Прогресс будет приходить сюда. Остановить: /stop_broadcast {broadcast_id}",
+        reply_markup=keyboards.teacher_kb
+    )
+
+
+async def stop_broadcast(message: Message, command: CommandObject, identity: Identity):
+    if not identity.is_teacher:
+        return
+    if not command.args or not command.args.strip().isdigit():
+        return await message.answer("Укажите номер рассылки: /stop_broadcast 12")
+    broadcast_id = int(command.args.strip())
+    await broadcaster.cancel(broadcast_id)
+    p = broadcaster.progress(broadcast_id)
+    status = f"\n{p.report()}" if p else ""
+    await message.answer(f"⏹ Рассылка #{broadcast_id} остановлена.{status}")
@@ -1,98 +1,88 @@
 # handlers/categories.py
-import json
-from aiogram import F
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
+from aiogram.types import Message
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.fsm.context import FSMContext
-from database import create_db_connection
+from database import acquire
+import eventlog
+from handlers import pagination
+from identity import Identity
 import keyboards
+import refdata
+import statements
+import text_router
 from handlers.misc import cancel_handler
 
-# Утилита логирования
-async def log_action(conn, user_id: str, action: str, details: dict):
-    await conn.execute(
-        """
-        INSERT INTO Logs(user_id, action, details)
-        VALUES($1, $2, $3)
-        """,
-        user_id,
-        action,
-        json.dumps(details)
-    )
-
-# Состояния для поиска по категориям
+# Поиск по дереву категорий любой глубины: на каждом шаге выбирается
+# подкатегория или «📄 Темы раздела» — темы всего поддерева
 class CatStates(StatesGroup):
-    WAITING_CATEGORY    = State()
-    WAITING_SUBCATEGORY = State()
+    BROWSING = State()
 
 
 def register_handlers(dp):
-    dp.message(F.text == '📂 По категории')(start_cat_search)
-    dp.message(F.text == '❌ Отмена', CatStates.WAITING_CATEGORY)(cancel_handler)
-    dp.message(F.text == '❌ Отмена', CatStates.WAITING_SUBCATEGORY)(cancel_handler)
-    dp.message(CatStates.WAITING_CATEGORY)(process_category)
-    dp.message(CatStates.WAITING_SUBCATEGORY)(process_subcategory)
+    routes = text_router.get(dp)
+    routes.add('📂 По категории', start_cat_search)
+    routes.add('❌ Отмена', cancel_handler, CatStates)
+    routes.add(refdata.SUBTREE_TOPICS_BUTTON, show_subtree_topics, CatStates.BROWSING)
+    routes.fallback(CatStates.BROWSING, process_category)
 
 async def start_cat_search(message: Message, state: FSMContext):
-    conn = await create_db_connection()
-    try:
-        rows = await conn.fetch("SELECT category_id, name FROM Categories ORDER BY name")
-    finally:
-        await conn.close()
-    kb = ReplyKeyboardMarkup(resize_keyboard=True)
-    for r in rows:
-        kb.add(KeyboardButton(text=f"{r['category_id']}|{r['name']}"))
-    kb.add(KeyboardButton('❌ Отмена'))
-    await message.answer("Выберите категорию:", reply_markup=kb)
-    await state.set_state(CatStates.WAITING_CATEGORY)
+    await state.set_data({})
+    await message.answer("Выберите категорию:", reply_markup=refdata.categories_kb())
+    await state.set_state(CatStates.BROWSING)
+
+# Счётчики поддерживаются триггерами (миграция 11): один запрос по ключу
+_COUNTS = statements.register(
+    "categories.counts", "SELECT topics, free_topics FROM CategoryStats WHERE category_id = $1"
+)
 
-async def process_category(message: Message, state: FSMContext):
-    cat_id, cat_name = message.text.split('|', 1)
-    await state.update_data(category_id=int(cat_id), category_name=cat_name)
-    conn = await create_db_connection()
-    try:
-        rows = await conn.fetch(
-            "SELECT subcategory_id, name FROM Subcategories WHERE category_id=$1 ORDER BY name",
-            int(cat_id)
-        )
-    finally:
-        await conn.close()
-    kb = ReplyKeyboardMarkup(resize_keyboard=True)
-    for r in rows:
-        kb.add(KeyboardButton(text=f"{r['subcategory_id']}|{r['name']}"))
-    kb.add(KeyboardButton('❌ Отмена'))
-    await message.answer(f"Категория «{cat_name}». Выберите подкатегорию:", reply_markup=kb)
-    await state.set_state(CatStates.WAITING_SUBCATEGORY)
+async def _counts(category_id: int):
+    async with acquire() as conn:
+        row = await _COUNTS.fetchrow(conn, category_id)
+    return (row['topics'], row['free_topics']) if row else (0, 0)
 
-async def process_subcategory(message: Message, state: FSMContext):
-    sub_id, sub_name = message.text.split('|', 1)
+async def process_category(message: Message, state: FSMContext, identity: Identity):
+    # Кнопки — названия; id ищется среди подкатегорий текущего раздела
     data = await state.get_data()
-    conn = await create_db_connection()
-    try:
-        topics = await conn.fetch(
-            """
-            SELECT title, COALESCE(description,'—') AS desc
-            FROM Topics
-            WHERE subcategory_id = $1
-            ORDER BY title
-            """, int(sub_id)
-        )
-        # Логируем поиск по категории
-        await log_action(
-            conn,
-            str(message.from_user.id),
-            'search_by_category',
-            {'category': data['category_name'], 'subcategory': sub_name, 'count': len(topics)}
-        )
-    finally:
-        await conn.close()
+    cat_id = refdata.category_id(data.get('category_id'), message.text.strip())
+    if cat_id is None:
+        await message.answer("Выберите категорию кнопкой.")
+        return
+    cat_name = refdata.category_name(cat_id)
+    await state.update_data(category_id=cat_id, category_name=cat_name)
 
-    if not topics:
-        await message.answer("Тем не найдено.", reply_markup=keyboards.student_kb)
-    else:
-        lines = [f"📂 Темы в подкатегории «{sub_name}»:"]
-        for t in topics:
-            lines.append(f"• {t['title']}")
-        await message.answer("\n".join(lines), reply_markup=keyboards.student_kb)
+    # У листа выбирать больше нечего — сразу показываем темы
+    if not refdata.has_subcategories(cat_id):
+        await _show_topics(message, state, identity, cat_id, cat_name)
+        return
+
+    topics, free = await _counts(cat_id)
+    await message.answer(
+        f"📂 «{cat_name}»: тем {topics}, из них свободных {free}.\n"
+        f"Выберите подкатегорию или «{refdata.SUBTREE_TOPICS_BUTTON}»:",
+        reply_markup=refdata.subcategories_kb(cat_id)
+    )
 
+async def show_subtree_topics(message: Message, state: FSMContext, identity: Identity):
+    data = await state.get_data()
+    if 'category_id' not in data:
+        await message.answer("Сначала выберите категорию.", reply_markup=refdata.categories_kb())
+        return
+    await _show_topics(message, state, identity, data['category_id'], data['category_name'])
+
+async def _show_topics(message: Message, state: FSMContext, identity: Identity,
+                       cat_id: int, cat_name: str):
     await state.clear()
+    topics, free = await _counts(cat_id)
+    # Логируем поиск по категории
+    eventlog.log_action(
+        str(message.from_user.id),
+        'search_by_category',
+        {'category': cat_name, 'category_id': cat_id, 'count': topics}
+    )
+
+    kb = keyboards.teacher_kb if identity.is_teacher else keyboards.student_kb
+    if not topics:
+        await message.answer("Тем не найдено.", reply_markup=kb)
+        return
+    await message.answer(f"📂 «{cat_name}»: тем {topics}, из них свободных {free}.", reply_markup=kb)
+    await pagination.send_first_page(message, 'cat', str(cat_id))
@@ -11,24 +11,27 @@ from aiogram.types import (
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from database import create_db_connection
+from database import acquire
+from identity import Identity, get_identity
 import keyboards
+import reservations
+import text_router
 
 class ChooseTopicStates(StatesGroup):
     WAITING_TITLE = State()
 
 def register_handlers(dp):
-    dp.message(F.text == '🎯 Выбираю тему')(choose_topic_start)
-    dp.message(F.text == '❌ Отмена', ChooseTopicStates.WAITING_TITLE)(cancel_choose)
-    dp.message(ChooseTopicStates.WAITING_TITLE)(process_choose)
+    routes = text_router.get(dp)
+    routes.add('🎯 Выбираю тему', choose_topic_start)
+    routes.add('❌ Отмена', cancel_choose, ChooseTopicStates.WAITING_TITLE)
+    routes.fallback(ChooseTopicStates.WAITING_TITLE, process_choose)
 
     dp.callback_query(F.data.startswith("approve_choose:"))(approve_choose)
     dp.callback_query(F.data.startswith("decline_choose:"))(decline_choose)
 
 
 async def choose_topic_start(message: Message, state: FSMContext):
-    conn = await create_db_connection()
-    try:
+    async with acquire() as conn:
         rows = await conn.fetch("""
             SELECT title, topic_id, teacher_id
             FROM Topics
@@ -36,8 +39,6 @@ async def choose_topic_start(message: Message, state: FSMContext):
               AND student_id IS NULL
               AND status = 'free'
         """)
-    finally:
-        await conn.close()
 
     if not rows:
         return await message.answer(
@@ -77,14 +78,11 @@ async def process_choose(message: Message, state: FSMContext):
     student_tg = str(message.from_user.id)
 
     # получаем telegram_id преподавателя
-    conn = await create_db_connection()
-    try:
+    async with acquire() as conn:
         teacher_tg = await conn.fetchval(
             "SELECT telegram_id FROM Teachers WHERE teacher_id = $1",
             teacher_id
         )
-    finally:
-        await conn.close()
 
     markup = InlineKeyboardMarkup(inline_keyboard=[[
         InlineKeyboardButton(text="✅ Одобрить", callback_data=f"approve_choose:{topic_id}:{student_tg}"),
@@ -104,33 +102,44 @@ async def process_choose(message: Message, state: FSMContext):
     await state.clear()
 
 
-async def approve_choose(query: CallbackQuery):
+async def approve_choose(query: CallbackQuery, identity: Identity):
+    # callback_data присылает клиент: одобрять может только преподаватель,
+    # и только свою тему (проверяется в reservations.claim)
+    if not identity.is_teacher:
+        return await query.answer("Одобрять выбор темы может только преподаватель", show_alert=True)
     _, topic_id_str, student_tg = query.data.split(":")
-    topic_id = int(topic_id_str)
-    conn = await create_db_connection()
-    try:
-        await conn.execute(
-            """
-            UPDATE Topics
-               SET student_id = (
-                   SELECT student_id FROM Students WHERE telegram_id = $1
-               ), status = 'closed'
-             WHERE topic_id = $2
-            """,
-            student_tg, topic_id
-        )
-    finally:
-        await conn.close()
+    student = await get_identity(student_tg)
+    if not student.is_student:
+        return await query.answer("Студент не найден", show_alert=True)
 
-    # уведомляем студента
-    await query.bot.send_message(
-        chat_id=int(student_tg),
-        text="✅ Ваш выбор темы одобрен преподавателем."
+    result = await reservations.claim(
+        student.student_id, topic_id=int(topic_id_str),
+        status='closed', teacher_id=identity.teacher_id
     )
+    if result.outcome == 'has_topic':
+        return await query.answer(
+            f"За студентом уже закреплена тема «{result.title}»", show_alert=True
+        )
+    if result.outcome == 'taken':
+        holder = result.holder_name or "другой студент"
+        return await query.answer(f"Тему уже закрепил {holder}", show_alert=True)
+    if result.outcome == 'not_found':
+        return await query.answer("Тема удалена", show_alert=True)
+    if result.outcome == 'forbidden':
+        return await query.answer("Это тема другого преподавателя", show_alert=True)
+
+    if result.outcome == 'claimed':
+        # уведомляем студента
+        await query.bot.send_message(
+            chat_id=int(student_tg),
+            text=f"✅ Ваш выбор темы «{result.title}» одобрен преподавателем."
+        )
     await query.answer("Тема закреплена за студентом")
 
 
-async def decline_choose(query: CallbackQuery):
+async def decline_choose(query: CallbackQuery, identity: Identity):
+    if not identity.is_teacher:
+        return await query.answer("Отклонять выбор темы может только преподаватель", show_alert=True)
     _, topic_id, student_tg = query.data.split(":")
     await query.bot.send_message(
         chat_id=int(student_tg),
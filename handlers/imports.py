@@ -0,0 +1,161 @@
+# handlers/imports.py
+import csv
+import io
+import logging
+
+import asyncpg
+from aiogram import F
+from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, BufferedInputFile
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+
+import bulk_import
+from config import IMPORT_MAX_FILE_SIZE
+import eventlog
+from identity import Identity
+import keyboards
+import text_router
+
+logger = logging.getLogger(__name__)
+
+# Сколько ошибок показать в сообщении; полный список приходит файлом
+_ERRORS_INLINE = 20
+
+# Подпись кнопки -> вид импорта из bulk_import.KINDS
+_KIND_BUTTONS = {
+    '📚 Темы': 'topics',
+    '👥 Список группы': 'roster',
+}
+
+_FORMATS = {
+    'topics': (
+        "Пришлите файл CSV или XLSX со списком тем. Первая строка — заголовки:\n"
+        "• <b>Название</b> — не короче 5 символов;\n"
+        "• <b>Ключевые слова</b> — через запятую или «;»;\n"
+        "• Описание — необязательно, не короче 10 символов;\n"
+        "• Кафедра — необязательно, по умолчанию ваша.\n"
+        "Темы с уже существующими названиями пропускаются."
+    ),
+    'roster': (
+        "Пришлите файл CSV или XLSX со списком группы. Первая строка — заголовки:\n"
+        "• <b>ФИО</b>;\n"
+        "• <b>Группа</b> — например, КС-46;\n"
+        "• Email, Телефон (+79991234567) — необязательно;\n"
+        "• Кафедра — необязательно, по умолчанию ваша.\n"
+        "Студенты, которые уже есть в базе (тот же email или ФИО в группе), пропускаются. "
+        "Студент получит свою запись из списка, если при регистрации в боте укажет тот же email."
+    ),
+}
+
+
+class ImportStates(StatesGroup):
+    CHOOSING_KIND = State()
+    WAITING_FILE = State()
+
+
+def register_handlers(dp):
+    routes = text_router.get(dp)
+    routes.add('📥 Импорт', import_start)
+    routes.add('❌ Отмена', cancel_import, ImportStates)
+    routes.fallback(ImportStates.CHOOSING_KIND, process_kind)
+    routes.fallback(ImportStates.WAITING_FILE, remind_file)
+
+    # Документы идут мимо text_router: он разбирает только текст
+    dp.message(ImportStates.WAITING_FILE, F.document)(process_file)
+
+
+async def import_start(message: Message, state: FSMContext, identity: Identity):
+    if not identity.is_teacher:
+        return await message.answer("⚠️ Доступно только преподавателям!")
+
+    buttons = [[KeyboardButton(text=label)] for label in _KIND_BUTTONS]
+    buttons.append([KeyboardButton(text='❌ Отмена')])
+    kb = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
+    await message.answer("Что импортировать?", reply_markup=kb)
+    await state.set_state(ImportStates.CHOOSING_KIND)
+
+
+async def cancel_import(message: Message, state: FSMContext):
+    await state.clear()
+    await message.answer("Импорт отменён.", reply_markup=keyboards.teacher_kb)
+
+
+async def process_kind(message: Message, state: FSMContext):
+    kind = _KIND_BUTTONS.get(message.text)
+    if kind is None:
+        return await message.answer("Выберите, что импортировать, кнопкой.")
+    await state.update_data(kind=kind)
+    await message.answer(_FORMATS[kind], parse_mode="HTML", reply_markup=keyboards.cancel_kb)
+    await state.set_state(ImportStates.WAITING_FILE)
+
+
+async def remind_file(message: Message):
+    await message.answer("Пришлите файл .csv или .xlsx документом или нажмите «❌ Отмена».")
+
+
+def _report(result: bulk_import.ImportResult) -> str:
+    what = "Тем" if result.kind == 'topics' else "Студентов"
+    lines = [
+        f"📥 Строк в файле: {result.rows}",
+        f"✅ {what} добавлено: {result.added}",
+    ]
+    if result.existing:
+        shown = ", ".join(map(str, result.existing[:_ERRORS_INLINE]))
+        more = "…" if len(result.existing) > _ERRORS_INLINE else ""
+        lines.append(f"↩️ Уже были в базе: {len(result.existing)} (строки {shown}{more})")
+    if result.errors:
+        lines.append(f"⚠️ С ошибками: {len(result.errors)}")
+        lines += [f"  строка {e.line}: {e.message}" for e in result.errors[:_ERRORS_INLINE]]
+        if len(result.errors) > _ERRORS_INLINE:
+            lines.append("  … полный список — в файле ниже.")
+    return "\n".join(lines)
+
+
+def _errors_file(result: bulk_import.ImportResult) -> BufferedInputFile:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, delimiter=';')
+    writer.writerow(["Строка", "Ошибка"])
+    writer.writerows((e.line, e.message) for e in result.errors)
+    # BOM — чтобы Excel открыл файл в UTF-8
+    return BufferedInputFile(buffer.getvalue().encode('utf-8-sig'), filename="import_errors.csv")
+
+
+async def process_file(message: Message, state: FSMContext, identity: Identity):
+    if not identity.is_teacher:
+        await state.clear()
+        return await message.answer("⚠️ Доступно только преподавателям!")
+    document = message.document
+    if document.file_size and document.file_size > IMPORT_MAX_FILE_SIZE:
+        return await message.answer(
+            f"⚠️ Файл больше {IMPORT_MAX_FILE_SIZE // (1024 * 1024)} МБ — разбейте его на части."
+        )
+    data = await state.get_data()
+    kind = data.get('kind')
+    if kind not in bulk_import.KINDS:
+        await state.clear()
+        return await message.answer("❌ Повторите команду.", reply_markup=keyboards.teacher_kb)
+
+    file = await message.bot.download(document)
+    try:
+        result = await bulk_import.run(
+            file.getvalue(), document.file_name or "", kind,
+            identity.teacher_id, identity.department_id
+        )
+    except bulk_import.ImportFileError as e:
+        # Файл можно исправить и прислать снова, не выходя из импорта
+        return await message.answer(f"⚠️ {e}")
+    except asyncpg.UniqueViolationError:
+        # Те же email одновременно появились в базе другим путём
+        logger.warning("Импорт %s прерван конфликтом уникальности", kind, exc_info=True)
+        return await message.answer("⚠️ Данные изменились во время импорта, пришлите файл ещё раз.")
+
+    await state.clear()
+    # Запись об импорте нужна для разбора «откуда взялись эти строки» — ждём место в очереди
+    await eventlog.wait_for_room()
+    eventlog.log_action(str(message.from_user.id), 'bulk_import', {
+        'kind': kind, 'rows': result.rows, 'added': result.added,
+        'existing': len(result.existing), 'errors': len(result.errors),
+    })
+    await message.answer(_report(result), reply_markup=keyboards.teacher_kb)
+    if len(result.errors) > _ERRORS_INLINE:
+        await message.answer_document(_errors_file(result), caption="Ошибки импорта по строкам")
@@ -0,0 +1,340 @@
+# handlers/pagination.py
+"""Постраничный просмотр тем с кнопками ◀ ▶ в одном сообщении.
+
+Страница — компактный список «номер. название — преподаватель»; полная
+карточка темы загружается по нажатию на номер. Листание редактирует то же
+сообщение, каждый шаг — один небольшой запрос по индексу.
+
+Списки из БД (свободные темы, темы категории) листаются по ключу
+(title, topic_id): в callback_data хранится topic_id крайней темы страницы,
+её название берётся подзапросом по первичному ключу. Результаты поиска упорядочены по
+релевантности, поэтому их id запоминаются в таблице SearchResults и листаются
+по смещению — в любом процессе бота.
+"""
+import html
+import logging
+import secrets
+
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.filters.callback_data import CallbackData
+from aiogram.types import (
+    Message,
+    CallbackQuery,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+)
+
+from config import TOPICS_PAGE_SIZE, SEARCH_RESULTS_TTL
+from database import acquire
+import statements
+
+logger = logging.getLogger(__name__)
+
+
+class PageCallback(CallbackData, prefix="pg"):
+    scope: str        # 'free', 'dept', 'cat' или 'res'
+    param: str = ""   # department_id для 'dept', category_id для 'cat', ключ результатов для 'res'
+    anchor: int = 0   # topic_id крайней темы (для 'res' — смещение); 0 — начало
+    direction: str = "a"  # 'n' — после anchor, 'p' — до anchor, 'a' — начиная с anchor
+
+
+class CardCallback(CallbackData, prefix="tc"):
+    topic_id: int
+    # Куда вернуться по «⬅ К списку»
+    scope: str
+    param: str = ""
+    anchor: int = 0
+
+
+def register_handlers(dp):
+    dp.callback_query(PageCallback.filter())(turn_page)
+    dp.callback_query(CardCallback.filter())(show_card)
+
+
+_STATUS_ICONS = {'free': '🟢', 'reserved': '🟡', 'closed': '🔴'}
+
+_TITLES = {
+    'free': "📚 Свободные темы",
+    'dept': "📚 Свободные темы кафедры",
+    'cat': "📂 Темы категории",
+}
+
+# Условия списков, которые листаются по ключу; $2 — param
+_SCOPE_WHERE = {
+    'free': "t.status = 'free'",
+    'dept': "t.status = 'free' AND t.department_id = $2",
+    # Все темы поддерева категории, без рекурсии: через таблицу замыкания
+    'cat': """t.topic_id IN (
+            SELECT tc.topic_id
+              FROM CategoryClosure cc
+              JOIN TopicCategories tc ON tc.category_id = cc.descendant_id
+             WHERE cc.ancestor_id = $2)""",
+}
+
+_KEYSET_SQL = """
+    SELECT t.topic_id, t.title, t.status,
+           COALESCE(te.name, 'Не назначен') AS teacher_name
+      FROM Topics t
+      LEFT JOIN Teachers te ON te.teacher_id = t.teacher_id
+     WHERE {where}{cursor}
+     ORDER BY t.title {order}, t.topic_id {order}
+     LIMIT $1
+"""
+
+# Отдельный текст запроса для первой страницы, а не «$n = 0 OR ...»:
+# иначе обобщённый план подготовленного запроса не сможет идти по индексу
+_CURSOR_SQL = """
+       AND (t.title, t.topic_id) {op}
+           (SELECT a.title, a.topic_id FROM Topics a WHERE a.topic_id = {anchor})"""
+
+# Просроченные результаты удаляются попутно, по индексу expires_at
+_REMEMBER_SQL = """
+    WITH purged AS (
+        DELETE FROM SearchResults WHERE expires_at <= now()
+    )
+    INSERT INTO SearchResults(key, title, topic_ids, expires_at)
+    VALUES($1, $2, $3::int[], now() + $4 * interval '1 second')
+"""
+
+# Страница результатов: $1 — ключ, $2 — смещение, $3 — размер страницы.
+# Строка с заголовком есть всегда, пока результаты не устарели; удалённые
+# с тех пор темы пропускаются
+_RESULTS_PAGE_SQL = """
+    SELECT r.title AS list_title, cardinality(r.topic_ids) AS total,
+           p.topic_id, p.title, p.status, p.teacher_name
+      FROM SearchResults r
+      LEFT JOIN LATERAL (
+          SELECT t.topic_id, t.title, t.status,
+                 COALESCE(te.name, 'Не назначен') AS teacher_name, ids.n
+            FROM unnest(r.topic_ids[$2 + 1 : $2 + $3]) WITH ORDINALITY ids(topic_id, n)
+            JOIN Topics t ON t.topic_id = ids.topic_id
+            LEFT JOIN Teachers te ON te.teacher_id = t.teacher_id
+      ) p ON true
+     WHERE r.key = $1 AND r.expires_at > now()
+     ORDER BY p.n
+"""
+
+_CARD_SQL = """
+    SELECT t.title, t.description, t.keywords, t.status,
+           COALESCE(te.name, 'Не назначен') AS teacher_name,
+           COALESCE(s.name, '—') AS student_name
+      FROM Topics t
+      LEFT JOIN Teachers te ON te.teacher_id = t.teacher_id
+      LEFT JOIN Students s ON s.student_id = t.student_id
+     WHERE t.topic_id = $1
+"""
+
+def _direction(direction: str) -> tuple[str, str]:
+    """Оператор сравнения с якорем и порядок сортировки для направления."""
+    if direction == 'p':
+        return '<', 'DESC'
+    return ('>=' if direction == 'a' else '>'), 'ASC'
+
+
+# Все варианты запроса страницы готовятся заранее: (раздел, направление, есть ли якорь)
+_KEYSET: dict[tuple[str, str, bool], statements.Statement] = {}
+for _scope, _where in _SCOPE_WHERE.items():
+    _anchor = '$3' if '$2' in _where else '$2'
+    for _dir in ('a', 'n', 'p'):
+        _op, _order = _direction(_dir)
+        for _anchored in (False, True):
+            _cursor = _CURSOR_SQL.format(op=_op, anchor=_anchor) if _anchored else ''
+            # Без якоря 'a' и 'n' дают один и тот же текст — и одно имя
+            _name = f"pagination.{_scope}.{_order.lower()}" + (f".{_dir}" if _anchored else '')
+            _KEYSET[_scope, _dir, _anchored] = statements.register(
+                _name, _KEYSET_SQL.format(where=_where, cursor=_cursor, order=_order)
+            )
+
+_REMEMBER = statements.register("pagination.remember", _REMEMBER_SQL)
+_RESULTS_PAGE = statements.register("pagination.results_page", _RESULTS_PAGE_SQL)
+_CARD = statements.register("pagination.card", _CARD_SQL)
+
+
+class _Page:
+    def __init__(self, rows, has_prev: bool, has_next: bool, offset: int = 0):
+        self.rows = rows
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.offset = offset
+
+
+# ---- Источники страниц ----
+
+async def _keyset_page(scope: str, param: str, anchor: int, direction: str) -> _Page:
+    args = [TOPICS_PAGE_SIZE + 1]
+    if '$2' in _SCOPE_WHERE[scope]:
+        args.append(int(param))
+    if anchor:
+        args.append(anchor)
+    statement = _KEYSET[scope, direction, bool(anchor)]
+
+    async with acquire() as conn:
+        rows = await statement.fetch(conn, *args)
+
+    # Лишняя строка показывает, есть ли что-то дальше в направлении чтения
+    more = len(rows) > TOPICS_PAGE_SIZE
+    rows = rows[:TOPICS_PAGE_SIZE]
+    if direction == 'p':
+        return _Page(rows[::-1], has_prev=more, has_next=True)
+    # 'a' приходит только с первой темы страницы, у которой была предыдущая
+    return _Page(rows, has_prev=anchor != 0, has_next=more)
+
+
+async def remember_results(title: str, topic_ids: list[int]) -> str:
+    """Сохраняет найденные темы на SEARCH_RESULTS_TTL секунд; возвращает ключ для callback_data."""
+    key = secrets.token_hex(6)
+    async with acquire() as conn:
+        await _REMEMBER.execute(conn, key, title, topic_ids, SEARCH_RESULTS_TTL)
+    return key
+
+
+async def _results_page(key: str, offset: int) -> tuple[str, _Page] | None:
+    """(заголовок, страница) результатов поиска или None, если они устарели."""
+    async with acquire() as conn:
+        rows = await _RESULTS_PAGE.fetch(conn, key, offset, TOPICS_PAGE_SIZE)
+    if not rows:
+        return None
+    total = rows[0]['total']
+    page = [r for r in rows if r['topic_id'] is not None]
+    return rows[0]['list_title'], _Page(
+        page, has_prev=offset > 0, has_next=offset + TOPICS_PAGE_SIZE < total, offset=offset
+    )
+
+
+# ---- Отрисовка ----
+
+def _render(title: str, page: _Page, scope: str, param: str):
+    lines = [f"<b>{title}</b>", ""]
+    for n, r in enumerate(page.rows, start=1):
+        icon = _STATUS_ICONS.get(r['status'], '') + ' ' if scope == 'res' else ''
+        lines.append(
+            f"{n}. {icon}{html.escape(r['title'])} — {html.escape(r['teacher_name'])}"
+        )
+    lines.append("")
+    lines.append("Нажмите номер, чтобы открыть карточку темы.")
+
+    # Позиция этой страницы: сюда вернёт «⬅ К списку» из карточки
+    if scope == 'res':
+        here = page.offset
+    else:
+        here = page.rows[0]['topic_id'] if page.has_prev and page.rows else 0
+
+    numbers = [
+        InlineKeyboardButton(
+            text=str(n),
+            callback_data=CardCallback(
+                topic_id=r['topic_id'], scope=scope, param=param, anchor=here
+            ).pack()
+        )
+        for n, r in enumerate(page.rows, start=1)
+    ]
+    keyboard = [numbers[i: i + 5] for i in range(0, len(numbers), 5)]
+
+    nav = []
+    if page.has_prev:
+        if scope == 'res':
+            prev_cb = PageCallback(scope=scope, param=param,
+                                   anchor=max(page.offset - TOPICS_PAGE_SIZE, 0))
+        else:
+            prev_cb = PageCallback(scope=scope, param=param,
+                                   anchor=page.rows[0]['topic_id'], direction='p')
+        nav.append(InlineKeyboardButton(text="◀", callback_data=prev_cb.pack()))
+    if page.has_next:
+        if scope == 'res':
+            next_cb = PageCallback(scope=scope, param=param,
+                                   anchor=page.offset + TOPICS_PAGE_SIZE)
+        else:
+            next_cb = PageCallback(scope=scope, param=param,
+                                   anchor=page.rows[-1]['topic_id'], direction='n')
+        nav.append(InlineKeyboardButton(text="▶", callback_data=next_cb.pack()))
+    if nav:
+        keyboard.append(nav)
+
+    return "\n".join(lines), InlineKeyboardMarkup(inline_keyboard=keyboard)
+
+
+async def _edit(query: CallbackQuery, text: str, markup: InlineKeyboardMarkup):
+    try:
+        await query.message.edit_text(text, reply_markup=markup, parse_mode="HTML")
+    except TelegramBadRequest as e:
+        # Повторное нажатие на ту же кнопку: содержимое не изменилось
+        if "message is not modified" in e.message:
+            return
+        # Сообщение слишком старое или удалено — показываем страницу новым
+        logger.warning("Не удалось отредактировать сообщение со списком: %s", e.message)
+        await query.message.answer(text, reply_markup=markup, parse_mode="HTML")
+
+
+# ---- Точки входа для хэндлеров ----
+
+async def send_first_page(message: Message, scope: str, param: str = "") -> bool:
+    """Отправляет первую страницу списка. False — список пуст, ничего не отправлено."""
+    page = await _keyset_page(scope, param, 0, 'a')
+    if not page.rows:
+        return False
+    text, markup = _render(_TITLES[scope], page, scope, param)
+    await message.answer(text, reply_markup=markup, parse_mode="HTML")
+    return True
+
+
+async def send_results(message: Message, title: str, rows):
+    """Показывает результаты поиска постранично.
+
+    rows — найденные темы в порядке релевантности, с полями topic_id, title,
+    status и teacher_name; первая страница строится из них без запроса к БД.
+    """
+    key = await remember_results(title, [r['topic_id'] for r in rows])
+    page = _Page(rows[:TOPICS_PAGE_SIZE], has_prev=False, has_next=len(rows) > TOPICS_PAGE_SIZE)
+    text, markup = _render(title, page, 'res', key)
+    await message.answer(text, reply_markup=markup, parse_mode="HTML")
+
+
+# ---- Колбэки ----
+
+async def _load(scope: str, param: str, anchor: int, direction: str):
+    """(заголовок, страница) или None, если список устарел."""
+    if scope == 'res':
+        return await _results_page(param, anchor)
+    if scope not in _SCOPE_WHERE or direction not in ('a', 'n', 'p'):
+        return None
+    page = await _keyset_page(scope, param, anchor, direction)
+    if not page.rows and anchor:
+        # Крайнюю тему удалили или закрепили — начинаем список заново
+        page = await _keyset_page(scope, param, 0, 'a')
+    return _TITLES[scope], page
+
+
+async def turn_page(query: CallbackQuery, callback_data: PageCallback):
+    loaded = await _load(callback_data.scope, callback_data.param,
+                         callback_data.anchor, callback_data.direction)
+    if loaded is None:
+        return await query.answer("Результаты устарели, повторите поиск.", show_alert=True)
+    title, page = loaded
+    if not page.rows:
+        return await query.answer("Список пуст.", show_alert=True)
+    text, markup = _render(title, page, callback_data.scope, callback_data.param)
+    await _edit(query, text, markup)
+    await query.answer()
+
+
+async def show_card(query: CallbackQuery, callback_data: CardCallback):
+    async with acquire() as conn:
+        t = await _CARD.fetchrow(conn, callback_data.topic_id)
+    if t is None:
+        return await query.answer("Тема больше не существует.", show_alert=True)
+
+    text = (
+        f"📌 <b>{html.escape(t['title'])}</b>\n"
+        f"👨🏫 Преподаватель: {html.escape(t['teacher_name'])}\n"
+        f"👤 Студент: {html.escape(t['student_name'])}\n"
+        f"🏷 Ключевые слова: {html.escape(', '.join(t['keywords'] or []))}\n"
+        f"📝 Описание: {html.escape(t['description'] or 'нет описания')}\n"
+        f"{_STATUS_ICONS.get(t['status'], '🔹')} Статус: {t['status']}"
+    )
+    back = PageCallback(scope=callback_data.scope, param=callback_data.param,
+                        anchor=callback_data.anchor, direction='a')
+    markup = InlineKeyboardMarkup(inline_keyboard=[[
+        InlineKeyboardButton(text="⬅ К списку", callback_data=back.pack())
+    ]])
+    await _edit(query, text, markup)
+    await query.answer()
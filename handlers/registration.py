@@ -1,25 +1,35 @@
 # handlers/registration.py
 import re
-from aiogram import F
 from aiogram.filters import Command
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
 from config import TEACHER_ACCESS_CODE
-from database import create_db_connection
+from database import acquire
+from identity import Identity, invalidate
 import keyboards
-
-# Состояния регистрации
-class RegState:
-    ROLE_SELECTION = 0
-    TEACHER_CODE = 1
-    NAME_INPUT = 2
-    EMAIL_INPUT = 3
-    PHONE_INPUT = 4
-    GROUP_INPUT = 5
-    DEPARTMENT_SELECTION = 6
-
-# Временное хранилище данных регистрации
-user_registration_data = {}
+import refdata
+import text_router
+
+# Состояния регистрации. Хранятся в общем хранилище FSM (fsm_storage.py),
+# поэтому регистрацию можно продолжить в любом процессе бота
+class RegState(StatesGroup):
+    ROLE_SELECTION = State()
+    TEACHER_CODE = State()
+    NAME_INPUT = State()
+    EMAIL_INPUT = State()
+    PHONE_INPUT = State()
+    GROUP_INPUT = State()
+    DEPARTMENT_SELECTION = State()
+
+# Клавиатура для необязательных полей
+skip_kb = ReplyKeyboardMarkup(
+    keyboard=[
+        [KeyboardButton(text='Пропустить')],
+        [KeyboardButton(text='❌ Отмена')]
+    ],
+    resize_keyboard=True
+)
 
 # Валидации
 def validate_email(email: str) -> bool:
@@ -34,218 +44,188 @@ def validate_group(group: str) -> bool:
 # Регистрация хэндлеров
 def register_handlers(dp):
     dp.message(Command("start"))(start_handler)
-    dp.message(F.text.in_(['🎓 Студент','👨🏫 Преподаватель']))(role_handler)
-    dp.message(
-        F.text,
-        lambda message: message.from_user.id in user_registration_data
-    )(process_registration)
+
+    routes = text_router.get(dp)
+    routes.add('❌ Отмена', cancel_registration, RegState)
+    routes.add('🎓 Студент', role_handler, RegState.ROLE_SELECTION)
+    routes.add('👨🏫 Преподаватель', role_handler, RegState.ROLE_SELECTION)
+    routes.fallback(RegState.TEACHER_CODE, process_teacher_code)
+    routes.fallback(RegState.NAME_INPUT, process_name)
+    routes.fallback(RegState.EMAIL_INPUT, process_email)
+    routes.fallback(RegState.PHONE_INPUT, process_phone)
+    routes.fallback(RegState.GROUP_INPUT, process_group)
+    routes.fallback(RegState.DEPARTMENT_SELECTION, process_department)
 
 # Обработчики
-async def start_handler(message: Message):
-    user_id = message.from_user.id
-    conn = None
-    try:
-        conn = await create_db_connection()
-        student = await conn.fetchrow(
-            "SELECT * FROM Students WHERE telegram_id = $1",
-            str(user_id)
-        )
-        teacher = await conn.fetchrow(
-            "SELECT * FROM Teachers WHERE telegram_id = $1",
-            str(user_id)
+async def start_handler(message: Message, state: FSMContext, identity: Identity):
+    if identity.is_student:
+        await message.answer("🎓 Добро пожаловать, студент!", reply_markup=keyboards.student_kb)
+    elif identity.is_teacher:
+        await message.answer("👨🏫 Добро пожаловать, преподаватель!", reply_markup=keyboards.teacher_kb)
+    else:
+        await state.clear()
+        await state.set_state(RegState.ROLE_SELECTION)
+        await message.answer(
+            "👋 Для начала работы выберите вашу роль:",
+            reply_markup=keyboards.registration_kb
         )
-        if student:
-            await message.answer("🎓 Добро пожаловать, студент!", reply_markup=keyboards.student_kb)
-        elif teacher:
-            await message.answer("👨🏫 Добро пожаловать, преподаватель!", reply_markup=keyboards.teacher_kb)
-        else:
-            user_registration_data[user_id] = {"state": RegState.ROLE_SELECTION}
-            await message.answer(
-                "👋 Для начала работы выберите вашу роль:",
-                reply_markup=keyboards.registration_kb
-            )
-    except Exception as e:
-        await message.answer(f"⚠️ Ошибка: {e}")
-    finally:
-        if conn:
-            await conn.close()
 
-async def role_handler(message: Message):
-    user_id = message.from_user.id
-    if user_registration_data.get(user_id, {}).get("state") != RegState.ROLE_SELECTION:
-        return
+async def cancel_registration(message: Message, state: FSMContext):
+    await state.clear()
+    await message.answer(
+        "Регистрация отменена. Чтобы начать заново, нажмите /start",
+        reply_markup=keyboards.registration_kb
+    )
+
+async def role_handler(message: Message, state: FSMContext):
     role = "student" if message.text == '🎓 Студент' else "teacher"
-    next_state = RegState.TEACHER_CODE if role == "teacher" else RegState.NAME_INPUT
-    user_registration_data[user_id] = {"state": next_state, "role": role, "data": {}}
+    await state.set_data({"role": role})
 
     if role == "teacher":
+        await state.set_state(RegState.TEACHER_CODE)
         await message.answer("Введите секретный код преподавателя:", reply_markup=keyboards.cancel_kb)
     else:
+        await state.set_state(RegState.NAME_INPUT)
         await message.answer("Введите ваше ФИО:", reply_markup=keyboards.cancel_kb)
 
-async def process_registration(message: Message):
-    user_id = message.from_user.id
-    if user_id not in user_registration_data:
+# 1) Проверка кода преподавателя
+async def process_teacher_code(message: Message, state: FSMContext):
+    if message.text.strip() != TEACHER_ACCESS_CODE:
+        await message.answer("❌ Неверный код! Попробуйте еще раз:")
         return
-    state = user_registration_data[user_id]["state"]
-    text = message.text.strip()
-    role = user_registration_data[user_id]["role"]
-
-    try:
-        # 1) Проверка кода преподавателя
-        if state == RegState.TEACHER_CODE:
-            if text != TEACHER_ACCESS_CODE:
-                await message.answer("❌ Неверный код! Попробуйте еще раз:")
-                return
-            user_registration_data[user_id]["state"] = RegState.NAME_INPUT
-            await message.answer("Введите ваше ФИО:", reply_markup=keyboards.cancel_kb)
-            return
-
-        # 2) Ввод имени
-        if state == RegState.NAME_INPUT:
-            if len(text) < 2:
-                await message.answer("⚠️ Имя должно содержать минимум 2 символа. Повторите ввод:")
-                return
-            user_registration_data[user_id]["data"]["name"] = text
-            user_registration_data[user_id]["state"] = RegState.EMAIL_INPUT
-            # Предлагаем ввести или пропустить email
-            kb = ReplyKeyboardMarkup(
-                keyboard=[
-                    [KeyboardButton(text='Пропустить')],
-                    [KeyboardButton(text='❌ Отмена')]
-                ],
-                resize_keyboard=True
-            )
-            await message.answer("Введите ваш email или нажмите «Пропустить»:", reply_markup=kb)
-            return
-
-        # 3) Ввод email или пропустить
-        if state == RegState.EMAIL_INPUT:
-            if text.lower() == 'пропустить':
-                user_registration_data[user_id]["data"]["email"] = None
-            else:
-                if not validate_email(text):
-                    await message.answer("⚠️ Некорректный email. Повторите ввод или «Пропустить»:")
-                    return
-                user_registration_data[user_id]["data"]["email"] = text
-            user_registration_data[user_id]["state"] = RegState.PHONE_INPUT
-            # Предлагаем ввести или пропустить телефон
-            kb = ReplyKeyboardMarkup(
-                keyboard=[
-                    [KeyboardButton(text='Пропустить')],
-                    [KeyboardButton(text='❌ Отмена')]
-                ],
-                resize_keyboard=True
-            )
-            await message.answer("Введите номер телефона (+79991234567) или «Пропустить»:", reply_markup=kb)
-            return
+    await state.set_state(RegState.NAME_INPUT)
+    await message.answer("Введите ваше ФИО:", reply_markup=keyboards.cancel_kb)
 
-        # 4) Ввод телефона или пропустить
-        if state == RegState.PHONE_INPUT:
-            if text.lower() == 'пропустить':
-                user_registration_data[user_id]["data"]["phone"] = None
-            else:
-                if not validate_phone(text):
-                    await message.answer("⚠️ Некорректный номер. Повторите ввод или «Пропустить»:")
-                    return
-                user_registration_data[user_id]["data"]["phone"] = text
+# 2) Ввод имени
+async def process_name(message: Message, state: FSMContext):
+    text = message.text.strip()
+    if len(text) < 2:
+        await message.answer("⚠️ Имя должно содержать минимум 2 символа. Повторите ввод:")
+        return
+    await state.update_data(name=text)
+    await state.set_state(RegState.EMAIL_INPUT)
+    # Предлагаем ввести или пропустить email
+    await message.answer("Введите ваш email или нажмите «Пропустить»:", reply_markup=skip_kb)
 
-            # следующий этап
-            if role == "student":
-                user_registration_data[user_id]["state"] = RegState.GROUP_INPUT
-                await message.answer("Введите номер группы (например: КС-46):", reply_markup=keyboards.cancel_kb)
-            else:
-                user_registration_data[user_id]["state"] = RegState.DEPARTMENT_SELECTION
-                await _ask_department(message)
+# 3) Ввод email или пропустить
+async def process_email(message: Message, state: FSMContext):
+    text = message.text.strip()
+    if text.lower() == 'пропустить':
+        email = None
+    else:
+        if not validate_email(text):
+            await message.answer("⚠️ Некорректный email. Повторите ввод или «Пропустить»:")
             return
-
-        # 5) Ввод группы (только для студентов)
-        if state == RegState.GROUP_INPUT:
-            if not validate_group(text):
-                await message.answer("⚠️ Неверный формат группы. Пример: КС-46")
-                return
-            user_registration_data[user_id]["data"]["group"] = text
-            user_registration_data[user_id]["state"] = RegState.DEPARTMENT_SELECTION
-            await _ask_department(message)
+        email = text
+    await state.update_data(email=email)
+    await state.set_state(RegState.PHONE_INPUT)
+    # Предлагаем ввести или пропустить телефон
+    await message.answer("Введите номер телефона (+79991234567) или «Пропустить»:", reply_markup=skip_kb)
+
+# 4) Ввод телефона или пропустить
+async def process_phone(message: Message, state: FSMContext):
+    text = message.text.strip()
+    if text.lower() == 'пропустить':
+        phone = None
+    else:
+        if not validate_phone(text):
+            await message.answer("⚠️ Некорректный номер. Повторите ввод или «Пропустить»:")
             return
+        phone = text
+    data = await state.update_data(phone=phone)
 
-        # 6) Выбор кафедры
-        if state == RegState.DEPARTMENT_SELECTION:
-            user_registration_data[user_id]["data"]["department"] = text
-            await save_user_data(user_id, message)
-            return
+    # следующий этап
+    if data["role"] == "student":
+        await state.set_state(RegState.GROUP_INPUT)
+        await message.answer("Введите номер группы (например: КС-46):", reply_markup=keyboards.cancel_kb)
+    else:
+        await state.set_state(RegState.DEPARTMENT_SELECTION)
+        await _ask_department(message)
 
-    except Exception as e:
-        await message.answer(f"⚠️ Ошибка: {e}")
-        user_registration_data.pop(user_id, None)
+# 5) Ввод группы (только для студентов)
+async def process_group(message: Message, state: FSMContext):
+    text = message.text.strip()
+    if not validate_group(text):
+        await message.answer("⚠️ Неверный формат группы. Пример: КС-46")
+        return
+    await state.update_data(group=text)
+    await state.set_state(RegState.DEPARTMENT_SELECTION)
+    await _ask_department(message)
+
+# 6) Выбор кафедры
+async def process_department(message: Message, state: FSMContext):
+    dept_id = refdata.department_id(message.text.strip())
+    if dept_id is None:
+        await message.answer("⚠️ Выберите кафедру из списка:", reply_markup=refdata.registration_departments_kb())
+        return
+    data = await state.update_data(department_id=dept_id)
+    await save_user_data(message, state, data)
 
 
 async def _ask_department(message: Message):
-    """Запрашивает список кафедр и показывает клавиатуру."""
-    conn = await create_db_connection()
-    try:
-        rows = await conn.fetch("SELECT name FROM Departments ORDER BY name")
-        names = [r['name'] for r in rows]
-    finally:
-        await conn.close()
-
-    # Формируем список рядов кнопок по 2 в ряд
-    buttons: list[list[KeyboardButton]] = []
-    row: list[KeyboardButton] = []
-    for name in names:
-        row.append(KeyboardButton(text=name))
-        if len(row) == 2:
-            buttons.append(row)
-            row = []
-    if row:
-        buttons.append(row)
-    # Добавляем кнопку отмены отдельным рядом
-    buttons.append([KeyboardButton(text='❌ Отмена')])
-
-    kb = ReplyKeyboardMarkup(keyboard=buttons, resize_keyboard=True)
-    await message.answer("Выберите вашу кафедру:", reply_markup=kb)
+    """Показывает клавиатуру кафедр (готовая, из refdata)."""
+    await message.answer("Выберите вашу кафедру:", reply_markup=refdata.registration_departments_kb())
 
 
-
-async def save_user_data(user_id: int, message: Message):
-    conn = None
+async def save_user_data(message: Message, state: FSMContext, data: dict):
+    user_id = message.from_user.id
+    role = data["role"]
+    dept_id = data["department_id"]
     try:
-        conn = await create_db_connection()
-        data = user_registration_data[user_id]["data"]
-        role = user_registration_data[user_id]["role"]
-
-        # id кафедры
-        dept_id = await conn.fetchval(
-            "SELECT department_id FROM Departments WHERE name = $1",
-            data["department"]
-        )
-
-        if role == "student":
-            await conn.execute(
-                """
-                INSERT INTO Students(
-                    name, email, phone, telegram_id, group_name, department_id
-                ) VALUES($1, $2, $3, $4, $5, $6)
-                """,
-                data["name"], data["email"], data["phone"],
-                str(user_id), data["group"], dept_id
-            )
-            await message.answer("🎓 Регистрация студента завершена!", reply_markup=keyboards.student_kb)
-        else:
-            await conn.execute(
-                """
-                INSERT INTO Teachers(
-                    name, email, phone, telegram_id, department_id
-                ) VALUES($1, $2, $3, $4, $5)
-                """,
-                data["name"], data["email"], data["phone"],
-                str(user_id), dept_id
-            )
-            await message.answer("👨🏫 Регистрация преподавателя завершена!", reply_markup=keyboards.teacher_kb)
+        async with acquire() as conn:
+            if role == "student":
+                # Студент из импортированного списка группы (bulk_import.py)
+                # получает свою запись, только если указал тот же email:
+                # ФИО и группу однокурсника знает кто угодно
+                row = await conn.fetchrow(
+                    """
+                    WITH listed AS (
+                        SELECT student_id FROM Students
+                         WHERE telegram_id IS NULL AND lower(email) = lower($2)
+                           AND group_name = $5 AND department_id = $6
+                         LIMIT 1
+                           FOR UPDATE SKIP LOCKED
+                    ), linked AS (
+                        UPDATE Students s
+                           SET telegram_id = $4, phone = COALESCE($3, s.phone)
+                          FROM listed
+                         WHERE s.student_id = listed.student_id
+                        RETURNING s.student_id
+                    ), inserted AS (
+                        INSERT INTO Students(
+                            name, email, phone, telegram_id, group_name, department_id
+                        )
+                        SELECT $1, $2, $3, $4, $5, $6
+                         WHERE NOT EXISTS (SELECT 1 FROM linked)
+                    )
+                    SELECT EXISTS (SELECT 1 FROM linked) AS linked,
+                           EXISTS (SELECT 1 FROM Students
+                                    WHERE telegram_id IS NULL AND lower(name) = lower($1)
+                                      AND group_name = $5 AND department_id = $6) AS listed_by_name
+                    """,
+                    data["name"], data["email"], data["phone"],
+                    str(user_id), data["group"], dept_id
+                )
+                await message.answer("🎓 Регистрация студента завершена!", reply_markup=keyboards.student_kb)
+                if not row["linked"] and row["listed_by_name"]:
+                    await message.answer(
+                        "ℹ️ В списке вашей группы есть студент с таким ФИО, но с другим email, "
+                        "поэтому записи не объединены. Если это вы, обратитесь к преподавателю."
+                    )
+            else:
+                await conn.execute(
+                    """
+                    INSERT INTO Teachers(
+                        name, email, phone, telegram_id, department_id
+                    ) VALUES($1, $2, $3, $4, $5)
+                    """,
+                    data["name"], data["email"], data["phone"],
+                    str(user_id), dept_id
+                )
+                await message.answer("👨🏫 Регистрация преподавателя завершена!", reply_markup=keyboards.teacher_kb)
 
     except Exception as e:
         await message.answer(f"⚠️ Ошибка сохранения данных: {e}")
     finally:
-        user_registration_data.pop(user_id, None)
-        if conn:
-            await conn.close()
+        await state.clear()
+        invalidate(user_id)
@@ -1,51 +1,64 @@
 # handlers/search.py
-import json
-from aiogram import F
+"""Поиск тем: «Искать везде» и три узких режима.
+
+«Искать везде» — основной вход: полнотекстовый поиск с русской морфологией
+по названию, ключевым словам, описанию и преподавателю (Topics.search_vector,
+GIN-индекс), результаты по релевантности. Узкие режимы отвечают на то, чего
+полнотекстовый поиск не умеет:
+
+- по ключевым словам — точные ключевые слова и их префиксы с «и»/«или»
+  (keyword_index.py, в памяти процесса, без запроса к Topics);
+- по названию и по преподавателю — подстрока и опечатки (pg_trgm). Морфология
+  сводит слово к основе, но «нейро» или «Иванв» не найдёт.
+
+Варианты *_PLAIN — те же запросы через ILIKE для базы без pg_trgm
+(database.trigram_enabled); прежних сканирований по LOWER() LIKE и unnest
+ключевых слов больше нет.
+"""
 from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from database import create_db_connection
+import database
+from database import acquire
+import eventlog
+from handlers import pagination
+from identity import Identity
+import keyword_index
 import keyboards
-
-# Утилита логирования
-async def log_action(conn, user_id: str, action: str, details: dict):
-    await conn.execute(
-        """
-        INSERT INTO Logs(user_id, action, details)
-        VALUES($1, $2, $3)
-        """,
-        user_id,
-        action,
-        json.dumps(details)
-    )
+import statements
+import text_router
 
 class SearchStates(StatesGroup):
+    WAITING_QUERY    = State()
     WAITING_KEYWORDS = State()
     WAITING_TITLE    = State()
     WAITING_TEACHER  = State()
 
 def register_handlers(dp):
-    dp.message(F.text == '🔍 Поиск темы')(search_topic_start)
+    routes = text_router.get(dp)
+    routes.add('🔍 Поиск темы', search_topic_start)
 
     # Отмена
-    dp.message(F.text == '❌ Отмена', SearchStates.WAITING_KEYWORDS)(cancel_search)
-    dp.message(F.text == '❌ Отмена', SearchStates.WAITING_TITLE)(cancel_search)
-    dp.message(F.text == '❌ Отмена', SearchStates.WAITING_TEACHER)(cancel_search)
+    routes.add('❌ Отмена', cancel_search, SearchStates)
 
     # Ветки поиска
-    dp.message(F.text == "🔎 По ключевым словам")(search_by_keywords_start)
-    dp.message(SearchStates.WAITING_KEYWORDS)(process_search_by_keywords)
+    routes.add("🔎 Искать везде", search_everywhere_start)
+    routes.fallback(SearchStates.WAITING_QUERY, process_search_everywhere)
+
+    routes.add("🔎 По ключевым словам", search_by_keywords_start)
+    routes.fallback(SearchStates.WAITING_KEYWORDS, process_search_by_keywords)
 
-    dp.message(F.text == "📖 По названию")(search_by_title_start)
-    dp.message(SearchStates.WAITING_TITLE)(process_search_by_title)
+    routes.add("📖 По названию", search_by_title_start)
+    routes.fallback(SearchStates.WAITING_TITLE, process_search_by_title)
 
-    dp.message(F.text == "👨🏫 По преподавателю")(search_by_teacher_start)
-    dp.message(SearchStates.WAITING_TEACHER)(process_search_by_teacher)
+    routes.add("👨🏫 По преподавателю", search_by_teacher_start)
+    routes.fallback(SearchStates.WAITING_TEACHER, process_search_by_teacher)
 
 
 async def search_topic_start(message: Message):
     kb = ReplyKeyboardMarkup(
         keyboard=[
+            [KeyboardButton(text="🔎 Искать везде")],
             [KeyboardButton(text="🔎 По ключевым словам")],
             [KeyboardButton(text="📖 По названию")],
             [KeyboardButton(text="👨🏫 По преподавателю")],
@@ -56,21 +69,64 @@ async def search_topic_start(message: Message):
     await message.answer("Выберите тип поиска:", reply_markup=kb)
 
 
-async def cancel_search(message: Message, state: FSMContext):
+async def cancel_search(message: Message, state: FSMContext, identity: Identity):
     await state.clear()
-    user_id = str(message.from_user.id)
-    conn = await create_db_connection()
-    try:
-        is_student = await conn.fetchval(
-            "SELECT 1 FROM Students WHERE telegram_id = $1", user_id
-        )
-    finally:
-        await conn.close()
-
-    kb = keyboards.student_kb if is_student else keyboards.teacher_kb
+    kb = keyboards.student_kb if identity.is_student else keyboards.teacher_kb
     await message.answer("Поиск отменён.", reply_markup=kb)
 
 
+# ---- По всем полям (полнотекстовый) ----
+
+async def search_everywhere_start(message: Message, state: FSMContext):
+    kb = ReplyKeyboardMarkup(
+        keyboard=[[KeyboardButton(text="❌ Отмена")]],
+        resize_keyboard=True
+    )
+    await message.answer(
+        "Введите запрос — ищем по названию, ключевым словам, описанию и преподавателю:",
+        reply_markup=kb
+    )
+    await state.set_state(SearchStates.WAITING_QUERY)
+
+
+_FULLTEXT = statements.register("search.fulltext", """
+    SELECT
+      t.topic_id,
+      t.title,
+      COALESCE(te.name, 'Не назначен') AS teacher_name,
+      t.status
+    FROM Topics t
+    CROSS JOIN websearch_to_tsquery('russian', $1) AS q
+    LEFT JOIN Teachers te ON t.teacher_id = te.teacher_id
+    WHERE t.search_vector @@ q
+    ORDER BY ts_rank_cd(t.search_vector, q) DESC, t.title
+    LIMIT 50
+""")
+
+
+async def process_search_everywhere(message: Message, state: FSMContext, identity: Identity):
+    query = message.text.strip()
+    if len(query) < 2:
+        return await message.answer("Введите минимум 2 символа:")
+
+    async with acquire() as conn:
+        # websearch_to_tsquery понимает «кавычки», OR и -исключения;
+        # русская морфология сводит словоформы к одной основе
+        topics = await _FULLTEXT.fetch(conn, query)
+    eventlog.log_action(
+        str(message.from_user.id),
+        'search_fulltext',
+        {'query': query, 'count': len(topics)}
+    )
+    eventlog.log_search(identity.student_id, query)
+
+    if not topics:
+        return await message.answer("Ничего не найдено. Попробуйте другие слова.")
+
+    await pagination.send_results(message, "🔍 Найденные темы", topics)
+    await state.clear()
+
+
 # ---- По ключевым словам ----
 
 async def search_by_keywords_start(message: Message, state: FSMContext):
@@ -78,74 +134,90 @@ async def search_by_keywords_start(message: Message, state: FSMContext):
         keyboard=[[KeyboardButton(text="❌ Отмена")]],
         resize_keyboard=True
     )
-    await message.answer("Введите ключевые слова через запятую:", reply_markup=kb)
+    await message.answer(
+        "Введите ключевые слова через запятую (любое из них) "
+        "или через «+» (все сразу), например: нейросети + python, графы",
+        reply_markup=kb
+    )
     await state.set_state(SearchStates.WAITING_KEYWORDS)
 
 
-async def process_search_by_keywords(message: Message, state: FSMContext):
-    keywords = [kw.strip().lower() for kw in message.text.split(',') if kw.strip()]
-    if not keywords:
-        return await message.answer("Введите хотя бы одно ключевое слово:")
-
-    conn = await create_db_connection()
-    try:
-        # Собираем темы вместе с данными о студенте
-        conditions = []
-        params     = []
-        for i, kw in enumerate(keywords, start=1):
-            conditions.append(f"LOWER(k) LIKE ${i}")
-            params.append(f"%{kw}%")
-
-        sql = f"""
-            SELECT
-              t.title,
-              t.description,
-              t.keywords,
-              COALESCE(te.name, 'Не назначен')     AS teacher_name,
-              COALESCE(s.name, '—')                AS student_name,
-              t.status
-            FROM Topics t
-            LEFT JOIN Teachers te ON t.teacher_id = te.teacher_id
-            LEFT JOIN Students s ON t.student_id = s.student_id
-            WHERE EXISTS (
-                SELECT 1 FROM unnest(t.keywords) AS k
-                WHERE {' OR '.join(conditions)}
-            )
-            ORDER BY t.title
-            LIMIT 50
-        """
-        topics = await conn.fetch(sql, *params)
-
-        # Логируем
-        await log_action(
-            conn,
-            str(message.from_user.id),
-            'search_by_keywords',
-            {'keywords': keywords, 'count': len(topics)}
-        )
-    finally:
-        await conn.close()
+# Список id — один параметр-массив: текст запроса не зависит от числа найденных тем
+_BY_IDS = statements.register("search.by_ids", """
+    SELECT
+      t.topic_id,
+      t.title,
+      COALESCE(te.name, 'Не назначен')     AS teacher_name,
+      t.status
+    FROM Topics t
+    LEFT JOIN Teachers te ON t.teacher_id = te.teacher_id
+    WHERE t.topic_id = ANY($1::int[])
+    ORDER BY t.status = 'free' DESC, t.title
+""")
+
+
+async def process_search_by_keywords(message: Message, state: FSMContext, identity: Identity):
+    groups = keyword_index.parse_query(message.text)
+    if not groups:
+        return await message.answer("Введите хотя бы одно ключевое слово (от 2 символов):")
+
+    # Ищем по индексу в памяти, из БД только забираем найденные темы
+    topic_ids = keyword_index.rank(keyword_index.search(groups), limit=50)
+    topics = []
+    if topic_ids:
+        async with acquire() as conn:
+            topics = await _BY_IDS.fetch(conn, topic_ids)
+
+    # Логируем
+    eventlog.log_action(
+        str(message.from_user.id),
+        'search_by_keywords',
+        {'keywords': groups, 'count': len(topics)}
+    )
+    eventlog.log_search(identity.student_id, message.text.strip())
 
     if not topics:
         return await message.answer("Темы не найдены по ключевым словам.")
 
-    text = ["🔍 Найденные темы:"]
-    for t in topics:
-        kws = ", ".join(t['keywords'])
-        text.append(
-            f"\n📌 <b>{t['title']}</b>\n"
-            f"👨🏫 {t['teacher_name']}\n"
-            f"👤 {t['student_name']}\n"
-            f"🏷 {kws}\n"
-            f"📝 {t['description'] or 'нет описания'}\n"
-            f"🔹 {t['status']}"
-        )
-    await message.answer("\n".join(text), parse_mode="HTML")
+    await pagination.send_results(message, "🔍 Найденные темы", topics)
     await state.clear()
 
 
 # ---- По названию ----
 
+# С pg_trgm ищем и по подстроке, и по похожему слову (опечатки), а лучшие
+# совпадения поднимаем наверх; оба условия обслуживает триграммный GIN-индекс.
+# Без расширения остаётся прежний ILIKE.
+_TITLE_SQL_TRGM = """
+    SELECT
+      t.topic_id,
+      t.title,
+      COALESCE(te.name, 'Не назначен') AS teacher_name,
+      t.status
+    FROM Topics t
+    LEFT JOIN Teachers te ON t.teacher_id = te.teacher_id
+    WHERE t.title ILIKE $1 OR $2 <% t.title
+    ORDER BY t.title ILIKE $1 DESC, word_similarity($2, t.title) DESC, t.title
+    LIMIT 50
+"""
+
+_TITLE_SQL_PLAIN = """
+    SELECT
+      t.topic_id,
+      t.title,
+      COALESCE(te.name, 'Не назначен') AS teacher_name,
+      t.status
+    FROM Topics t
+    LEFT JOIN Teachers te ON t.teacher_id = te.teacher_id
+    WHERE t.title ILIKE $1
+    ORDER BY t.title
+    LIMIT 50
+"""
+
+_TITLE_TRGM = statements.register("search.title_trgm", _TITLE_SQL_TRGM)
+_TITLE_PLAIN = statements.register("search.title", _TITLE_SQL_PLAIN)
+
+
 async def search_by_title_start(message: Message, state: FSMContext):
     kb = ReplyKeyboardMarkup(
         keyboard=[[KeyboardButton(text="❌ Отмена")]],
@@ -155,59 +227,68 @@ async def search_by_title_start(message: Message, state: FSMContext):
     await state.set_state(SearchStates.WAITING_TITLE)
 
 
-async def process_search_by_title(message: Message, state: FSMContext):
+async def process_search_by_title(message: Message, state: FSMContext, identity: Identity):
     term = message.text.strip().lower()
     if len(term) < 3:
         return await message.answer("Введите минимум 3 символа:")
 
-    conn = await create_db_connection()
-    try:
-        topics = await conn.fetch(
-            """
-            SELECT
-              t.title,
-              t.description,
-              t.keywords,
-              COALESCE(te.name, 'Не назначен') AS teacher_name,
-              COALESCE(s.name, '—')             AS student_name,
-              t.status
-            FROM Topics t
-            LEFT JOIN Teachers te ON t.teacher_id = te.teacher_id
-            LEFT JOIN Students s ON t.student_id = s.student_id
-            WHERE LOWER(t.title) LIKE $1
-            ORDER BY t.title
-            LIMIT 50
-            """, f"%{term}%"
-        )
-        await log_action(
-            conn,
+    async with acquire() as conn:
+        if database.trigram_enabled:
+            topics = await _TITLE_TRGM.fetch(conn, f"%{term}%", term)
+        else:
+            topics = await _TITLE_PLAIN.fetch(conn, f"%{term}%")
+        eventlog.log_action(
             str(message.from_user.id),
             'search_by_title',
             {'term': term, 'count': len(topics)}
         )
-    finally:
-        await conn.close()
+        eventlog.log_search(identity.student_id, term)
 
     if not topics:
         return await message.answer("Темы не найдены по названию.")
 
-    text = ["🔍 Найденные темы:"]
-    for t in topics:
-        kws = ", ".join(t['keywords'])
-        text.append(
-            f"\n📌 <b>{t['title']}</b>\n"
-            f"👨🏫 {t['teacher_name']}\n"
-            f"👤 {t['student_name']}\n"
-            f"🏷 {kws}\n"
-            f"📝 {t['description'] or 'нет описания'}\n"
-            f"🔹 {t['status']}"
-        )
-    await message.answer("\n".join(text), parse_mode="HTML")
+    await pagination.send_results(message, "🔍 Найденные темы", topics)
     await state.clear()
 
 
 # ---- По преподавателю ----
 
+_TEACHER_SQL_TRGM = """
+    WITH te AS (
+        SELECT teacher_id, name,
+               name ILIKE $1 AS exact,
+               word_similarity($2, name) AS sim
+          FROM Teachers
+         WHERE name ILIKE $1 OR $2 <% name
+    )
+    SELECT
+      t.topic_id,
+      t.title,
+      te.name AS teacher_name,
+      t.status
+    FROM te
+    JOIN Topics t ON t.teacher_id = te.teacher_id
+    ORDER BY te.exact DESC, te.sim DESC, t.title
+    LIMIT 50
+"""
+
+_TEACHER_SQL_PLAIN = """
+    SELECT
+      t.topic_id,
+      t.title,
+      te.name AS teacher_name,
+      t.status
+    FROM Topics t
+    JOIN Teachers te ON t.teacher_id = te.teacher_id
+    WHERE te.name ILIKE $1
+    ORDER BY t.title
+    LIMIT 50
+"""
+
+_TEACHER_TRGM = statements.register("search.teacher_trgm", _TEACHER_SQL_TRGM)
+_TEACHER_PLAIN = statements.register("search.teacher", _TEACHER_SQL_PLAIN)
+
+
 async def search_by_teacher_start(message: Message, state: FSMContext):
     kb = ReplyKeyboardMarkup(
         keyboard=[[KeyboardButton(text="❌ Отмена")]],
@@ -217,52 +298,25 @@ async def search_by_teacher_start(message: Message, state: FSMContext):
     await state.set_state(SearchStates.WAITING_TEACHER)
 
 
-async def process_search_by_teacher(message: Message, state: FSMContext):
+async def process_search_by_teacher(message: Message, state: FSMContext, identity: Identity):
     name = message.text.strip()
     if len(name) < 2:
         return await message.answer("Введите минимум 2 символа:")
 
-    conn = await create_db_connection()
-    try:
-        topics = await conn.fetch(
-            """
-            SELECT
-              t.title,
-              t.description,
-              t.keywords,
-              te.name AS teacher_name,
-              COALESCE(s.name, '—') AS student_name,
-              t.status
-            FROM Topics t
-            JOIN Teachers te ON t.teacher_id = te.teacher_id
-            LEFT JOIN Students s ON t.student_id = s.student_id
-            WHERE te.name ILIKE $1
-            ORDER BY t.title
-            LIMIT 50
-            """, f"%{name}%"
-        )
-        await log_action(
-            conn,
+    async with acquire() as conn:
+        if database.trigram_enabled:
+            topics = await _TEACHER_TRGM.fetch(conn, f"%{name}%", name)
+        else:
+            topics = await _TEACHER_PLAIN.fetch(conn, f"%{name}%")
+        eventlog.log_action(
             str(message.from_user.id),
             'search_by_teacher',
             {'name': name, 'count': len(topics)}
         )
-    finally:
-        await conn.close()
+        eventlog.log_search(identity.student_id, name)
 
     if not topics:
         return await message.answer("Темы не найдены по преподавателю.")
 
-    text = ["🔍 Найденные темы:"]
-    for t in topics:
-        kws = ", ".join(t['keywords'])
-        text.append(
-            f"\n📌 <b>{t['title']}</b>\n"
-            f"👨🏫 {t['teacher_name']}\n"
-            f"👤 {t['student_name']}\n"
-            f"🏷 {kws}\n"
-            f"📝 {t['description'] or 'нет описания'}\n"
-            f"🔹 {t['status']}"
-        )
-    await message.answer("\n".join(text), parse_mode="HTML")
+    await pagination.send_results(message, "🔍 Найденные темы", topics)
     await state.clear()
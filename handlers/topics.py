@@ -1,6 +1,6 @@
 # handlers/topics.py
-import json
-from aiogram import F
+import asyncpg
+
 from aiogram.types import (
     Message,
     ReplyKeyboardMarkup,
@@ -9,8 +9,12 @@ from aiogram.types import (
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 
-from database import create_db_connection
+from database import acquire
+import eventlog
+from identity import Identity, invalidate, invalidate_student
+import keyword_index
 import keyboards
+import text_router
 
 
 # состояния для разных сценариев
@@ -32,78 +36,53 @@ class DeleteAccountStates(StatesGroup):
     CONFIRM = State()
 
 
-async def log_action(conn, user_id: str, action: str, details: dict):
-    await conn.execute(
-        """
-        INSERT INTO Logs(user_id, action, details)
-        VALUES($1, $2, $3)
-        """,
-        user_id, action, json.dumps(details)
-    )
-
-
 def register_handlers(dp):
+    routes = text_router.get(dp)
     # создание/предложение темы
-    dp.message(F.text == '📝 Предложить тему')(suggest_topic)
-    dp.message(F.text == '❌ Отмена', TopicStates.WAITING_TITLE)(cancel_topic)
-    dp.message(F.text == '❌ Отмена', TopicStates.WAITING_DESCRIPTION)(cancel_topic)
-    dp.message(F.text == '❌ Отмена', TopicStates.WAITING_KEYWORDS)(cancel_topic)
-    dp.message(TopicStates.WAITING_TITLE)(process_title)
-    dp.message(TopicStates.WAITING_DESCRIPTION)(process_description)
-    dp.message(TopicStates.WAITING_KEYWORDS)(process_keywords)
+    routes.add('📝 Предложить тему', suggest_topic)
+    routes.add('❌ Отмена', cancel_topic, TopicStates)
+    routes.fallback(TopicStates.WAITING_TITLE, process_title)
+    routes.fallback(TopicStates.WAITING_DESCRIPTION, process_description)
+    routes.fallback(TopicStates.WAITING_KEYWORDS, process_keywords)
 
     # одобрение темы (преподаватель)
-    dp.message(F.text == '✅ Одобрить тему')(approve_topic_start)
-    dp.message(F.text == '❌ Отмена', ApproveTopicStates.WAITING_TITLE)(cancel_approve_topic)
-    dp.message(ApproveTopicStates.WAITING_TITLE)(process_approve_topic)
+    routes.add('✅ Одобрить тему', approve_topic_start)
+    routes.add('❌ Отмена', cancel_approve_topic, ApproveTopicStates.WAITING_TITLE)
+    routes.fallback(ApproveTopicStates.WAITING_TITLE, process_approve_topic)
 
     # открепление от темы (студент)
-    dp.message(F.text == '📤 Открепиться от темы')(detach_topic_start)
-    dp.message(F.text == '❌ Отмена', DetachStates.WAITING_TITLE)(cancel_detach)
-    dp.message(DetachStates.WAITING_TITLE)(process_detach)
+    routes.add('📤 Открепиться от темы', detach_topic_start)
+    routes.add('❌ Отмена', cancel_detach, DetachStates.WAITING_TITLE)
+    routes.fallback(DetachStates.WAITING_TITLE, process_detach)
 
     # удаление аккаунта
-    dp.message(F.text == '🗑 Удалить аккаунт')(delete_account_start)
-    dp.message(F.text == 'ПОДТВЕРЖДАЮ', DeleteAccountStates.CONFIRM)(process_delete_account)
-    dp.message(F.text == 'ОТМЕНА', DeleteAccountStates.CONFIRM)(cancel_delete_account)
+    routes.add('🗑 Удалить аккаунт', delete_account_start)
+    routes.add('ПОДТВЕРЖДАЮ', process_delete_account, DeleteAccountStates.CONFIRM)
+    routes.add('ОТМЕНА', cancel_delete_account, DeleteAccountStates.CONFIRM)
 
 
 # --- ПРЕДЛОЖЕНИЕ ТЕМЫ ---
-async def suggest_topic(message: Message, state: FSMContext):
-    user_tg = str(message.from_user.id)
-    conn = await create_db_connection()
-    try:
-        student = await conn.fetchrow(
-            "SELECT student_id, department_id FROM Students WHERE telegram_id = $1",
-            user_tg
+async def suggest_topic(message: Message, state: FSMContext, identity: Identity):
+    if not identity.is_registered:
+        return await message.answer(
+            "❌ Для предложения темы необходимо пройти регистрацию!",
+            reply_markup=keyboards.registration_kb
         )
-        teacher = await conn.fetchrow(
-            "SELECT teacher_id, department_id FROM Teachers WHERE telegram_id = $1",
-            user_tg
-        )
-        if not student and not teacher:
-            return await message.answer(
-                "❌ Для предложения темы необходимо пройти регистрацию!",
-                reply_markup=keyboards.registration_kb
-            )
-        dept_id = student['department_id'] if student else teacher['department_id']
-        await state.update_data(
-            student_id=student['student_id'] if student else None,
-            teacher_id=teacher['teacher_id'] if teacher else None,
-            department_id=dept_id
-        )
-        await message.answer(
-            "Введите название темы:",
-            reply_markup=keyboards.cancel_kb
-        )
-        await state.set_state(TopicStates.WAITING_TITLE)
-    finally:
-        await conn.close()
+    await state.update_data(
+        student_id=identity.student_id,
+        teacher_id=identity.teacher_id,
+        department_id=identity.department_id
+    )
+    await message.answer(
+        "Введите название темы:",
+        reply_markup=keyboards.cancel_kb
+    )
+    await state.set_state(TopicStates.WAITING_TITLE)
 
 
-async def cancel_topic(message: Message, state: FSMContext):
+async def cancel_topic(message: Message, state: FSMContext, identity: Identity):
     await state.clear()
-    kb = keyboards.student_kb if await _is_student(message) else keyboards.teacher_kb
+    kb = keyboards.student_kb if identity.is_student else keyboards.teacher_kb
     await message.answer("Операция отменена.", reply_markup=kb)
 
 
@@ -141,43 +120,40 @@ async def process_keywords(message: Message, state: FSMContext):
     if not kws:
         return await message.answer("⚠️ Укажите хотя бы одно ключевое слово.")
     data = await state.get_data()
-    conn = await create_db_connection()
     try:
-        await conn.execute(
-            """
-            INSERT INTO Topics(
-                title, description, keywords, status,
-                student_id, teacher_id, department_id
-            ) VALUES($1,$2,$3,$4,$5,$6,$7)
-            """,
-            data['title'],
-            data.get('description'),
-            kws,
-            'free',
-            data.get('student_id'),
-            data.get('teacher_id'),
-            data['department_id']
-        )
-        await log_action(conn, str(message.from_user.id), 'add_topic', {
-            'title': data['title'], 'keywords': kws
-        })
-        kb = keyboards.student_kb if data.get('student_id') else keyboards.teacher_kb
-        await message.answer("✅ Тема добавлена!", reply_markup=kb)
+        async with acquire() as conn:
+            topic_id = await conn.fetchval(
+                """
+                INSERT INTO Topics(
+                    title, description, keywords, status,
+                    student_id, teacher_id, department_id
+                ) VALUES($1,$2,$3,$4,$5,$6,$7)
+                RETURNING topic_id
+                """,
+                data['title'],
+                data.get('description'),
+                kws,
+                'free',
+                data.get('student_id'),
+                data.get('teacher_id'),
+                data['department_id']
+            )
+            keyword_index.add(topic_id, kws, 'free')
+            eventlog.log_action(str(message.from_user.id), 'add_topic', {
+                'title': data['title'], 'keywords': kws
+            })
+            kb = keyboards.student_kb if data.get('student_id') else keyboards.teacher_kb
+            await message.answer("✅ Тема добавлена!", reply_markup=kb)
     finally:
-        await conn.close()
         await state.clear()
 
 
 # --- ОДОБРЕНИЕ ТЕМЫ ---
-async def approve_topic_start(message: Message, state: FSMContext):
-    user_tg = str(message.from_user.id)
-    conn = await create_db_connection()
-    try:
-        if not await conn.fetchval(
-            "SELECT 1 FROM Teachers WHERE telegram_id = $1", user_tg
-        ):
-            return await message.answer("⚠️ Только для преподавателей!", reply_markup=keyboards.teacher_kb)
+async def approve_topic_start(message: Message, state: FSMContext, identity: Identity):
+    if not identity.is_teacher:
+        return await message.answer("⚠️ Только для преподавателей!", reply_markup=keyboards.teacher_kb)
 
+    async with acquire() as conn:
         rows = await conn.fetch(
             """
             SELECT t.title,
@@ -200,31 +176,34 @@ async def approve_topic_start(message: Message, state: FSMContext):
         )
         await message.answer(prompt, reply_markup=kb)
         await state.set_state(ApproveTopicStates.WAITING_TITLE)
-    finally:
-        await conn.close()
 
 
-async def process_approve_topic(message: Message, state: FSMContext):
+async def process_approve_topic(message: Message, state: FSMContext, identity: Identity):
     title = message.text.strip()
-    user_tg = str(message.from_user.id)
-    conn = await create_db_connection()
     try:
-        teacher_id = await conn.fetchval(
-            "SELECT teacher_id FROM Teachers WHERE telegram_id = $1", user_tg
-        )
-        result = await conn.execute(
-            """
-            UPDATE Topics
-               SET status='closed', teacher_id=$1
-             WHERE title=$2 AND status='free'
-            """,
-            teacher_id, title
-        )
-        if result == 'UPDATE 0':
-            return await message.answer("⚠️ Тема не найдена или уже закрыта.")
-        await message.answer(f"✅ Тема «{title}» одобрена.", reply_markup=keyboards.teacher_kb)
+        async with acquire() as conn:
+            try:
+                approved = await conn.fetch(
+                    """
+                    UPDATE Topics
+                       SET status='closed', teacher_id=$1
+                     WHERE title=$2 AND status='free'
+                    RETURNING topic_id, student_id
+                    """,
+                    identity.teacher_id, title
+                )
+            except asyncpg.UniqueViolationError:
+                # Предложивший тему студент тем временем закрепил другую
+                return await message.answer(
+                    "⚠️ За автором темы уже закреплена другая тема — одобрить нельзя."
+                )
+            if not approved:
+                return await message.answer("⚠️ Тема не найдена или уже закрыта.")
+            for r in approved:
+                keyword_index.set_status(r['topic_id'], 'closed')
+                invalidate_student(r['student_id'])
+            await message.answer(f"✅ Тема «{title}» одобрена.", reply_markup=keyboards.teacher_kb)
     finally:
-        await conn.close()
         await state.clear()
 
 
@@ -234,16 +213,12 @@ async def cancel_approve_topic(message: Message, state: FSMContext):
 
 
 # --- ОТКРЕПЛЕНИЕ ОТ ТЕМЫ ---
-async def detach_topic_start(message: Message, state: FSMContext):
-    user_tg = str(message.from_user.id)
-    conn = await create_db_connection()
-    try:
-        student_id = await conn.fetchval(
-            "SELECT student_id FROM Students WHERE telegram_id = $1", user_tg
-        )
-        if not student_id:
-            return await message.answer("❌ Вы не студент или не зарегистрированы.", reply_markup=keyboards.student_kb)
+async def detach_topic_start(message: Message, state: FSMContext, identity: Identity):
+    student_id = identity.student_id
+    if not student_id:
+        return await message.answer("❌ Вы не студент или не зарегистрированы.", reply_markup=keyboards.student_kb)
 
+    async with acquire() as conn:
         rows = await conn.fetch(
             """
             SELECT title
@@ -262,8 +237,6 @@ async def detach_topic_start(message: Message, state: FSMContext):
         await message.answer("Выберите тему, от которой хотите открепиться:", reply_markup=kb)
         await state.update_data(student_id=student_id)
         await state.set_state(DetachStates.WAITING_TITLE)
-    finally:
-        await conn.close()
 
 
 async def process_detach(message: Message, state: FSMContext):
@@ -274,23 +247,25 @@ async def process_detach(message: Message, state: FSMContext):
         await message.answer("❌ Повторите команду.", reply_markup=keyboards.student_kb)
         return await state.clear()
 
-    conn = await create_db_connection()
     try:
-        result = await conn.execute(
-            """
-            UPDATE Topics
-               SET student_id = NULL, status = 'free'
-             WHERE title = $1 AND student_id = $2
-            """,
-            title, student_id
-        )
-        if result == 'UPDATE 1':
-            await message.answer(f"✅ Вы открепились от темы «{title}».", reply_markup=keyboards.student_kb)
-            await log_action(conn, str(message.from_user.id), 'detach_topic', {'title': title})
-        else:
-            await message.answer("❌ Не удалось найти такую тему, привязанную к вам.", reply_markup=keyboards.student_kb)
+        async with acquire() as conn:
+            detached = await conn.fetch(
+                """
+                UPDATE Topics
+                   SET student_id = NULL, status = 'free'
+                 WHERE title = $1 AND student_id = $2
+                RETURNING topic_id
+                """,
+                title, student_id
+            )
+            if len(detached) == 1:
+                keyword_index.set_status(detached[0]['topic_id'], 'free')
+                invalidate_student(student_id)
+                await message.answer(f"✅ Вы открепились от темы «{title}».", reply_markup=keyboards.student_kb)
+                eventlog.log_action(str(message.from_user.id), 'detach_topic', {'title': title})
+            else:
+                await message.answer("❌ Не удалось найти такую тему, привязанную к вам.", reply_markup=keyboards.student_kb)
     finally:
-        await conn.close()
         await state.clear()
 
 
@@ -310,33 +285,39 @@ async def delete_account_start(message: Message, state: FSMContext):
     await state.set_state(DeleteAccountStates.CONFIRM)
 
 
-async def process_delete_account(message: Message, state: FSMContext):
-    user_tg = str(message.from_user.id)
-    conn = await create_db_connection()
-    try:
-        student = await conn.fetchrow("SELECT student_id FROM Students WHERE telegram_id = $1", user_tg)
-        if student:
-            sid = student['student_id']
-            await conn.execute("DELETE FROM Topics WHERE student_id=$1", sid)
+async def process_delete_account(message: Message, state: FSMContext, identity: Identity):
+    user_tg = identity.telegram_id
+    async with acquire() as conn:
+        if identity.is_student:
+            sid = identity.student_id
+            removed = await conn.fetch(
+                "DELETE FROM Topics WHERE student_id=$1 RETURNING topic_id", sid
+            )
             await conn.execute("DELETE FROM Students WHERE student_id=$1", sid)
-            await log_action(conn, user_tg, 'delete_account', {'role':'student'})
+            for r in removed:
+                keyword_index.remove(r['topic_id'])
+            eventlog.log_action(user_tg, 'delete_account', {'role':'student'})
+            invalidate(user_tg)
             await message.answer("✅ Ваш аккаунт и все ваши темы удалены.", reply_markup=keyboards.registration_kb)
             await state.clear()
             return
 
-        teacher = await conn.fetchrow("SELECT teacher_id FROM Teachers WHERE telegram_id = $1", user_tg)
-        if teacher:
-            tid = teacher['teacher_id']
-            await conn.execute("DELETE FROM Topics WHERE teacher_id=$1", tid)
+        if identity.is_teacher:
+            tid = identity.teacher_id
+            orphaned = await conn.fetch(
+                "DELETE FROM Topics WHERE teacher_id=$1 RETURNING topic_id, student_id", tid
+            )
             await conn.execute("DELETE FROM Teachers WHERE teacher_id=$1", tid)
-            await log_action(conn, user_tg, 'delete_account', {'role':'teacher'})
+            eventlog.log_action(user_tg, 'delete_account', {'role':'teacher'})
+            invalidate(user_tg)
+            for r in orphaned:
+                keyword_index.remove(r['topic_id'])
+                invalidate_student(r['student_id'])
             await message.answer("✅ Ваш преподавательский аккаунт и все ваши темы удалены.", reply_markup=keyboards.registration_kb)
             await state.clear()
             return
 
         await message.answer("⚠️ Аккаунт не найден.", reply_markup=keyboards.registration_kb)
-    finally:
-        await conn.close()
 
 
 async def cancel_detach(message: Message, state: FSMContext):
@@ -344,19 +325,8 @@ async def cancel_detach(message: Message, state: FSMContext):
     await message.answer("Открепление отменено.", reply_markup=keyboards.student_kb)
 
 
-async def cancel_delete_account(message: Message, state: FSMContext):
+async def cancel_delete_account(message: Message, state: FSMContext, identity: Identity):
     await state.clear()
-    kb = keyboards.student_kb if await _is_student(message) else keyboards.teacher_kb
+    kb = keyboards.student_kb if identity.is_student else keyboards.teacher_kb
     await message.answer("Удаление отменено.", reply_markup=kb)
 
-
-# вспомогательная функция
-async def _is_student(message: Message) -> bool:
-    conn = await create_db_connection()
-    try:
-        return bool(await conn.fetchval(
-            "SELECT 1 FROM Students WHERE telegram_id=$1",
-            str(message.from_user.id)
-        ))
-    finally:
-        await conn.close()
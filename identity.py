@@ -0,0 +1,154 @@
+# identity.py
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+from config import IDENTITY_CACHE_TTL, IDENTITY_CACHE_MAX_SIZE
+from database import acquire
+import statements
+
+
+@dataclass(frozen=True)
+class Identity:
+    """Кто пишет боту: роль и ключевые идентификаторы пользователя."""
+    telegram_id: str
+    role: str | None = None            # 'student', 'teacher' или None
+    student_id: int | None = None
+    teacher_id: int | None = None
+    department_id: int | None = None
+    topic_id: int | None = None        # закреплённая за студентом тема
+
+    @property
+    def is_student(self) -> bool:
+        return self.student_id is not None
+
+    @property
+    def is_teacher(self) -> bool:
+        return self.teacher_id is not None
+
+    @property
+    def is_registered(self) -> bool:
+        return self.role is not None
+
+
+# Один запрос на обе таблицы вместо отдельных SELECT по Students и Teachers
+_IDENTITY_SQL = """
+    SELECT 'student' AS role, s.student_id, NULL::INTEGER AS teacher_id, s.department_id,
+           (SELECT t.topic_id FROM Topics t
+             WHERE t.student_id = s.student_id AND t.status IN ('reserved', 'closed')
+             ORDER BY t.topic_id LIMIT 1) AS topic_id
+      FROM Students s
+     WHERE s.telegram_id = $1
+    UNION ALL
+    SELECT 'teacher', NULL, te.teacher_id, te.department_id, NULL
+      FROM Teachers te
+     WHERE te.telegram_id = $1
+"""
+_IDENTITY = statements.register("identity.load", _IDENTITY_SQL)
+
+# telegram_id -> (момент устаревания, Identity)
+_cache: dict[str, tuple[float, Identity]] = {}
+# student_id -> telegram_id, чтобы сбрасывать кэш по изменениям в Topics
+_by_student: dict[int, str] = {}
+
+
+async def _load_identity(telegram_id: str) -> Identity:
+    async with acquire() as conn:
+        rows = await _IDENTITY.fetch(conn, telegram_id)
+
+    student = next((r for r in rows if r['role'] == 'student'), None)
+    teacher = next((r for r in rows if r['role'] == 'teacher'), None)
+    if student is None and teacher is None:
+        return Identity(telegram_id=telegram_id)
+    # Как и раньше, при двойной регистрации роль студента приоритетнее
+    main = student or teacher
+    return Identity(
+        telegram_id=telegram_id,
+        role=main['role'],
+        student_id=student['student_id'] if student else None,
+        teacher_id=teacher['teacher_id'] if teacher else None,
+        department_id=main['department_id'],
+        topic_id=student['topic_id'] if student else None,
+    )
+
+
+def _store(identity: Identity):
+    if len(_cache) >= IDENTITY_CACHE_MAX_SIZE:
+        now = time.monotonic()
+        for key in [k for k, (exp, _) in _cache.items() if exp <= now]:
+            invalidate(key)
+        # Всё ещё переполнен — вытесняем самые старые записи
+        while len(_cache) >= IDENTITY_CACHE_MAX_SIZE:
+            invalidate(next(iter(_cache)))
+    _cache[identity.telegram_id] = (time.monotonic() + IDENTITY_CACHE_TTL, identity)
+    if identity.student_id is not None:
+        _by_student[identity.student_id] = identity.telegram_id
+
+
+async def get_identity(telegram_id) -> Identity:
+    """Возвращает Identity пользователя из кэша или одним запросом к БД."""
+    telegram_id = str(telegram_id)
+    cached = _cache.get(telegram_id)
+    if cached and cached[0] > time.monotonic():
+        return cached[1]
+    identity = await _load_identity(telegram_id)
+    _store(identity)
+    return identity
+
+
+def invalidate(telegram_id):
+    """Сбрасывает кэш после регистрации, удаления аккаунта или смены темы."""
+    cached = _cache.pop(str(telegram_id), None)
+    if cached and cached[1].student_id is not None:
+        _by_student.pop(cached[1].student_id, None)
+
+
+def invalidate_student(student_id: int | None):
+    """То же, что invalidate(), когда известен только student_id."""
+    if student_id is None:
+        return
+    telegram_id = _by_student.pop(student_id, None)
+    if telegram_id is not None:
+        _cache.pop(telegram_id, None)
+
+
+def user_changed(telegram_id: str | None):
+    """Обработчик NOTIFY refdata 'user:<telegram_id>' (refdata.subscribe); None — сбросить всё."""
+    if telegram_id is None:
+        _cache.clear()
+        _by_student.clear()
+    else:
+        invalidate(telegram_id)
+
+
+def student_changed(student_id: str | None):
+    """Обработчик NOTIFY refdata 'student:<id>': у студента сменилась тема."""
+    if student_id is None:
+        user_changed(None)
+    else:
+        invalidate_student(int(student_id))
+
+
+class IdentityMiddleware(BaseMiddleware):
+    """Подставляет в хэндлеры аргумент identity: Identity."""
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None:
+            data["identity"] = await get_identity(user.id)
+        return await handler(event, data)
+
+
+def setup(dp):
+    # Внутренний middleware: запрос выполняется, только если нашёлся хэндлер
+    middleware = IdentityMiddleware()
+    dp.message.middleware(middleware)
+    dp.callback_query.middleware(middleware)
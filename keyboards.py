@@ -1,6 +1,9 @@
 # keyboard.py
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
 
+import identity
+import text_router
+
 student_kb = ReplyKeyboardMarkup(
     keyboard=[
         [KeyboardButton(text='📝 Предложить тему')],
@@ -18,6 +21,8 @@ teacher_kb = ReplyKeyboardMarkup(
         [KeyboardButton(text='📝 Предложить тему')],
         [KeyboardButton(text='🔍 Поиск темы')],
         [KeyboardButton(text='📈 Аналитика')],
+        [KeyboardButton(text='📣 Рассылка')],
+        [KeyboardButton(text='📥 Импорт')],
         [KeyboardButton(text='📚 Свободные темы')],
         [KeyboardButton(text='✅ Одобрить тему')],
         [KeyboardButton(text='👤 Просмотр профиля')],
@@ -51,4 +56,8 @@ main_kb = ReplyKeyboardMarkup(
 )
 
 def setup(dp):
-    pass
+    # Роль и id пользователя подставляются в хэндлеры аргументом identity
+    identity.setup(dp)
+    # Кнопки меню и ввод в диалогах — через таблицу маршрутов
+    text_router.setup(dp)
+
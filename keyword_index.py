@@ -0,0 +1,172 @@
+# keyword_index.py
+"""Инвертированный индекс ключевых слов тем, живущий в памяти процесса.
+
+Каждое ключевое слово темы и каждое слово внутри него раскладывается на
+префиксы (от MIN_TERM_LENGTH символов до полной длины), и для каждого префикса
+хранится множество topic_id. Поиск по слову — один поиск в словаре, без
+обращения к БД; в БД потом идёт только выборка найденных тем по id.
+
+Свои изменения хэндлеры вносят в индекс сразу; изменения тем в других
+процессах бота приходят по NOTIFY refdata 'topic:<id>' (topic_changed) и
+перечитываются из БД пачкой.
+"""
+import asyncio
+import logging
+import re
+
+from database import acquire
+
+logger = logging.getLogger(__name__)
+
+MIN_TERM_LENGTH = 2
+# Уведомления одной транзакции (импорт сотен тем) приходят подряд —
+# собираем их перед запросом к БД
+_REFRESH_DELAY = 0.2
+_RETRY_DELAY = 5
+
+# префикс -> множество topic_id
+_index: dict[str, set[int]] = {}
+# topic_id -> префиксы темы (нужно для удаления и замены ключевых слов)
+_topic_prefixes: dict[int, set[str]] = {}
+# topic_id -> статус темы
+_status: dict[int, str] = {}
+
+_EMPTY: frozenset = frozenset()
+
+# Темы, изменённые другими процессами, и нужна ли полная перестройка
+_stale: set[int] = set()
+_rebuild = False
+_refresher: asyncio.Task | None = None
+
+
+def normalize(text: str) -> str:
+    return re.sub(r'\s+', ' ', text.lower().replace('ё', 'е')).strip()
+
+
+def _prefixes(keyword: str) -> set[str]:
+    result = set()
+    words = [keyword] + keyword.split(' ')
+    for word in words:
+        for end in range(MIN_TERM_LENGTH, len(word) + 1):
+            result.add(word[:end])
+    return result
+
+
+def add(topic_id: int, keywords, status: str = 'free'):
+    """Добавляет тему в индекс (или заменяет её ключевые слова)."""
+    remove(topic_id)
+    prefixes = set()
+    for kw in keywords or []:
+        prefixes |= _prefixes(normalize(kw))
+    for prefix in prefixes:
+        _index.setdefault(prefix, set()).add(topic_id)
+    _topic_prefixes[topic_id] = prefixes
+    _status[topic_id] = status
+
+
+def remove(topic_id: int):
+    for prefix in _topic_prefixes.pop(topic_id, ()):
+        posting = _index.get(prefix)
+        if posting is not None:
+            posting.discard(topic_id)
+            if not posting:
+                del _index[prefix]
+    _status.pop(topic_id, None)
+
+
+def set_status(topic_id: int, status: str):
+    if topic_id in _status:
+        _status[topic_id] = status
+
+
+async def build():
+    """Полностью перестраивает индекс по таблице Topics (вызывается при старте)."""
+    async with acquire() as conn:
+        rows = await conn.fetch("SELECT topic_id, keywords, status FROM Topics")
+    _index.clear()
+    _topic_prefixes.clear()
+    _status.clear()
+    for r in rows:
+        add(r['topic_id'], r['keywords'], r['status'])
+
+
+def topic_changed(topic_id: str | None):
+    """Обработчик NOTIFY refdata 'topic:<id>' (refdata.subscribe); None — перестроить всё."""
+    global _rebuild, _refresher
+    if topic_id is None:
+        _rebuild = True
+    else:
+        _stale.add(int(topic_id))
+    if _refresher is None or _refresher.done():
+        _refresher = asyncio.create_task(_refresh())
+
+
+async def _refresh():
+    global _rebuild
+    while _stale or _rebuild:
+        await asyncio.sleep(_REFRESH_DELAY)
+        ids, rebuild = list(_stale), _rebuild
+        _stale.clear()
+        _rebuild = False
+        try:
+            if rebuild:
+                await build()
+                continue
+            async with acquire() as conn:
+                rows = await conn.fetch(
+                    "SELECT topic_id, keywords, status FROM Topics WHERE topic_id = ANY($1::int[])", ids
+                )
+        except Exception:
+            logger.exception("Не удалось обновить индекс ключевых слов, повторим")
+            _stale.update(ids)
+            _rebuild = _rebuild or rebuild
+            await asyncio.sleep(_RETRY_DELAY)
+            continue
+        for r in rows:
+            add(r['topic_id'], r['keywords'], r['status'])
+        # Темы, которых больше нет, — удалены
+        for topic_id in set(ids) - {r['topic_id'] for r in rows}:
+            remove(topic_id)
+
+
+def parse_query(text: str) -> list[list[str]]:
+    """«a + b, c» -> [['a', 'b'], ['c']]: запятая — ИЛИ, плюс — И."""
+    groups = []
+    for group in text.split(','):
+        terms = [normalize(t) for t in group.split('+')]
+        terms = [t for t in terms if len(t) >= MIN_TERM_LENGTH]
+        if terms:
+            groups.append(terms)
+    return groups
+
+
+def _intersect(terms: list[str]) -> set[int]:
+    postings = sorted((_index.get(t, _EMPTY) for t in terms), key=len)
+    # Начинаем с самого короткого списка: стоимость пересечения
+    # определяется им, а не самым популярным словом
+    result = set(postings[0])
+    for posting in postings[1:]:
+        if not result:
+            break
+        result &= posting
+    return result
+
+
+def search(groups: list[list[str]]) -> set[int]:
+    result: set[int] = set()
+    for terms in groups:
+        result |= _intersect(terms)
+    return result
+
+
+def rank(topic_ids, limit: int) -> list[int]:
+    """Не больше limit id: сначала свободные темы, затем более новые."""
+    return sorted(topic_ids, key=lambda tid: (_status.get(tid) != 'free', -tid))[:limit]
+
+
+def stats() -> dict:
+    return {
+        'topics': len(_topic_prefixes),
+        'terms': len(_index),
+        'postings': sum(len(p) for p in _index.values()),
+    }
@@ -1,18 +1,29 @@
 import asyncio
 import re
-import io
-import matplotlib.pyplot as plt
-from aiogram import Bot, Dispatcher, F
-from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton
+from aiogram import Bot, Dispatcher
+from aiogram.types import Message, ReplyKeyboardMarkup, KeyboardButton, BufferedInputFile
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import Command
-from config import API_TOKEN
-from database import create_db_connection, init_db
+from config import API_TOKEN, BOT_MODE
+from database import acquire, init_pool, close_pool, init_db
+import charts
+import eventlog
+import fsm_storage
+from handlers import pagination
+import identity
+import keyword_index
+import reservations
+import text_router
+import webhook
+from identity import Identity, invalidate_student
 
 
 bot = Bot(token=API_TOKEN)
-dp = Dispatcher()
+dp = Dispatcher(storage=fsm_storage.make_storage())
+identity.setup(dp)
+routes = text_router.setup(dp)
+pagination.register_handlers(dp)
 
 # Константы
 TEACHER_ACCESS_CODE = "prof_code_123"
@@ -72,195 +83,146 @@ cancel_kb = ReplyKeyboardMarkup(
     resize_keyboard=True
 )
 
-@dp.message(F.text == '📚 Свободные темы')
-async def list_free_topics(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    conn = None
-    try:
-        conn = await create_db_connection()
-        student_id = await conn.fetchval(
-            "SELECT student_id FROM Students WHERE telegram_id = $1", str(user_id)
-        )
-        if not student_id:
-            await message.answer("❌ Эта функция доступна только студентам!")
-            return
-        free_topics = await conn.fetch(
-            "SELECT title FROM Topics WHERE status='free' AND department_id = ("
-            "SELECT department_id FROM Students WHERE student_id=$1) LIMIT 10", student_id
-        )
-        if not free_topics:
-            await message.answer("Свободных тем пока нет.", reply_markup=student_kb)
-            return
-        topics_list = '\n'.join(f"• {t['title']}" for t in free_topics)
-        await message.answer(
-            f"Выберите тему для закрепления (введите точное название):\n{topics_list}",
-            reply_markup=cancel_kb
-        )
-        await state.set_state(ReserveStates.WAITING_TITLE)
-    finally:
-        if conn:
-            await conn.close()
-
-@dp.message(ReserveStates.WAITING_TITLE)
-async def process_reserve_title(message: Message, state: FSMContext):
+@routes.text('📚 Свободные темы')
+async def list_free_topics(message: Message, state: FSMContext, identity: Identity):
+    if not identity.is_student:
+        await message.answer("❌ Эта функция доступна только студентам!")
+        return
+    if identity.department_id is None or not await pagination.send_first_page(
+        message, 'dept', str(identity.department_id)
+    ):
+        await message.answer("Свободных тем пока нет.", reply_markup=student_kb)
+        return
+    await message.answer(
+        "Выберите тему для закрепления (введите точное название):",
+        reply_markup=cancel_kb
+    )
+    await state.set_state(ReserveStates.WAITING_TITLE)
+
+@routes.any_text(ReserveStates.WAITING_TITLE)
+async def process_reserve_title(message: Message, state: FSMContext, identity: Identity):
     title = message.text.strip()
-    user_id = message.from_user.id
-    conn = None
-    try:
-        conn = await create_db_connection()
-        student_id = await conn.fetchval(
-            "SELECT student_id FROM Students WHERE telegram_id=$1", str(user_id)
-        )
-        existing = await conn.fetchval(
-            "SELECT COUNT(*) FROM Topics WHERE student_id=$1", student_id
-        )
-        if existing and existing > 0:
-            await message.answer(
-                "⚠️ У вас уже есть закрепленная тему. Сначала открепитесь от неё.",
-                reply_markup=student_kb
-            )
-            await state.clear()
-            return
-        updated = await conn.fetchrow(
-            """
-            UPDATE Topics
-            SET status='reserved', student_id=$1
-            WHERE title=$2 AND status='free'
-            RETURNING topic_id
-            """,
-            student_id, title
-        )
-        if not updated:
-            await message.answer(
-                "Тема не найдена или уже занята. Попробуйте выбрать другую.",
-                reply_markup=student_kb
-            )
-        else:
-            topic_id = updated['topic_id']
-            await conn.execute(
-                "INSERT INTO Interactions(student_id, topic_id, user_role, action) VALUES($1,$2,'student','reserved')",
-                student_id, topic_id
-            )
-            await message.answer(
-                f"✅ Тема «{title}» успешно закреплена за вами!", reply_markup=student_kb
-            )
-    finally:
-        if conn:
-            await conn.close()
-        await state.clear()
-
-@dp.message(F.text == '🔄 Сменить тему')
-async def start_unreserve(message: Message, state: FSMContext):
-    user_id = message.from_user.id
-    conn = None
-    try:
-        conn = await create_db_connection()
-        student_id = await conn.fetchval(
-            "SELECT student_id FROM Students WHERE telegram_id=$1", str(user_id)
-        )
-        if not student_id:
-            await message.answer("❌ Эта функция доступна только студентам!")
-            return
+    await state.clear()
+    result = await reservations.claim(identity.student_id, title=title)
+    if result.outcome == 'claimed':
+        text = f"✅ Тема «{title}» успешно закреплена за вами!"
+    elif result.outcome == 'already':
+        text = f"Тема «{title}» уже закреплена за вами."
+    elif result.outcome == 'has_topic':
+        text = (f"⚠️ За вами уже закреплена тема «{result.title}». "
+                "Сначала открепитесь от неё.")
+    elif result.outcome == 'taken' and result.holder_name:
+        text = f"❌ Тему «{title}» уже закрепил {result.holder_name}. Выберите другую."
+    elif result.outcome == 'taken':
+        text = f"❌ Тема «{title}» уже занята. Выберите другую."
+    else:
+        text = "Тема не найдена. Проверьте точное название."
+    await message.answer(text, reply_markup=student_kb)
+
+@routes.text('🔄 Сменить тему')
+async def start_unreserve(message: Message, state: FSMContext, identity: Identity):
+    student_id = identity.student_id
+    if not student_id:
+        await message.answer("❌ Эта функция доступна только студентам!")
+        return
+    async with acquire() as conn:
         current = await conn.fetchrow(
             "SELECT title FROM Topics WHERE student_id=$1", student_id
         )
-        if not current:
-            await message.answer("У вас нет закреплённой темы.", reply_markup=student_kb)
-            return
-        title = current['title']
-        yes_no_kb = ReplyKeyboardMarkup(
-            keyboard=[
-                [KeyboardButton(text='Да'), KeyboardButton(text='Нет')],
-                [KeyboardButton(text='❌ Отмена')]
-            ],
-            resize_keyboard=True
-        )
-        await message.answer(
-            f"Ваша текущая тема: «{title}». Вы действительно хотите открепиться?",
-            reply_markup=yes_no_kb
-        )
-        await state.update_data(title=title, student_id=student_id)
-        await state.set_state(UnreserveStates.WAITING_CONFIRM)
-    finally:
-        if conn:
-            await conn.close()
-
-@dp.message(UnreserveStates.WAITING_CONFIRM)
+    if not current:
+        await message.answer("У вас нет закреплённой темы.", reply_markup=student_kb)
+        return
+    title = current['title']
+    yes_no_kb = ReplyKeyboardMarkup(
+        keyboard=[
+            [KeyboardButton(text='Да'), KeyboardButton(text='Нет')],
+            [KeyboardButton(text='❌ Отмена')]
+        ],
+        resize_keyboard=True
+    )
+    await message.answer(
+        f"Ваша текущая тема: «{title}». Вы действительно хотите открепиться?",
+        reply_markup=yes_no_kb
+    )
+    await state.update_data(title=title, student_id=student_id)
+    await state.set_state(UnreserveStates.WAITING_CONFIRM)
+
+@routes.any_text(UnreserveStates.WAITING_CONFIRM)
 async def process_unreserve_confirm(message: Message, state: FSMContext):
     text = message.text.strip().lower()
     data = await state.get_data()
     title = data.get('title')
     student_id = data.get('student_id')
-    conn = None
-    try:
-        if text == 'да':
-            conn = await create_db_connection()
-            await conn.execute(
-                "UPDATE Topics SET status='free', student_id=NULL WHERE student_id=$1", student_id
-            )
-            await conn.execute(
-                "INSERT INTO Interactions(student_id, topic_id, user_role, action) "
-                "SELECT $1, topic_id, 'student', 'unreserved' FROM Topics WHERE title=$2",
-                student_id, title
-            )
-            await message.answer(
-                f"✅ Вы успешно открепились от темы «{title}».", reply_markup=student_kb
-            )
-        else:
-            await message.answer("Операция отменена.", reply_markup=student_kb)
-    finally:
-        if conn:
-            await conn.close()
-        await state.clear()
+    await state.clear()
+    if text != 'да':
+        await message.answer("Операция отменена.", reply_markup=student_kb)
+        return
+    async with acquire() as conn:
+        released = await conn.fetch(
+            "UPDATE Topics SET status='free', student_id=NULL WHERE student_id=$1 RETURNING topic_id",
+            student_id
+        )
+    for r in released:
+        keyword_index.set_status(r['topic_id'], 'free')
+        eventlog.log_interaction(
+            'unreserved', 'student', student_id=student_id, topic_id=r['topic_id']
+        )
+    invalidate_student(student_id)
+    await message.answer(
+        f"✅ Вы успешно открепились от темы «{title}».", reply_markup=student_kb
+    )
 
 async def send_group_histogram(message: Message):
-    conn = await create_db_connection()
-    try:
+    async with acquire() as conn:
         rows = await conn.fetch(
-            "SELECT COALESCE(group_name, 'Не указана') AS grp, COUNT(*) AS cnt "
-            "FROM Students GROUP BY grp ORDER BY cnt DESC"
+            "SELECT COALESCE(NULLIF(group_name, ''), 'Не указана') AS grp, SUM(students) AS cnt "
+            "FROM GroupStats WHERE students > 0 GROUP BY grp ORDER BY cnt DESC"
         )
-        groups = [r['grp'] for r in rows]
-        counts = [r['cnt'] for r in rows]
+    groups = [r['grp'] for r in rows]
+    counts = [r['cnt'] for r in rows]
 
-        # Построение гистограммы
-        plt.figure(figsize=(8,4))
-        plt.bar(groups, counts)
-        plt.xlabel('Группа')
-        plt.ylabel('Число студентов')
-        plt.title('Распределение студентов по группам')
-        plt.tight_layout()
-
-        buf = io.BytesIO()
-        plt.savefig(buf, format='png')
-        buf.seek(0)
-        await bot.send_photo(message.chat.id, buf)
-        plt.close()
-    finally:
-        await conn.close()
+    try:
+        png = await charts.render('group_sizes', groups, counts)
+    except charts.ChartError:
+        await message.answer("⚠️ Не удалось построить график, попробуйте позже.")
+        return
+    await bot.send_photo(message.chat.id, BufferedInputFile(png, filename="groups.png"))
 
-@dp.message(F.text == '📊 Статистика по группам')
+@routes.text('📊 Статистика по группам')
 async def cmd_group_stats(message: Message):
     await send_group_histogram(message)
 
 @dp.message(Command("start"))
-async def start_handler(message: Message):
-    user_id = message.from_user.id
-    conn = None
+async def start_handler(message: Message, identity: Identity):
+    if identity.is_student:
+        await message.answer("🎓 Добро пожаловать, студент!", reply_markup=student_kb)
+    elif identity.is_teacher:
+        await message.answer("👨🏫 Добро пожаловать, преподаватель!", reply_markup=teacher_kb)
+    else:
+        # ... регистрация
+        pass
+
+async def main():
+    await init_pool()
     try:
-        conn = await create_db_connection()
-        student = await conn.fetchrow("SELECT 1 FROM Students WHERE telegram_id=$1", str(user_id))
-        teacher = await conn.fetchrow("SELECT 1 FROM Teachers WHERE telegram_id=$1", str(user_id))
-        if student:
-            await message.answer("🎓 Добро пожаловать, студент!", reply_markup=student_kb)
-        elif teacher:
-            await message.answer("👨🏫 Добро пожаловать, преподаватель!", reply_markup=teacher_kb)
-        else:
-            # ... регистрация
-            pass
+        await init_db()
+        await keyword_index.build()
+        await eventlog.start()
+        fsm_storage.start()
+        charts.start()
+        try:
+            if BOT_MODE == 'webhook':
+                await webhook.run(bot, dp)
+            else:
+                # После работы в режиме webhook getUpdates вернёт Conflict, пока он не снят
+                await bot.delete_webhook()
+                await dp.start_polling(bot)
+        finally:
+            charts.stop()
+            await eventlog.stop()
+            await fsm_storage.stop()
     finally:
-        if conn:
-            await conn.close()
+        await close_pool()
 
 if __name__ == '__main__':
-    asyncio.run(dp.start_polling(bot))
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
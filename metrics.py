@@ -0,0 +1,213 @@
+# metrics.py
+"""Метрики обработки обновлений в текстовом формате Prometheus.
+
+На каждое обновление записываются хэндлер, состояние FSM, исход (handled,
+unhandled, error), полное время обработки, время в БД и время запросов к
+Bot API. Гистограммы и счётчики отдаются по HTTP на
+METRICS_HOST:METRICS_PORT/metrics вместе с состоянием пула соединений.
+
+Запись — пара perf_counter, contextvar и bisect на обновление (единицы
+микросекунд, см. benchmarks/metrics_overhead.py). METRICS_ENABLED=0
+выключает и middleware, и сервер.
+"""
+import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from dataclasses import dataclass
+
+from aiohttp import web
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.dispatcher.event.bases import UNHANDLED
+
+from config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+import database
+import fsm_storage
+import querytrace
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин, секунды: от быстрых ответов из кэша до графиков
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+NO_HANDLER = "none"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: tuple[str, ...]):
+        self.name = name
+        self.help = help_text
+        self.labels = labels
+        self._values: dict[tuple, int] = {}
+
+    def inc(self, key: tuple):
+        self._values[key] = self._values.get(key, 0) + 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in sorted(self._values.items()):
+            labels = ",".join(f'{n}="{_escape(v)}"' for n, v in zip(self.labels, key))
+            lines.append(f"{self.name}{{{labels}}} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, label: str, buckets: tuple[float, ...] = BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = buckets
+        # значение метки -> [счётчики по корзинам (последняя — +Inf), сумма]
+        self._series: dict[str, list] = {}
+
+    def observe(self, key: str, value: float):
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self._series.items()):
+            label = f'{self.label}="{_escape(key)}"'
+            total = 0
+            for bound, count in zip(self.buckets, series):
+                total += count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {total}')
+            total += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {total}')
+            lines.append(f"{self.name}_sum{{{label}}} {series[-1]}")
+            lines.append(f"{self.name}_count{{{label}}} {total}")
+        return lines
+
+
+updates_total = Counter(
+    "bot_updates_total", "Обработанные обновления", ("handler", "state", "outcome")
+)
+update_seconds = Histogram(
+    "bot_update_duration_seconds", "Полное время обработки обновления", "handler"
+)
+db_seconds = Histogram(
+    "bot_update_db_seconds", "Время запросов к БД за обновление", "handler"
+)
+api_seconds = Histogram(
+    "bot_update_api_seconds", "Время запросов к Bot API за обновление", "handler"
+)
+api_requests_total = Counter(
+    "bot_api_requests_total", "Запросы к Bot API", ("method",)
+)
+
+
+@dataclass
+class _Update:
+    handler: str = NO_HANDLER
+    state: str = "none"
+    api: float = 0.0
+
+
+_current: ContextVar[_Update | None] = ContextVar("metrics_update", default=None)
+
+
+class UpdateMetricsMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: время и исход всего обновления."""
+
+    async def __call__(self, handler, event, data):
+        update = _Update()
+        # Время в БД считает трассировка запросов, открытая querytrace раньше нас
+        queries = querytrace.current()
+        db_before = queries.time if queries is not None else 0.0
+        token = _current.set(update)
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            result = await handler(event, data)
+            outcome = "unhandled" if result is UNHANDLED else "handled"
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            _current.reset(token)
+            updates_total.inc((update.handler, update.state, outcome))
+            update_seconds.observe(update.handler, elapsed)
+            if queries is not None:
+                db_seconds.observe(update.handler, queries.time - db_before)
+            api_seconds.observe(update.handler, update.api)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware на событиях: какой хэндлер сработал и в каком состоянии."""
+
+    async def __call__(self, handler, event, data):
+        update = _current.get()
+        if update is not None:
+            update.handler = querytrace.handler_name(data)
+            update.state = data.get("raw_state") or "none"
+        return await handler(event, data)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время запросов к Bot API."""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            update = _current.get()
+            if update is not None:
+                update.api += time.perf_counter() - started
+            api_requests_total.inc((type(method).__name__,))
+
+
+def setup(dp: Dispatcher, bot: Bot):
+    """Подключает middleware метрик; вызывать после регистрации хэндлеров и querytrace.setup()."""
+    if not METRICS_ENABLED:
+        return
+    # Снаружи FSM: чтение состояния тоже входит во время обновления
+    fsm_storage.outer_middleware(dp, UpdateMetricsMiddleware())
+    handler_middleware = HandlerMetricsMiddleware()
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(handler_middleware)
+    bot.session.middleware(ApiMetricsMiddleware())
+
+
+def render() -> str:
+    lines = []
+    for metric in (updates_total, update_seconds, db_seconds, api_seconds, api_requests_total):
+        lines += metric.render()
+    for key, value in database.pool_stats().items():
+        kind = "counter" if key.endswith("_total") else "gauge"
+        lines += [f"# TYPE bot_db_pool_{key} {kind}", f"bot_db_pool_{key} {value}"]
+    return "\n".join(lines) + "\n"
+
+
+async def _handle(request: web.Request) -> web.Response:
+    return web.Response(body=render().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+_runner: web.AppRunner | None = None
+
+
+async def start():
+    """Запускает HTTP-сервер /metrics (если METRICS_ENABLED)."""
+    global _runner
+    if not METRICS_ENABLED or _runner is not None:
+        return
+    app = web.Application()
+    app.router.add_get("/metrics", _handle)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, METRICS_HOST, METRICS_PORT).start()
+    logger.info("Метрики: http://%s:%s/metrics", METRICS_HOST, METRICS_PORT)
+
+
+async def stop():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
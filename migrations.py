@@ -0,0 +1,829 @@
+# migrations.py
+"""Версионированные миграции схемы БД.
+
+Каждая миграция — (версия, название, SQL или корутина fn(conn)). Применённые
+версии записываются в schema_migrations, при старте выполняются только новые.
+Новую миграцию добавляют в конец MIGRATIONS со следующим номером; уже
+выпущенные миграции не редактируют.
+"""
+import asyncpg
+
+# Ключ advisory-lock, чтобы две копии бота не накатывали миграции одновременно
+_LOCK_KEY = 0x4E4952  # 'NIR'
+
+BASELINE = """
+    -- Таблицы предметной области
+    CREATE TABLE IF NOT EXISTS Departments (
+        department_id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        description TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS Students (
+        student_id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        email TEXT UNIQUE,
+        phone TEXT,
+        telegram_id TEXT UNIQUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        group_name TEXT,
+        department_id INTEGER REFERENCES Departments(department_id) ON DELETE SET NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS Teachers (
+        teacher_id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        email TEXT UNIQUE,
+        phone TEXT,
+        telegram_id TEXT UNIQUE,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        department_id INTEGER REFERENCES Departments(department_id) ON DELETE SET NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS Topics (
+        topic_id SERIAL PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT,
+        keywords TEXT[],
+        status TEXT CHECK (status IN ('free', 'reserved', 'closed')),
+        teacher_id INTEGER REFERENCES Teachers(teacher_id) ON DELETE SET NULL,
+        student_id INTEGER REFERENCES Students(student_id) ON DELETE SET NULL,
+        department_id INTEGER REFERENCES Departments(department_id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS Suggestions (
+        suggestion_id SERIAL PRIMARY KEY,
+        title TEXT NOT NULL,
+        description TEXT,
+        student_id INTEGER REFERENCES Students(student_id) ON DELETE CASCADE,
+        status TEXT CHECK (status IN ('pending', 'approved', 'rejected')),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Обновлённая лог‑таблица действий
+    CREATE TABLE IF NOT EXISTS Interactions (
+        interaction_id SERIAL PRIMARY KEY,
+        teacher_id   INTEGER REFERENCES Teachers(teacher_id) ON DELETE CASCADE,
+        student_id   INTEGER REFERENCES Students(student_id) ON DELETE CASCADE,
+        topic_id     INTEGER REFERENCES Topics(topic_id)   ON DELETE CASCADE,
+        user_role    TEXT CHECK(user_role IN ('student','teacher')),
+        action       TEXT NOT NULL,
+        timestamp    TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Категории и связь с темами
+    CREATE TABLE IF NOT EXISTS Categories (
+        category_id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        parent_id INTEGER REFERENCES Categories(category_id) ON DELETE CASCADE
+    );
+
+    CREATE TABLE IF NOT EXISTS TopicCategories (
+        topic_id INTEGER REFERENCES Topics(topic_id) ON DELETE CASCADE,
+        category_id INTEGER REFERENCES Categories(category_id) ON DELETE CASCADE,
+        PRIMARY KEY(topic_id, category_id)
+    );
+
+    CREATE TABLE IF NOT EXISTS SearchLogs (
+        log_id SERIAL PRIMARY KEY,
+        student_id INTEGER REFERENCES Students(student_id) ON DELETE CASCADE,
+        query TEXT NOT NULL,
+        timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+EVENT_LOG = """
+    CREATE TABLE IF NOT EXISTS Logs (
+        log_id BIGSERIAL PRIMARY KEY,
+        user_id TEXT,
+        action TEXT NOT NULL,
+        details JSONB,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+"""
+
+FULL_TEXT_SEARCH = """
+    ALTER TABLE Topics ADD COLUMN IF NOT EXISTS search_vector TSVECTOR;
+
+    CREATE OR REPLACE FUNCTION topics_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('russian', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('russian', coalesce(array_to_string(NEW.keywords, ' '), '')), 'B') ||
+            setweight(to_tsvector('russian', coalesce(
+                (SELECT name FROM Teachers WHERE teacher_id = NEW.teacher_id), '')), 'C') ||
+            setweight(to_tsvector('russian', coalesce(NEW.description, '')), 'D');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS topics_search_vector_trg ON Topics;
+    CREATE TRIGGER topics_search_vector_trg
+        BEFORE INSERT OR UPDATE OF title, description, keywords, teacher_id ON Topics
+        FOR EACH ROW EXECUTE FUNCTION topics_search_vector_update();
+
+    -- Переименование преподавателя пересчитывает вектор его тем
+    CREATE OR REPLACE FUNCTION teachers_name_search_update() RETURNS trigger AS $$
+    BEGIN
+        UPDATE Topics SET teacher_id = teacher_id WHERE teacher_id = NEW.teacher_id;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS teachers_name_search_trg ON Teachers;
+    CREATE TRIGGER teachers_name_search_trg
+        AFTER UPDATE OF name ON Teachers
+        FOR EACH ROW WHEN (OLD.name IS DISTINCT FROM NEW.name)
+        EXECUTE FUNCTION teachers_name_search_update();
+
+    CREATE INDEX IF NOT EXISTS topics_search_vector_idx
+        ON Topics USING GIN (search_vector);
+
+    -- Заполняем вектор для тем, созданных до появления триггера
+    UPDATE Topics SET title = title WHERE search_vector IS NULL;
+"""
+
+TRIGRAM_INDEXES = """
+    CREATE INDEX IF NOT EXISTS topics_title_trgm_idx
+        ON Topics USING GIN (title gin_trgm_ops);
+    CREATE INDEX IF NOT EXISTS teachers_name_trgm_idx
+        ON Teachers USING GIN (name gin_trgm_ops);
+"""
+
+
+async def _trigram_search(conn):
+    # Расширения может не быть (нет прав или пакета contrib) — тогда поиск
+    # остаётся на ILIKE. Точка сохранения не даёт ошибке сорвать всю миграцию.
+    try:
+        async with conn.transaction():
+            await conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    except asyncpg.PostgresError as e:
+        print(f"pg_trgm недоступно, поиск без триграммных индексов: {e}")
+        return
+    await conn.execute(TRIGRAM_INDEXES)
+
+
+# Индексы под предикаты и сортировки из handlers/ и main.py
+HOT_PATH_INDEXES = """
+    -- Свободные темы кафедры (main.list_free_topics) и список свободных тем по названию
+    CREATE INDEX IF NOT EXISTS topics_status_department_idx ON Topics(status, department_id);
+    CREATE INDEX IF NOT EXISTS topics_free_title_idx ON Topics(title) WHERE status = 'free';
+    -- Темы студента (identity, открепление, удаление аккаунта, аналитика)
+    CREATE INDEX IF NOT EXISTS topics_student_idx ON Topics(student_id);
+    -- Темы преподавателя (поиск по преподавателю, удаление аккаунта)
+    CREATE INDEX IF NOT EXISTS topics_teacher_idx ON Topics(teacher_id);
+    -- Закрепление, одобрение и открепление по точному названию
+    CREATE INDEX IF NOT EXISTS topics_title_idx ON Topics(title);
+    -- Аналитика по кафедре и группе
+    CREATE INDEX IF NOT EXISTS students_department_group_idx ON Students(department_id, group_name);
+    -- Просмотр профиля по имени
+    CREATE INDEX IF NOT EXISTS students_name_idx ON Students(name);
+    CREATE INDEX IF NOT EXISTS teachers_name_idx ON Teachers(name);
+    -- Категории: дочерние узлы и темы категории
+    CREATE INDEX IF NOT EXISTS categories_parent_idx ON Categories(parent_id);
+    CREATE INDEX IF NOT EXISTS topic_categories_category_idx ON TopicCategories(category_id);
+    -- Журналы: выборки по времени и по студенту
+    CREATE INDEX IF NOT EXISTS interactions_timestamp_idx ON Interactions(timestamp);
+    CREATE INDEX IF NOT EXISTS search_logs_student_timestamp_idx ON SearchLogs(student_id, timestamp);
+    CREATE INDEX IF NOT EXISTS logs_created_at_idx ON Logs(created_at);
+"""
+
+# Счётчики для аналитики: поддерживаются триггерами, пересчитываются
+# целиком функцией analytics_rebuild() (python -m analytics_counters --rebuild).
+# Ключи без NULL: кафедра 0 — «не указана», группа '' — «не указана».
+# Студент с активной темой считается по его темам в статусе reserved/closed;
+# у студента одна активная тема, поэтому это число студентов.
+ANALYTICS_COUNTERS = """
+    CREATE TABLE IF NOT EXISTS DepartmentStats (
+        department_id INTEGER PRIMARY KEY,
+        students INTEGER NOT NULL DEFAULT 0,
+        students_reserved INTEGER NOT NULL DEFAULT 0,
+        students_closed INTEGER NOT NULL DEFAULT 0,
+        free_topics INTEGER NOT NULL DEFAULT 0
+    );
+
+    CREATE TABLE IF NOT EXISTS GroupStats (
+        department_id INTEGER NOT NULL,
+        group_name TEXT NOT NULL,
+        students INTEGER NOT NULL DEFAULT 0,
+        students_reserved INTEGER NOT NULL DEFAULT 0,
+        students_closed INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (department_id, group_name)
+    );
+
+    -- Эталонные значения «с нуля»: для проверки и перестроения счётчиков
+    CREATE OR REPLACE VIEW GroupStatsExpected AS
+    SELECT COALESCE(s.department_id, 0) AS department_id,
+           COALESCE(s.group_name, '') AS group_name,
+           count(*)::int AS students,
+           COALESCE(sum(t.reserved), 0)::int AS students_reserved,
+           COALESCE(sum(t.closed), 0)::int AS students_closed
+      FROM Students s
+      LEFT JOIN (
+            SELECT student_id,
+                   count(*) FILTER (WHERE status = 'reserved') AS reserved,
+                   count(*) FILTER (WHERE status = 'closed') AS closed
+              FROM Topics
+             WHERE student_id IS NOT NULL
+             GROUP BY student_id
+      ) t ON t.student_id = s.student_id
+     GROUP BY 1, 2;
+
+    CREATE OR REPLACE VIEW DepartmentStatsExpected AS
+    SELECT department_id,
+           sum(students)::int AS students,
+           sum(students_reserved)::int AS students_reserved,
+           sum(students_closed)::int AS students_closed,
+           sum(free_topics)::int AS free_topics
+      FROM (
+            SELECT department_id, students, students_reserved, students_closed, 0 AS free_topics
+              FROM GroupStatsExpected
+            UNION ALL
+            SELECT COALESCE(department_id, 0), 0, 0, 0, count(*)
+              FROM Topics
+             WHERE status = 'free'
+             GROUP BY 1
+      ) x
+     GROUP BY department_id;
+
+    CREATE OR REPLACE FUNCTION analytics_bump(
+        dept INTEGER, grp TEXT,
+        d_students INTEGER, d_reserved INTEGER, d_closed INTEGER, d_free INTEGER
+    ) RETURNS void AS $$
+    BEGIN
+        IF d_students = 0 AND d_reserved = 0 AND d_closed = 0 AND d_free = 0 THEN
+            RETURN;
+        END IF;
+        INSERT INTO DepartmentStats AS ds
+               (department_id, students, students_reserved, students_closed, free_topics)
+        VALUES (COALESCE(dept, 0), d_students, d_reserved, d_closed, d_free)
+        ON CONFLICT (department_id) DO UPDATE SET
+            students = ds.students + EXCLUDED.students,
+            students_reserved = ds.students_reserved + EXCLUDED.students_reserved,
+            students_closed = ds.students_closed + EXCLUDED.students_closed,
+            free_topics = ds.free_topics + EXCLUDED.free_topics;
+        IF d_students <> 0 OR d_reserved <> 0 OR d_closed <> 0 THEN
+            INSERT INTO GroupStats AS gs
+                   (department_id, group_name, students, students_reserved, students_closed)
+            VALUES (COALESCE(dept, 0), COALESCE(grp, ''), d_students, d_reserved, d_closed)
+            ON CONFLICT (department_id, group_name) DO UPDATE SET
+                students = gs.students + EXCLUDED.students,
+                students_reserved = gs.students_reserved + EXCLUDED.students_reserved,
+                students_closed = gs.students_closed + EXCLUDED.students_closed;
+        END IF;
+    END
+    $$ LANGUAGE plpgsql;
+
+    CREATE OR REPLACE FUNCTION topics_analytics_update() RETURNS trigger AS $$
+    DECLARE
+        st RECORD;
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            IF OLD.status = 'free' THEN
+                PERFORM analytics_bump(OLD.department_id, NULL, 0, 0, 0, -1);
+            ELSIF OLD.student_id IS NOT NULL THEN
+                SELECT department_id, group_name INTO st
+                  FROM Students WHERE student_id = OLD.student_id;
+                -- Студента уже нет: его темы вычел триггер удаления студента
+                IF FOUND THEN
+                    PERFORM analytics_bump(st.department_id, st.group_name, 0,
+                        -(OLD.status = 'reserved')::int, -(OLD.status = 'closed')::int, 0);
+                END IF;
+            END IF;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            IF NEW.status = 'free' THEN
+                PERFORM analytics_bump(NEW.department_id, NULL, 0, 0, 0, 1);
+            ELSIF NEW.student_id IS NOT NULL THEN
+                SELECT department_id, group_name INTO st
+                  FROM Students WHERE student_id = NEW.student_id;
+                IF FOUND THEN
+                    PERFORM analytics_bump(st.department_id, st.group_name, 0,
+                        (NEW.status = 'reserved')::int, (NEW.status = 'closed')::int, 0);
+                END IF;
+            END IF;
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS topics_analytics_trg ON Topics;
+    CREATE TRIGGER topics_analytics_trg
+        AFTER INSERT OR DELETE OR UPDATE OF status, student_id, department_id ON Topics
+        FOR EACH ROW EXECUTE FUNCTION topics_analytics_update();
+
+    CREATE OR REPLACE FUNCTION students_analytics_update() RETURNS trigger AS $$
+    DECLARE
+        n_reserved INTEGER := 0;
+        n_closed INTEGER := 0;
+    BEGIN
+        -- Активные темы студента переезжают вместе с ним
+        IF TG_OP <> 'INSERT' THEN
+            SELECT count(*) FILTER (WHERE status = 'reserved'),
+                   count(*) FILTER (WHERE status = 'closed')
+              INTO n_reserved, n_closed
+              FROM Topics WHERE student_id = OLD.student_id;
+            PERFORM analytics_bump(OLD.department_id, OLD.group_name, -1, -n_reserved, -n_closed, 0);
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM analytics_bump(NEW.department_id, NEW.group_name, 1, n_reserved, n_closed, 0);
+            RETURN NEW;
+        END IF;
+        RETURN OLD;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS students_analytics_trg ON Students;
+    CREATE TRIGGER students_analytics_trg
+        AFTER INSERT OR UPDATE OF department_id, group_name ON Students
+        FOR EACH ROW EXECUTE FUNCTION students_analytics_update();
+
+    -- Удаление — BEFORE: пока ON DELETE SET NULL не отвязал темы студента
+    DROP TRIGGER IF EXISTS students_analytics_delete_trg ON Students;
+    CREATE TRIGGER students_analytics_delete_trg
+        BEFORE DELETE ON Students
+        FOR EACH ROW EXECUTE FUNCTION students_analytics_update();
+
+    CREATE OR REPLACE FUNCTION analytics_rebuild() RETURNS void AS $$
+    BEGIN
+        -- На время пересчёта не даём менять студентов и темы
+        LOCK TABLE Students, Topics IN SHARE MODE;
+        DELETE FROM GroupStats;
+        DELETE FROM DepartmentStats;
+        INSERT INTO GroupStats SELECT * FROM GroupStatsExpected;
+        INSERT INTO DepartmentStats SELECT * FROM DepartmentStatsExpected;
+    END
+    $$ LANGUAGE plpgsql;
+
+    SELECT analytics_rebuild();
+"""
+
+# Постраничный просмотр свободных тем идёт по ключу (title, topic_id);
+# индексы заменяют topics_free_title_idx из миграции 5
+KEYSET_PAGINATION = """
+    CREATE INDEX IF NOT EXISTS topics_free_title_id_idx
+        ON Topics(title, topic_id) WHERE status = 'free';
+    CREATE INDEX IF NOT EXISTS topics_free_department_title_id_idx
+        ON Topics(department_id, title, topic_id) WHERE status = 'free';
+    DROP INDEX IF EXISTS topics_free_title_idx;
+"""
+
+# Рассылки (broadcaster.py): получатели фиксируются при создании,
+# статус каждого хранится в БД — после перезапуска рассылка продолжается
+BROADCASTS = """
+    CREATE TABLE IF NOT EXISTS Broadcasts (
+        broadcast_id SERIAL PRIMARY KEY,
+        audience TEXT NOT NULL,
+        text TEXT NOT NULL,
+        created_by BIGINT,
+        status TEXT NOT NULL DEFAULT 'running'
+            CHECK (status IN ('running', 'done', 'cancelled')),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP
+    );
+
+    CREATE TABLE IF NOT EXISTS BroadcastRecipients (
+        broadcast_id INTEGER REFERENCES Broadcasts(broadcast_id) ON DELETE CASCADE,
+        chat_id BIGINT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending'
+            CHECK (status IN ('pending', 'sent', 'failed')),
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        sent_at TIMESTAMP,
+        PRIMARY KEY (broadcast_id, chat_id)
+    );
+
+    CREATE INDEX IF NOT EXISTS broadcast_recipients_pending_idx
+        ON BroadcastRecipients(broadcast_id, chat_id) WHERE status = 'pending';
+"""
+
+# Состояния FSM (fsm_storage.py), общие для всех процессов бота
+FSM_STATES = """
+    CREATE TABLE IF NOT EXISTS FsmStates (
+        bot_id BIGINT NOT NULL,
+        chat_id BIGINT NOT NULL,
+        user_id BIGINT NOT NULL,
+        thread_id BIGINT NOT NULL DEFAULT 0,
+        destiny TEXT NOT NULL DEFAULT 'default',
+        state TEXT,
+        data BYTEA,
+        expires_at TIMESTAMPTZ NOT NULL,
+        PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+    );
+
+    CREATE INDEX IF NOT EXISTS fsm_states_expires_idx ON FsmStates(expires_at);
+"""
+
+# Справочники (refdata.py) кэшируются в процессах бота; любое изменение
+# кафедр или категорий рассылает NOTIFY refdata, и кэши перечитываются
+REFDATA_NOTIFY = """
+    CREATE OR REPLACE FUNCTION refdata_notify() RETURNS trigger AS $$
+    BEGIN
+        PERFORM pg_notify('refdata', TG_TABLE_NAME);
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS departments_refdata_trg ON Departments;
+    CREATE TRIGGER departments_refdata_trg
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Departments
+        FOR EACH STATEMENT EXECUTE FUNCTION refdata_notify();
+
+    DROP TRIGGER IF EXISTS categories_refdata_trg ON Categories;
+    CREATE TRIGGER categories_refdata_trg
+        AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON Categories
+        FOR EACH STATEMENT EXECUTE FUNCTION refdata_notify();
+"""
+
+# Дерево категорий (Categories.parent_id) любой глубины: таблица замыкания
+# «предок — потомок» и счётчики тем поддерева. Тема считается в узле один
+# раз, даже если привязана к нескольким категориям его поддерева. Триггеры
+# поддерживают всё на ходу; category_tree_rebuild() пересчитывает с нуля.
+CATEGORY_TREE = """
+    CREATE TABLE IF NOT EXISTS CategoryClosure (
+        ancestor_id INTEGER NOT NULL,
+        descendant_id INTEGER NOT NULL,
+        depth INTEGER NOT NULL,
+        PRIMARY KEY (ancestor_id, descendant_id)
+    );
+    CREATE INDEX IF NOT EXISTS category_closure_descendant_idx
+        ON CategoryClosure(descendant_id, ancestor_id);
+
+    CREATE TABLE IF NOT EXISTS CategoryStats (
+        category_id INTEGER PRIMARY KEY,
+        topics INTEGER NOT NULL DEFAULT 0,
+        free_topics INTEGER NOT NULL DEFAULT 0
+    );
+
+    -- Эталонные значения «с нуля» по текущему замыканию
+    CREATE OR REPLACE VIEW CategoryStatsExpected AS
+    SELECT c.category_id,
+           count(DISTINCT t.topic_id)::int AS topics,
+           count(DISTINCT t.topic_id) FILTER (WHERE t.status = 'free')::int AS free_topics
+      FROM Categories c
+      LEFT JOIN CategoryClosure cc ON cc.ancestor_id = c.category_id
+      LEFT JOIN TopicCategories tc ON tc.category_id = cc.descendant_id
+      LEFT JOIN Topics t ON t.topic_id = tc.topic_id
+     GROUP BY c.category_id;
+
+    CREATE OR REPLACE FUNCTION categories_tree_insert() RETURNS trigger AS $$
+    BEGIN
+        INSERT INTO CategoryClosure(ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, NEW.category_id, depth + 1
+          FROM CategoryClosure WHERE descendant_id = NEW.parent_id
+        UNION ALL
+        SELECT NEW.category_id, NEW.category_id, 0;
+        INSERT INTO CategoryStats(category_id) VALUES (NEW.category_id)
+            ON CONFLICT DO NOTHING;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS categories_tree_insert_trg ON Categories;
+    CREATE TRIGGER categories_tree_insert_trg
+        AFTER INSERT ON Categories
+        FOR EACH ROW EXECUTE FUNCTION categories_tree_insert();
+
+    -- Перенос поддерева под другого родителя
+    CREATE OR REPLACE FUNCTION categories_tree_move() RETURNS trigger AS $$
+    DECLARE
+        affected INTEGER[];
+    BEGIN
+        IF EXISTS (SELECT 1 FROM CategoryClosure
+                    WHERE ancestor_id = NEW.category_id AND descendant_id = NEW.parent_id) THEN
+            RAISE EXCEPTION 'Категорию % нельзя перенести внутрь неё самой', NEW.category_id;
+        END IF;
+        -- Прежние и новые предки: у них меняется состав поддерева
+        SELECT array_agg(ancestor_id) INTO affected
+          FROM CategoryClosure WHERE descendant_id IN (OLD.parent_id, NEW.parent_id);
+
+        DELETE FROM CategoryClosure
+         WHERE descendant_id IN (SELECT descendant_id FROM CategoryClosure
+                                  WHERE ancestor_id = NEW.category_id)
+           AND ancestor_id IN (SELECT ancestor_id FROM CategoryClosure
+                                WHERE descendant_id = OLD.parent_id);
+        INSERT INTO CategoryClosure(ancestor_id, descendant_id, depth)
+        SELECT p.ancestor_id, s.descendant_id, p.depth + s.depth + 1
+          FROM CategoryClosure p, CategoryClosure s
+         WHERE p.descendant_id = NEW.parent_id AND s.ancestor_id = NEW.category_id;
+
+        UPDATE CategoryStats s
+           SET topics = e.topics, free_topics = e.free_topics
+          FROM CategoryStatsExpected e
+         WHERE e.category_id = s.category_id AND s.category_id = ANY(affected);
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS categories_tree_move_trg ON Categories;
+    CREATE TRIGGER categories_tree_move_trg
+        AFTER UPDATE OF parent_id ON Categories
+        FOR EACH ROW WHEN (OLD.parent_id IS DISTINCT FROM NEW.parent_id)
+        EXECUTE FUNCTION categories_tree_move();
+
+    -- Удаление — BEFORE: привязки тем снимаются, пока замыкание цело, и
+    -- триггер TopicCategories вычитает их у предков
+    CREATE OR REPLACE FUNCTION categories_tree_delete() RETURNS trigger AS $$
+    BEGIN
+        DELETE FROM TopicCategories WHERE category_id = OLD.category_id;
+        DELETE FROM CategoryClosure
+         WHERE ancestor_id = OLD.category_id OR descendant_id = OLD.category_id;
+        DELETE FROM CategoryStats WHERE category_id = OLD.category_id;
+        RETURN OLD;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS categories_tree_delete_trg ON Categories;
+    CREATE TRIGGER categories_tree_delete_trg
+        BEFORE DELETE ON Categories
+        FOR EACH ROW EXECUTE FUNCTION categories_tree_delete();
+
+    CREATE OR REPLACE FUNCTION topic_categories_stats_update() RETURNS trigger AS $$
+    DECLARE
+        link RECORD;
+        delta INTEGER;
+        is_free INTEGER;
+    BEGIN
+        IF TG_OP = 'INSERT' THEN
+            link := NEW;
+            delta := 1;
+        ELSE
+            link := OLD;
+            delta := -1;
+        END IF;
+        SELECT (status = 'free')::int INTO is_free FROM Topics WHERE topic_id = link.topic_id;
+        -- Предок меняется, только если это единственная привязка темы в его поддереве
+        UPDATE CategoryStats s
+           SET topics = s.topics + delta,
+               free_topics = s.free_topics + delta * COALESCE(is_free, 0)
+          FROM CategoryClosure a
+         WHERE a.descendant_id = link.category_id
+           AND s.category_id = a.ancestor_id
+           AND NOT EXISTS (
+                SELECT 1
+                  FROM TopicCategories tc
+                  JOIN CategoryClosure d
+                    ON d.descendant_id = tc.category_id AND d.ancestor_id = a.ancestor_id
+                 WHERE tc.topic_id = link.topic_id AND tc.category_id <> link.category_id
+           );
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS topic_categories_stats_trg ON TopicCategories;
+    CREATE TRIGGER topic_categories_stats_trg
+        AFTER INSERT OR DELETE ON TopicCategories
+        FOR EACH ROW EXECUTE FUNCTION topic_categories_stats_update();
+
+    CREATE OR REPLACE FUNCTION topics_category_stats_update() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP = 'DELETE' THEN
+            -- BEFORE DELETE: статус темы ещё виден триггеру TopicCategories
+            DELETE FROM TopicCategories WHERE topic_id = OLD.topic_id;
+            RETURN OLD;
+        END IF;
+        IF (OLD.status = 'free') <> (NEW.status = 'free') THEN
+            UPDATE CategoryStats
+               SET free_topics = free_topics + CASE WHEN NEW.status = 'free' THEN 1 ELSE -1 END
+             WHERE category_id IN (
+                    SELECT a.ancestor_id
+                      FROM TopicCategories tc
+                      JOIN CategoryClosure a ON a.descendant_id = tc.category_id
+                     WHERE tc.topic_id = NEW.topic_id
+             );
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS topics_category_stats_trg ON Topics;
+    CREATE TRIGGER topics_category_stats_trg
+        AFTER UPDATE OF status ON Topics
+        FOR EACH ROW EXECUTE FUNCTION topics_category_stats_update();
+
+    DROP TRIGGER IF EXISTS topics_category_delete_trg ON Topics;
+    CREATE TRIGGER topics_category_delete_trg
+        BEFORE DELETE ON Topics
+        FOR EACH ROW EXECUTE FUNCTION topics_category_stats_update();
+
+    CREATE OR REPLACE FUNCTION category_tree_rebuild() RETURNS void AS $$
+    BEGIN
+        LOCK TABLE Categories, TopicCategories, Topics IN SHARE MODE;
+        DELETE FROM CategoryClosure;
+        INSERT INTO CategoryClosure(ancestor_id, descendant_id, depth)
+        WITH RECURSIVE tree(ancestor_id, descendant_id, depth) AS (
+            SELECT category_id, category_id, 0 FROM Categories
+            UNION ALL
+            SELECT tree.ancestor_id, c.category_id, tree.depth + 1
+              FROM tree
+              JOIN Categories c ON c.parent_id = tree.descendant_id
+             -- защита от зацикленных parent_id, записанных до этой миграции
+             WHERE tree.depth < 100
+        )
+        SELECT ancestor_id, descendant_id, min(depth) FROM tree GROUP BY 1, 2;
+        DELETE FROM CategoryStats;
+        INSERT INTO CategoryStats(category_id, topics, free_topics)
+        SELECT category_id, topics, free_topics FROM CategoryStatsExpected;
+    END
+    $$ LANGUAGE plpgsql;
+
+    SELECT category_tree_rebuild();
+"""
+
+# Не больше одной активной темы на студента: гонку двух бронирований разных
+# тем одним студентом проверка в запросе не ловит, индекс — ловит
+ONE_ACTIVE_TOPIC = """
+    CREATE UNIQUE INDEX IF NOT EXISTS topics_one_active_per_student_idx
+        ON Topics(student_id) WHERE status IN ('reserved', 'closed');
+"""
+
+
+async def _one_active_topic(conn):
+    # Старые хэндлеры могли закрепить за студентом несколько тем. Какую из них
+    # оставить — решает человек, поэтому миграция останавливается со списком.
+    duplicates = await conn.fetch("""
+        SELECT student_id, array_agg(topic_id ORDER BY topic_id) AS topics
+          FROM Topics
+         WHERE student_id IS NOT NULL AND status IN ('reserved', 'closed')
+         GROUP BY student_id
+        HAVING count(*) > 1
+    """)
+    if duplicates:
+        listing = "; ".join(f"студент {r['student_id']}: темы {list(r['topics'])}" for r in duplicates)
+        raise RuntimeError(
+            "За некоторыми студентами закреплено несколько тем, освободите лишние "
+            f"и перезапустите миграцию: {listing}"
+        )
+    await conn.execute(ONE_ACTIVE_TOPIC)
+
+
+# Кэши процессов бота (keyword_index.py, identity.py) сбрасываются по тому же
+# каналу NOTIFY refdata, что и справочники: 'topic:<id>', 'student:<id>',
+# 'user:<telegram_id>'. Одинаковые уведомления в транзакции Postgres склеивает
+CACHE_NOTIFY = """
+    CREATE OR REPLACE FUNCTION topics_cache_notify() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            PERFORM pg_notify('refdata', 'topic:' || OLD.topic_id);
+            IF OLD.student_id IS NOT NULL THEN
+                PERFORM pg_notify('refdata', 'student:' || OLD.student_id);
+            END IF;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            PERFORM pg_notify('refdata', 'topic:' || NEW.topic_id);
+            IF NEW.student_id IS NOT NULL THEN
+                PERFORM pg_notify('refdata', 'student:' || NEW.student_id);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS topics_cache_trg ON Topics;
+    CREATE TRIGGER topics_cache_trg
+        AFTER INSERT OR DELETE OR UPDATE OF keywords, status, student_id ON Topics
+        FOR EACH ROW EXECUTE FUNCTION topics_cache_notify();
+
+    CREATE OR REPLACE FUNCTION users_cache_notify() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP <> 'INSERT' THEN
+            IF OLD.telegram_id IS NOT NULL THEN
+                PERFORM pg_notify('refdata', 'user:' || OLD.telegram_id);
+            END IF;
+        END IF;
+        IF TG_OP <> 'DELETE' THEN
+            IF NEW.telegram_id IS NOT NULL THEN
+                PERFORM pg_notify('refdata', 'user:' || NEW.telegram_id);
+            END IF;
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+
+    DROP TRIGGER IF EXISTS students_cache_trg ON Students;
+    CREATE TRIGGER students_cache_trg
+        AFTER INSERT OR DELETE OR UPDATE OF telegram_id, department_id ON Students
+        FOR EACH ROW EXECUTE FUNCTION users_cache_notify();
+
+    DROP TRIGGER IF EXISTS teachers_cache_trg ON Teachers;
+    CREATE TRIGGER teachers_cache_trg
+        AFTER INSERT OR DELETE OR UPDATE OF telegram_id, department_id ON Teachers
+        FOR EACH ROW EXECUTE FUNCTION users_cache_notify();
+"""
+
+
+# Найденные темы для листания результатов поиска (handlers/pagination.py):
+# страницу, открытую в одном процессе бота, листает любой другой
+SEARCH_RESULTS = """
+    CREATE TABLE IF NOT EXISTS SearchResults (
+        key TEXT PRIMARY KEY,
+        title TEXT NOT NULL,
+        topic_ids INTEGER[] NOT NULL,
+        expires_at TIMESTAMPTZ NOT NULL
+    );
+
+    CREATE INDEX IF NOT EXISTS search_results_expires_idx ON SearchResults(expires_at);
+"""
+
+
+# Какой процесс бота отправляет рассылку (broadcaster.py): resume() забирает
+# только ничьи рассылки или те, чья аренда истекла (процесс упал)
+BROADCAST_OWNER = """
+    ALTER TABLE Broadcasts
+        ADD COLUMN IF NOT EXISTS owner TEXT,
+        ADD COLUMN IF NOT EXISTS lease_until TIMESTAMPTZ;
+"""
+
+
+MIGRATIONS = [
+    (1, "baseline", BASELINE),
+    (2, "event log", EVENT_LOG),
+    (3, "full-text search", FULL_TEXT_SEARCH),
+    (4, "trigram search", _trigram_search),
+    (5, "hot path indexes", HOT_PATH_INDEXES),
+    (6, "analytics counters", ANALYTICS_COUNTERS),
+    (7, "keyset pagination indexes", KEYSET_PAGINATION),
+    (8, "broadcasts", BROADCASTS),
+    (9, "fsm storage", FSM_STATES),
+    (10, "reference data notifications", REFDATA_NOTIFY),
+    (11, "category tree", CATEGORY_TREE),
+    (12, "one active topic per student", _one_active_topic),
+    (13, "cache invalidation notifications", CACHE_NOTIFY),
+    (14, "shared search results", SEARCH_RESULTS),
+    (15, "broadcast owner", BROADCAST_OWNER),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Состояние схемы одним запросом: версия и наличие pg_trgm с его индексами
+_STATUS_SQL = """
+    SELECT (SELECT COALESCE(max(version), 0) FROM schema_migrations) AS version,
+           EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') AS trigram,
+           to_regclass('topics_title_trgm_idx') IS NOT NULL AS trigram_indexes
+"""
+
+
+async def status(conn) -> dict:
+    try:
+        row = await conn.fetchrow(_STATUS_SQL)
+    except asyncpg.UndefinedTableError:
+        return {"version": 0, "trigram": False, "trigram_indexes": False}
+    return dict(row)
+
+
+async def migrate(conn) -> dict:
+    """Применяет недостающие миграции и возвращает итоговое состояние схемы.
+
+    Если схема актуальна, выполняется единственный запрос status().
+    """
+    current = await status(conn)
+    if current["version"] >= LATEST_VERSION:
+        # pg_trgm поставили уже после миграции 4 — достраиваем индексы
+        if current["trigram"] and not current["trigram_indexes"]:
+            await conn.execute(TRIGRAM_INDEXES)
+            current["trigram_indexes"] = True
+        return current
+
+    await conn.execute("SELECT pg_advisory_lock($1)", _LOCK_KEY)
+    try:
+        await conn.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        """)
+        # Другая копия могла успеть накатить миграции, пока мы ждали блокировку
+        applied = await conn.fetchval("SELECT COALESCE(max(version), 0) FROM schema_migrations")
+        for version, name, step in MIGRATIONS:
+            if version <= applied:
+                continue
+            async with conn.transaction():
+                if callable(step):
+                    await step(conn)
+                else:
+                    await conn.execute(step)
+                await conn.execute(
+                    "INSERT INTO schema_migrations(version, name) VALUES($1, $2)",
+                    version, name
+                )
+            print(f"Применена миграция {version}: {name}")
+    finally:
+        await conn.execute("SELECT pg_advisory_unlock($1)", _LOCK_KEY)
+    return await status(conn)
+
+
+if __name__ == "__main__":
+    # python -m migrations — накатить миграции без запуска бота
+    import asyncio
+    from config import POSTGRES_URI
+
+    async def _main():
+        conn = await asyncpg.connect(POSTGRES_URI)
+        try:
+            result = await migrate(conn)
+            print(f"Версия схемы: {result['version']} из {LATEST_VERSION}")
+        finally:
+            await conn.close()
+
+    asyncio.run(_main())
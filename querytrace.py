@@ -0,0 +1,234 @@
+# querytrace.py
+"""Учёт запросов к БД в пределах одного обновления.
+
+Соединения пула (TracedConnection, см. database.init_pool) записывают каждый
+запрос в текущую трассировку: число обращений к БД, строки, время и сколько
+раз выполнялся каждый текст запроса. Трассировку на каждое обновление
+открывает middleware из setup(). По её завершении в лог попадают:
+
+- один и тот же запрос SQL_REPEAT_WARN и более раз — похоже на N+1;
+- больше SQL_QUERY_BUDGET обращений к БД (если задан).
+
+Запросы дольше SQL_SLOW_MS пишутся в лог всегда, с формой параметров
+(типы и размеры, без значений).
+
+Для проверок в тестах и скриптах — budget():
+
+    with querytrace.budget(2):
+        await process_search_by_keywords(message, state, identity)
+"""
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+
+from aiogram import BaseMiddleware, Dispatcher
+
+from config import SQL_SLOW_MS, SQL_REPEAT_WARN, SQL_QUERY_BUDGET
+from database import Connection
+import statements
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class QueryTrace:
+    label: str | None = None
+    queries: int = 0
+    rows: int = 0
+    time: float = 0.0
+    # текст запроса (без лишних пробелов) -> сколько раз выполнен
+    shapes: dict[str, int] = field(default_factory=dict)
+
+    def repeated(self, threshold: int) -> list[tuple[str, int]]:
+        return [(sql, n) for sql, n in self.shapes.items() if n >= threshold]
+
+    def _merge(self, other: "QueryTrace"):
+        self.label = self.label or other.label
+        self.queries += other.queries
+        self.rows += other.rows
+        self.time += other.time
+        for sql, n in other.shapes.items():
+            self.shapes[sql] = self.shapes.get(sql, 0) + n
+
+
+_current: ContextVar[QueryTrace | None] = ContextVar("query_trace", default=None)
+# Идёт сброс соединения при возврате в пул (TracedConnection.reset)
+_resetting: ContextVar[bool] = ContextVar("query_trace_resetting", default=False)
+
+
+def current() -> QueryTrace | None:
+    return _current.get()
+
+
+@contextmanager
+def trace(label: str | None = None):
+    """Считает запросы внутри блока; вложенная трассировка добавляется к внешней."""
+    parent = _current.get()
+    result = QueryTrace(label)
+    token = _current.set(result)
+    try:
+        yield result
+    finally:
+        _current.reset(token)
+        if parent is not None:
+            parent._merge(result)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+@contextmanager
+def budget(max_queries: int, label: str | None = None):
+    """Падает с QueryBudgetExceeded, если в блоке больше max_queries обращений к БД."""
+    with trace(label) as result:
+        yield result
+    if result.queries > max_queries:
+        details = "\n".join(f"  {n} × {_short(sql)}" for sql, n in result.shapes.items())
+        raise QueryBudgetExceeded(
+            f"{result.label or 'блок'}: {result.queries} запросов к БД при бюджете {max_queries}\n{details}"
+        )
+
+
+def _short(sql: str, limit: int = 200) -> str:
+    return sql if len(sql) <= limit else sql[:limit] + "…"
+
+
+def _param_shape(value) -> str:
+    if value is None:
+        return "null"
+    if isinstance(value, (list, tuple)):
+        return f"{type(value).__name__}[{len(value)}]"
+    if isinstance(value, (str, bytes)):
+        return f"{type(value).__name__}({len(value)})"
+    return type(value).__name__
+
+
+def _rows(method: str, result, args) -> int:
+    if method == "fetch":
+        return len(result)
+    if method in ("fetchrow", "fetchval"):
+        return int(result is not None)
+    if method == "executemany":
+        return len(args[1]) if len(args) > 1 else 0
+    # execute и copy_* возвращают статус вида "UPDATE 3" / "COPY 500"
+    tail = result.rsplit(" ", 1)[-1] if isinstance(result, str) else ""
+    return int(tail) if tail.isdigit() else 0
+
+
+def record(method: str, args: tuple, result, elapsed: float):
+    """Записывает выполненный запрос; args — как у метода соединения (SQL, параметры...)."""
+    sql = " ".join(str(args[0]).split()) if args else method
+    current_trace = _current.get()
+    if current_trace is not None:
+        current_trace.queries += 1
+        current_trace.rows += _rows(method, result, args)
+        current_trace.time += elapsed
+        current_trace.shapes[sql] = current_trace.shapes.get(sql, 0) + 1
+    if elapsed * 1000 >= SQL_SLOW_MS:
+        params = args[1:] if method != "executemany" else (args[1][:1] if len(args) > 1 else ())
+        logger.warning(
+            "Медленный запрос %.0f мс (%s): %s; параметры: (%s)",
+            elapsed * 1000, (current_trace.label or "без хэндлера") if current_trace else "вне обновления",
+            _short(sql), ", ".join(_param_shape(p) for p in params)
+        )
+
+
+# Запросы реестра statements.py идут мимо методов соединения
+statements.observe(record)
+
+
+class TracedConnection(Connection):
+    """Соединение пула, которое пишет запросы в текущую трассировку."""
+
+    async def _traced(self, method: str, call, args, kwargs):
+        if _resetting.get():
+            return await call(*args, **kwargs)
+        started = time.perf_counter()
+        result = None
+        try:
+            result = await call(*args, **kwargs)
+            return result
+        finally:
+            record(method, args, result, time.perf_counter() - started)
+
+    async def execute(self, *args, **kwargs):
+        return await self._traced("execute", super().execute, args, kwargs)
+
+    async def executemany(self, *args, **kwargs):
+        return await self._traced("executemany", super().executemany, args, kwargs)
+
+    async def fetch(self, *args, **kwargs):
+        return await self._traced("fetch", super().fetch, args, kwargs)
+
+    async def fetchrow(self, *args, **kwargs):
+        return await self._traced("fetchrow", super().fetchrow, args, kwargs)
+
+    async def fetchval(self, *args, **kwargs):
+        return await self._traced("fetchval", super().fetchval, args, kwargs)
+
+    async def copy_records_to_table(self, *args, **kwargs):
+        return await self._traced("copy_records_to_table", super().copy_records_to_table, args, kwargs)
+
+    async def reset(self, *, timeout=None):
+        # Пул сбрасывает соединение (UNLISTEN, RESET ALL ...) при каждом
+        # возврате через self.execute — это не запрос обновления
+        token = _resetting.set(True)
+        try:
+            await super().reset(timeout=timeout)
+        finally:
+            _resetting.reset(token)
+
+
+def handler_name(data: dict) -> str:
+    """Имя хэндлера из данных middleware: модуль.функция."""
+    # Текстовые маршруты проходят через общий хэндлер text_router
+    route = data.get("route")
+    if route is not None:
+        return route.name
+    callback = data["handler"].callback
+    return f"{callback.__module__}.{callback.__qualname__}"
+
+
+def _report(result: QueryTrace):
+    label = result.label or "без хэндлера"
+    for sql, n in result.repeated(SQL_REPEAT_WARN):
+        logger.warning("%s: запрос выполнен %s раз за обновление, похоже на N+1: %s", label, n, _short(sql))
+    if SQL_QUERY_BUDGET and result.queries > SQL_QUERY_BUDGET:
+        logger.warning("%s: %s запросов к БД за обновление при бюджете %s",
+                       label, result.queries, SQL_QUERY_BUDGET)
+
+
+class UpdateTraceMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: трассировка на всё обновление."""
+
+    async def __call__(self, handler, event, data):
+        with trace() as result:
+            try:
+                return await handler(event, data)
+            finally:
+                _report(result)
+
+
+class HandlerLabelMiddleware(BaseMiddleware):
+    """Внутренний middleware на событиях: подписывает трассировку именем хэндлера."""
+
+    async def __call__(self, handler, event, data):
+        result = _current.get()
+        if result is not None:
+            result.label = handler_name(data)
+        return await handler(event, data)
+
+
+def setup(dp: Dispatcher):
+    """Подключает трассировку запросов; вызывать до middleware, которые её читают (metrics)."""
+    # fsm_storage импортирует statements, а тот пишет сюда, — не на уровне модуля
+    import fsm_storage
+
+    # Снаружи FSM: запрос состояния из FsmStates тоже считается
+    fsm_storage.outer_middleware(dp, UpdateTraceMiddleware())
+    label = HandlerLabelMiddleware()
+    for observer in (dp.message, dp.callback_query):
+        observer.middleware(label)
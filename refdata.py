@@ -0,0 +1,231 @@
+# refdata.py
+"""Справочники в памяти процесса: кафедры и категории.
+
+Справочники меняются несколько раз в год, а нужны почти в каждом диалоге
+(регистрация, аналитика, поиск по категориям). При старте они загружаются
+целиком вместе с готовыми клавиатурами; хэндлеры берут всё отсюда без
+запросов к БД.
+
+Триггеры на Departments и Categories (миграция 10) шлют NOTIFY refdata, и
+каждый процесс бота перечитывает справочники. Вручную — командой
+/refresh_refdata (handlers/misc.py) или refdata.load().
+
+По тому же каналу приходят изменения тем и пользователей (миграция 13) —
+«вид:ключ», например 'topic:42'. Их разбирают обработчики, подписанные
+через subscribe(): так индекс ключевых слов и кэш identity одного процесса
+узнают об изменениях, сделанных другим.
+"""
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from typing import Callable
+
+from aiogram.types import ReplyKeyboardMarkup, KeyboardButton
+
+from database import acquire, connect
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'refdata'
+# Кнопка на клавиатуре подкатегорий: показать темы всего раздела
+SUBTREE_TOPICS_BUTTON = '📄 Темы раздела'
+# Пауза перед повторным подключением слушателя после обрыва
+_RECONNECT_DELAY = 5
+
+
+def _kb(rows: list[list[str]]) -> ReplyKeyboardMarkup:
+    keyboard = [[KeyboardButton(text=label) for label in row] for row in rows]
+    keyboard.append([KeyboardButton(text='❌ Отмена')])
+    return ReplyKeyboardMarkup(keyboard=keyboard, resize_keyboard=True)
+
+
+def _category_labels(categories) -> dict[tuple[int | None, str], int]:
+    """(parent_id, текст кнопки) -> category_id.
+
+    На кнопке только название; одинаковые названия у соседей различаются
+    номером: «Сети», «Сети (2)».
+    """
+    labels: dict[tuple[int | None, str], int] = {}
+    for r in categories:
+        label, n = r['name'], 1
+        while (r['parent_id'], label) in labels:
+            n += 1
+            label = f"{r['name']} ({n})"
+        labels[(r['parent_id'], label)] = r['category_id']
+    return labels
+
+
+@dataclass(frozen=True)
+class _Snapshot:
+    department_ids: dict[str, int] = field(default_factory=dict)
+    department_names: dict[int, str] = field(default_factory=dict)
+    # Кнопки по две в ряд — при регистрации, по одной — в аналитике
+    registration_kb: ReplyKeyboardMarkup = field(default_factory=lambda: _kb([]))
+    departments_kb: ReplyKeyboardMarkup = field(default_factory=lambda: _kb([]))
+    category_names: dict[int, str] = field(default_factory=dict)
+    # (parent_id, текст кнопки) -> category_id; у верхнего уровня parent_id None
+    category_ids: dict[tuple[int | None, str], int] = field(default_factory=dict)
+    categories_kb: ReplyKeyboardMarkup = field(default_factory=lambda: _kb([]))
+    # parent_id -> клавиатура подкатегорий (с кнопкой SUBTREE_TOPICS_BUTTON)
+    subcategory_kbs: dict[int, ReplyKeyboardMarkup] = field(default_factory=dict)
+
+
+# Снимок заменяется целиком, поэтому читатели никогда не видят его наполовину обновлённым
+_snap = _Snapshot()
+_listener: asyncio.Task | None = None
+_reloads: set[asyncio.Task] = set()
+# вид уведомления ('topic', 'user', ...) -> обработчик(ключ)
+_subscribers: dict[str, Callable[[str | None], None]] = {}
+
+
+async def load() -> dict:
+    """Перечитывает справочники и пересобирает клавиатуры; возвращает их размеры."""
+    global _snap
+    async with acquire() as conn:
+        departments = await conn.fetch("SELECT department_id, name FROM Departments ORDER BY name")
+        categories = await conn.fetch("SELECT category_id, parent_id, name FROM Categories ORDER BY name")
+
+    names = [r['name'] for r in departments]
+    category_ids = _category_labels(categories)
+    children: dict[int, list[str]] = {}
+    top = []
+    for parent_id, label in category_ids:
+        if parent_id is None:
+            top.append([label])
+        else:
+            children.setdefault(parent_id, []).append(label)
+
+    _snap = _Snapshot(
+        department_ids={r['name']: r['department_id'] for r in departments},
+        department_names={r['department_id']: r['name'] for r in departments},
+        registration_kb=_kb([names[i:i + 2] for i in range(0, len(names), 2)]),
+        departments_kb=_kb([[n] for n in names]),
+        category_names={r['category_id']: r['name'] for r in categories},
+        category_ids=category_ids,
+        categories_kb=_kb(top),
+        subcategory_kbs={
+            pid: _kb([[label] for label in labels] + [[SUBTREE_TOPICS_BUTTON]])
+            for pid, labels in children.items()
+        },
+    )
+    logger.info("Справочники загружены: кафедр %s, категорий %s", len(departments), len(categories))
+    return {'departments': len(departments), 'categories': len(categories)}
+
+
+def department_id(name: str) -> int | None:
+    return _snap.department_ids.get(name)
+
+
+def department_name(department_id: int) -> str | None:
+    return _snap.department_names.get(department_id)
+
+
+def registration_departments_kb() -> ReplyKeyboardMarkup:
+    return _snap.registration_kb
+
+
+def departments_kb() -> ReplyKeyboardMarkup:
+    return _snap.departments_kb
+
+
+def category_name(category_id: int) -> str | None:
+    return _snap.category_names.get(category_id)
+
+
+def category_id(parent_id: int | None, label: str) -> int | None:
+    """Категория по тексту кнопки на клавиатуре подкатегорий parent_id."""
+    return _snap.category_ids.get((parent_id, label))
+
+
+def categories_kb() -> ReplyKeyboardMarkup:
+    return _snap.categories_kb
+
+
+def has_subcategories(category_id: int) -> bool:
+    return category_id in _snap.subcategory_kbs
+
+
+def subcategories_kb(parent_id: int) -> ReplyKeyboardMarkup:
+    return _snap.subcategory_kbs.get(parent_id) or _kb([[SUBTREE_TOPICS_BUTTON]])
+
+
+async def _listen():
+    reconnect = False
+    while True:
+        lost = asyncio.Event()
+        try:
+            conn = await connect()
+        except Exception:
+            logger.exception("Не удалось подключиться для LISTEN %s", CHANNEL)
+            await asyncio.sleep(_RECONNECT_DELAY)
+            continue
+        try:
+            await conn.add_listener(CHANNEL, _on_notify)
+            conn.add_termination_listener(lambda *args: lost.set())
+            # Пока слушателя не было, изменения могли пройти мимо
+            if reconnect:
+                await _reload()
+                _resync()
+            reconnect = True
+            await lost.wait()
+            logger.warning("Соединение LISTEN %s потеряно, переподключаемся", CHANNEL)
+        finally:
+            if not conn.is_closed():
+                await conn.close()
+        await asyncio.sleep(_RECONNECT_DELAY)
+
+
+def subscribe(kind: str, handler: Callable[[str | None], None]):
+    """Вызывать handler(ключ) на NOTIFY refdata 'kind:ключ'.
+
+    handler(None) — уведомления могли потеряться (переподключение), сбросить
+    нужно всё. Обработчик синхронный и быстрый: работу с БД он откладывает
+    в задачу сам.
+    """
+    _subscribers[kind] = handler
+
+
+def _dispatch(kind: str, key: str | None):
+    try:
+        _subscribers[kind](key)
+    except Exception:
+        logger.exception("Ошибка обработки NOTIFY %s:%s", kind, key)
+
+
+def _resync():
+    for kind in list(_subscribers):
+        _dispatch(kind, None)
+
+
+def _on_notify(conn, pid, channel, payload):
+    kind, sep, key = payload.partition(':')
+    if sep:
+        if kind in _subscribers:
+            _dispatch(kind, key)
+        return
+    # Без «вид:» — имя таблицы справочника
+    task = asyncio.create_task(_reload())
+    _reloads.add(task)
+    task.add_done_callback(_reloads.discard)
+
+
+async def _reload():
+    try:
+        await load()
+    except Exception:
+        logger.exception("Не удалось перечитать справочники")
+
+
+def start():
+    """Запускает слушателя NOTIFY refdata; вызывать после load()."""
+    global _listener
+    if _listener is None:
+        _listener = asyncio.create_task(_listen())
+
+
+async def stop():
+    global _listener
+    if _listener is not None:
+        _listener.cancel()
+        await asyncio.gather(_listener, return_exceptions=True)
+        _listener = None
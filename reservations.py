@@ -0,0 +1,133 @@
+# reservations.py
+"""Закрепление темы за студентом: проверка, захват и запись в журнал одним запросом.
+
+Строка темы блокируется (FOR UPDATE), поэтому при гонке за одну тему
+претенденты выстраиваются в очередь на этой строке, и каждый следующий
+видит уже закреплённую тему и её владельца. Одна активная тема
+(reserved/closed) на студента гарантируется уникальным частичным индексом
+(миграция 12), а не только проверкой в запросе.
+
+Взять можно свободную тему без студента или предложенную самим студентом;
+при status='closed' (одобрение преподавателем) — и свою же reserved, но
+только тему этого преподавателя.
+"""
+from dataclasses import dataclass
+
+import asyncpg
+
+from database import acquire
+from identity import invalidate_student
+import keyword_index
+import statements
+
+# $1 student_id, $2 topic_id или название, $3 новый статус,
+# $4 teacher_id для журнала, $5 роль, $6 действие
+_CLAIM_SQL = """
+    WITH target AS (
+        SELECT t.topic_id, t.title, t.status, t.student_id, t.teacher_id
+          FROM Topics t
+         WHERE {where}
+         -- при совпадении названий предпочитаем свободную тему
+         ORDER BY (t.status = 'free') DESC, t.topic_id
+         LIMIT 1
+           FOR UPDATE
+    ), own AS (
+        SELECT topic_id, title
+          FROM Topics
+         WHERE student_id = $1 AND status IN ('reserved', 'closed')
+         LIMIT 1
+    ), claimed AS (
+        UPDATE Topics t
+           SET status = $3, student_id = $1
+          FROM target tg
+         WHERE t.topic_id = tg.topic_id
+           AND (
+                (tg.status = 'free' AND (tg.student_id IS NULL OR tg.student_id = $1))
+             OR ($3 = 'closed' AND tg.status = 'reserved' AND tg.student_id = $1)
+           )
+           AND ($3 <> 'closed' OR tg.teacher_id = $4)
+           AND NOT EXISTS (SELECT 1 FROM own WHERE own.topic_id <> tg.topic_id)
+        RETURNING t.topic_id
+    ), logged AS (
+        INSERT INTO Interactions(teacher_id, student_id, topic_id, user_role, action)
+        SELECT $4, $1, topic_id, $5, $6 FROM claimed
+    )
+    SELECT (SELECT topic_id FROM claimed) AS claimed_id,
+           tg.topic_id, tg.title, tg.status, tg.teacher_id, tg.student_id AS holder_id,
+           (SELECT name FROM Students WHERE student_id = tg.student_id) AS holder_name,
+           own.topic_id AS own_id, own.title AS own_title
+      FROM (SELECT 1) one
+      LEFT JOIN target tg ON true
+      LEFT JOIN own ON true
+"""
+
+_BY_ID = statements.register("reservations.claim_by_id", _CLAIM_SQL.format(where="t.topic_id = $2"))
+_BY_TITLE = statements.register("reservations.claim_by_title", _CLAIM_SQL.format(where="t.title = $2"))
+
+
+@dataclass(frozen=True)
+class Claim:
+    """Итог попытки закрепления.
+
+    outcome:
+      'claimed'   — тема закреплена этим запросом;
+      'already'   — тема уже закреплена за этим студентом (reserved или closed);
+      'taken'     — тему держит другой студент (holder_id, holder_name) или она закрыта;
+      'has_topic' — у студента уже есть другая активная тема (topic_id, title — она);
+      'not_found' — такой темы нет;
+      'forbidden' — одобрить (status='closed') можно только свою тему преподавателя.
+    """
+    outcome: str
+    topic_id: int | None = None
+    title: str | None = None
+    holder_id: int | None = None
+    holder_name: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.outcome in ('claimed', 'already')
+
+
+def _result(row, student_id: int, status: str, teacher_id: int | None) -> Claim:
+    if row['claimed_id'] is not None:
+        return Claim('claimed', row['claimed_id'], row['title'], student_id)
+    if row['topic_id'] is None:
+        return Claim('not_found')
+    if status == 'closed' and (teacher_id is None or row['teacher_id'] != teacher_id):
+        return Claim('forbidden', row['topic_id'], row['title'])
+    if row['own_id'] is not None and row['own_id'] != row['topic_id']:
+        return Claim('has_topic', row['own_id'], row['own_title'])
+    # Своя тема: повторная бронь уже одобренной — тоже 'already', а не 'taken'
+    if row['holder_id'] == student_id and row['status'] in ('reserved', 'closed'):
+        return Claim('already', row['topic_id'], row['title'], student_id)
+    return Claim('taken', row['topic_id'], row['title'], row['holder_id'], row['holder_name'])
+
+
+async def claim(student_id: int, *, topic_id: int | None = None, title: str | None = None,
+                status: str = 'reserved', teacher_id: int | None = None) -> Claim:
+    """Закрепляет тему (по id или точному названию) за студентом.
+
+    status='reserved' — студент бронирует сам; status='closed' с teacher_id —
+    преподаватель одобряет выбор студента. Один запрос к БД.
+    """
+    if (topic_id is None) == (title is None):
+        raise ValueError("Нужен либо topic_id, либо title")
+    statement, key = (_BY_ID, topic_id) if topic_id is not None else (_BY_TITLE, title)
+    role, action = ('teacher', 'approved') if teacher_id is not None else ('student', 'reserved')
+
+    for attempt in range(2):
+        try:
+            async with acquire() as conn:
+                row = await statement.fetchrow(conn, student_id, key, status, teacher_id, role, action)
+            break
+        except asyncpg.UniqueViolationError:
+            # Параллельно закрепилась другая тема этого студента: повторный
+            # запрос уже увидит её и вернёт 'has_topic'
+            if attempt:
+                raise
+
+    result = _result(row, student_id, status, teacher_id)
+    if result.outcome == 'claimed':
+        keyword_index.set_status(result.topic_id, status)
+        invalidate_student(student_id)
+    return result
@@ -0,0 +1,77 @@
+# startup.py
+"""Замер времени запуска бота: python bot.py --startup-profile.
+
+Фазы (импорты, подключение к БД, прогрев индексов) записываются всегда —
+это пара вызовов perf_counter. Отчёт печатается, только если профиль включён:
+когда начался поллинг и когда пришло первое обновление.
+"""
+import importlib
+import sys
+import time
+from contextlib import contextmanager
+
+# Отсчёт от импорта этого модуля — bot.py импортирует его первым
+_t0 = time.perf_counter()
+_phases: list[tuple[str, float]] = []
+_first_update_at: float | None = None
+
+enabled = False
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+@contextmanager
+def phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _phases.append((name, time.perf_counter() - started))
+
+
+def import_module(name: str):
+    """importlib.import_module с записью времени импорта в отчёт."""
+    # Модуль мог уже подтянуться как зависимость — тогда импорт бесплатный
+    with phase(f"import {name}"):
+        return importlib.import_module(name)
+
+
+def elapsed() -> float:
+    return time.perf_counter() - _t0
+
+
+def report(title: str) -> str:
+    lines = [f"⏱ {title}: {elapsed():.3f} с с момента запуска"]
+    width = max((len(name) for name, _ in _phases), default=0)
+    for name, seconds in sorted(_phases, key=lambda p: p[1], reverse=True):
+        lines.append(f"  {name:<{width}}  {seconds * 1000:8.1f} мс")
+    return "\n".join(lines)
+
+
+def _print(text: str):
+    print(text, file=sys.stderr, flush=True)
+
+
+async def on_polling_started():
+    if enabled:
+        _print(report("Поллинг запущен"))
+
+
+class FirstUpdateMiddleware:
+    """Внешний middleware на dp.update: фиксирует время до первого обновления."""
+
+    async def __call__(self, handler, event, data):
+        global _first_update_at
+        if _first_update_at is None:
+            _first_update_at = elapsed()
+            if enabled:
+                _print(f"⏱ Первое обновление: {_first_update_at:.3f} с с момента запуска")
+        return await handler(event, data)
+
+
+def setup(dp):
+    dp.startup.register(on_polling_started)
+    dp.update.outer_middleware(FirstUpdateMiddleware())
@@ -0,0 +1,107 @@
+# statements.py
+"""Реестр именованных запросов, подготовленных на каждом соединении пула.
+
+Горячие запросы (кто пишет боту, состояние FSM, страницы списков, поиск,
+закрепление темы) регистрируются под именем с неизменным текстом и набором
+параметров; списки передаются одним массивом ($1::int[]), а не «$1, $2, …».
+На соединении пула запрос готовится при первом выполнении и дальше идёт
+без разбора и планирования текста, сколько бы других запросов ни
+прошло через соединение. Подготовленные запросы живут вместе с
+соединением (database.Connection).
+
+Запрос объявляется рядом с кодом, который его выполняет:
+
+    _CARD = statements.register("pagination.card", "SELECT ... WHERE t.topic_id = $1")
+    ...
+    row = await _CARD.fetchrow(conn, topic_id)
+
+Готовятся запросы лениво, а не при создании соединения: пул открывается
+до миграций, а запросы с pg_trgm нужны, только если расширение есть.
+
+Подготовленный запрос выполняется мимо методов соединения, поэтому
+трассировка (querytrace.py) узнаёт о нём через observe().
+"""
+import time
+from typing import Callable
+
+import asyncpg
+
+_registry: dict[str, "Statement"] = {}
+# observer(метод, (sql, *параметры), результат, секунды) после каждого запроса
+_observer: Callable | None = None
+
+
+class Statement:
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+
+    def __repr__(self) -> str:
+        return f"<Statement {self.name}>"
+
+    async def fetch(self, conn, *args, timeout: float | None = None) -> list:
+        return await self._run(conn, "fetch", args, timeout)
+
+    async def fetchrow(self, conn, *args, timeout: float | None = None):
+        return await self._run(conn, "fetchrow", args, timeout)
+
+    async def fetchval(self, conn, *args, timeout: float | None = None):
+        return await self._run(conn, "fetchval", args, timeout)
+
+    async def execute(self, conn, *args, timeout: float | None = None) -> None:
+        """Для INSERT/UPDATE без RETURNING: у подготовленного запроса нет execute()."""
+        await self._run(conn, "execute", args, timeout)
+
+    async def _prepare(self, conn, cache: dict):
+        statement = cache[self.name] = await conn.prepare(self.sql)
+        return statement
+
+    async def _run(self, conn, method: str, args: tuple, timeout: float | None):
+        cache_of = getattr(conn, "prepared_statements", None)
+        if cache_of is None:
+            # Соединение не из пула бота (скрипты, бенчмарки) — обычный запрос
+            return await getattr(conn, method)(self.sql, *args, timeout=timeout)
+
+        cache = cache_of()
+        statement = cache.get(self.name)
+        if statement is None:
+            statement = await self._prepare(conn, cache)
+        call = "fetch" if method == "execute" else method
+        started = time.perf_counter()
+        result = None
+        try:
+            try:
+                result = await getattr(statement, call)(*args, timeout=timeout)
+            except (asyncpg.InvalidCachedStatementError, asyncpg.OutdatedSchemaCacheError):
+                # Таблицу изменили (миграция) — план устарел. В транзакции
+                # повторять нельзя: она уже прервана ошибкой
+                if conn.is_in_transaction():
+                    cache.pop(self.name, None)
+                    raise
+                statement = await self._prepare(conn, cache)
+                result = await getattr(statement, call)(*args, timeout=timeout)
+            return None if method == "execute" else result
+        finally:
+            if _observer is not None:
+                _observer(method, (self.sql, *args), result, time.perf_counter() - started)
+
+
+def observe(observer: Callable | None):
+    """Подключает наблюдателя за выполненными запросами (None — отключить)."""
+    global _observer
+    _observer = observer
+
+
+def register(name: str, sql: str) -> Statement:
+    """Регистрирует запрос под именем; то же имя с другим текстом — ошибка."""
+    existing = _registry.get(name)
+    if existing is not None:
+        if existing.sql != sql:
+            raise ValueError(f"Запрос {name} уже зарегистрирован с другим текстом")
+        return existing
+    statement = _registry[name] = Statement(name, sql)
+    return statement
+
+
+def registered() -> list[Statement]:
+    return list(_registry.values())
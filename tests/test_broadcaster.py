@@ -0,0 +1,104 @@
+# tests/test_broadcaster.py
+"""Аренда рассылок между процессами бота на настоящей БД: нужны POSTGRES_* в окружении.
+
+Сами сообщения не отправляются: broadcaster.start подменён записью id.
+"""
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("aiogram")
+pytest.importorskip("dotenv")
+
+import broadcaster  # noqa: E402
+import database  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not os.getenv("POSTGRES_HOST"), reason="нет БД: POSTGRES_HOST не задан")
+
+AUDIENCE = "tests"
+
+
+async def _with_broadcasts(check, monkeypatch):
+    started = []
+    monkeypatch.setattr(broadcaster, "start", lambda bot, broadcast_id: started.append(broadcast_id))
+    await database.init_pool()
+    try:
+        await database.init_db()
+        async with database.acquire() as conn:
+            await conn.execute("DELETE FROM Broadcasts WHERE audience = $1", AUDIENCE)
+            # (статус, владелец, аренда в секундах от текущего момента)
+            ids = {}
+            for name, status, owner, lease in [
+                ('orphan', 'running', None, None),
+                ('expired', 'running', 'crashed', -5),
+                ('leased', 'running', 'alive', 60),
+                ('done', 'done', None, None),
+            ]:
+                ids[name] = await conn.fetchval(
+                    """
+                    INSERT INTO Broadcasts(audience, text, status, owner, lease_until)
+                    VALUES($1, 'текст', $2, $3, now() + $4 * interval '1 second')
+                    RETURNING broadcast_id
+                    """,
+                    AUDIENCE, status, owner, lease
+                )
+        try:
+            return await check(ids, started)
+        finally:
+            async with database.acquire() as conn:
+                await conn.execute("DELETE FROM Broadcasts WHERE audience = $1", AUDIENCE)
+    finally:
+        await database.close_pool()
+
+
+async def _owners(ids: dict) -> dict:
+    async with database.acquire() as conn:
+        rows = await conn.fetch(
+            "SELECT broadcast_id, owner FROM Broadcasts WHERE broadcast_id = ANY($1::int[])",
+            list(ids.values())
+        )
+    by_id = {r['broadcast_id']: r['owner'] for r in rows}
+    return {name: by_id[broadcast_id] for name, broadcast_id in ids.items()}
+
+
+def test_claim_takes_orphaned_and_expired(monkeypatch):
+    async def check(ids, started):
+        monkeypatch.setattr(broadcaster, "OWNER", "first")
+        await broadcaster._claim(None)
+        mine = {name for name, i in ids.items() if i in started}
+        # Второй процесс живую аренду первого не забирает
+        started.clear()
+        monkeypatch.setattr(broadcaster, "OWNER", "second")
+        await broadcaster._claim(None)
+        again = {name for name, i in ids.items() if i in started}
+        return mine, again, await _owners(ids)
+
+    mine, again, owners = asyncio.run(_with_broadcasts(check, monkeypatch))
+    assert mine == {'orphan', 'expired'}
+    assert again == set()
+    assert owners == {'orphan': 'first', 'expired': 'first', 'leased': 'alive', 'done': None}
+
+
+def test_renew_only_own_running(monkeypatch):
+    async def check(ids, started):
+        monkeypatch.setattr(broadcaster, "OWNER", "alive")
+        own = await broadcaster._renew(ids['leased'])
+        foreign = await broadcaster._renew(ids['expired'])
+        await broadcaster.cancel(ids['leased'])
+        cancelled = await broadcaster._renew(ids['leased'])
+        return own, foreign, cancelled
+
+    assert asyncio.run(_with_broadcasts(check, monkeypatch)) == (True, False, False)
+
+
+def test_stop_releases_lease(monkeypatch):
+    async def check(ids, started):
+        monkeypatch.setattr(broadcaster, "OWNER", "alive")
+        await broadcaster.stop()
+        return await _owners(ids)
+
+    owners = asyncio.run(_with_broadcasts(check, monkeypatch))
+    assert owners['leased'] is None
+    assert owners['expired'] == 'crashed'
@@ -0,0 +1,137 @@
+# tests/test_eventlog.py
+"""Пачки журнала событий: запись, повтор после ошибок БД, политика переполнения."""
+import asyncio
+from contextlib import asynccontextmanager
+
+import pytest
+
+asyncpg = pytest.importorskip("asyncpg")
+pytest.importorskip("dotenv")
+
+import eventlog  # noqa: E402
+
+
+class FakeConnection:
+    """Пишет в словарь таблица -> строки; ошибки задаются по таблице."""
+
+    def __init__(self, db, copy_errors=None, row_errors=None):
+        self.db = db
+        self.copy_errors = copy_errors or {}
+        # (таблица, первое поле строки) -> исключение при построчной записи
+        self.row_errors = row_errors or {}
+
+    async def copy_records_to_table(self, table, records, columns):
+        error = self.copy_errors.get(table)
+        if error is not None:
+            raise error
+        self.db.setdefault(table, []).extend(records)
+
+    async def execute(self, sql, *record):
+        table = sql.split()[2].split('(')[0]
+        error = self.row_errors.get((table, record[0]))
+        if error is not None:
+            raise error
+        self.db.setdefault(table, []).append(record)
+
+
+@pytest.fixture(autouse=True)
+def clean_state(monkeypatch):
+    eventlog._queue.clear()
+    for key in eventlog._stats:
+        eventlog._stats[key] = 0
+    monkeypatch.setattr(eventlog, "_room", None)
+    monkeypatch.setattr(eventlog, "_wakeup", None)
+
+
+def _use(monkeypatch, conn):
+    @asynccontextmanager
+    async def acquire():
+        yield conn
+    monkeypatch.setattr(eventlog, "acquire", acquire)
+
+
+def _fill():
+    eventlog.log_action(1, "a")
+    eventlog.log_search(10, "q1")
+    eventlog.log_action(2, "b")
+    eventlog.log_search(11, "q2")
+
+
+def test_batch_is_written_with_one_copy_per_table(monkeypatch):
+    db = {}
+    _use(monkeypatch, FakeConnection(db))
+    _fill()
+    assert asyncio.run(eventlog.flush()) is True
+    assert [r[0] for r in db['logs']] == ['1', '2']
+    assert [r[1] for r in db['searchlogs']] == ['q1', 'q2']
+    assert eventlog.stats()['queued'] == 0
+
+
+def test_written_table_is_not_requeued_when_a_later_one_fails(monkeypatch):
+    db = {}
+    broken = asyncpg.ConnectionDoesNotExistError("connection was closed")
+    _use(monkeypatch, FakeConnection(db, copy_errors={'searchlogs': broken}))
+    _fill()
+    assert asyncio.run(eventlog.flush()) is False
+    assert len(db['logs']) == 2
+    # В очереди только незаписанная таблица
+    assert [table for table, _ in eventlog._queue] == ['searchlogs', 'searchlogs']
+
+    _use(monkeypatch, FakeConnection(db))
+    assert asyncio.run(eventlog.flush()) is True
+    assert len(db['logs']) == 2
+    assert [r[1] for r in db['searchlogs']] == ['q1', 'q2']
+    assert eventlog.stats()['failed'] == 0
+
+
+def test_bad_row_is_skipped_and_the_rest_written(monkeypatch):
+    db = {}
+    conn = FakeConnection(
+        db,
+        copy_errors={'searchlogs': asyncpg.ForeignKeyViolationError("fk")},
+        row_errors={('searchlogs', 10): asyncpg.ForeignKeyViolationError("fk")},
+    )
+    _use(monkeypatch, conn)
+    _fill()
+    assert asyncio.run(eventlog.flush()) is True
+    assert [r[1] for r in db['searchlogs']] == ['q2']
+    assert eventlog.stats()['failed'] == 1
+
+
+def test_dropped_connection_in_row_fallback_requeues_the_rest(monkeypatch):
+    db = {}
+    conn = FakeConnection(
+        db,
+        copy_errors={'searchlogs': asyncpg.ForeignKeyViolationError("fk")},
+        row_errors={('searchlogs', 11): asyncpg.ConnectionDoesNotExistError("closed")},
+    )
+    _use(monkeypatch, conn)
+    _fill()
+    assert asyncio.run(eventlog.flush()) is False
+    assert [r[1] for r in db['searchlogs']] == ['q1']
+    assert [record[1] for _, record in eventlog._queue] == ['q2']
+    assert eventlog.stats()['failed'] == 0
+
+
+def test_requeue_respects_drop_policy(monkeypatch):
+    monkeypatch.setattr(eventlog, "EVENTLOG_QUEUE_SIZE", 3)
+    monkeypatch.setattr(eventlog, "EVENTLOG_DROP_POLICY", "oldest")
+    for i in range(3):
+        eventlog.log_action(i, "a")
+    batch = eventlog._take_batch()
+    eventlog.log_action(3, "a")
+    eventlog.log_action(4, "a")
+    eventlog._requeue(batch)
+    # Возвращённая пачка старше остальных — при переполнении уходит первой
+    assert [record[0] for _, record in eventlog._queue] == ['2', '3', '4']
+    assert eventlog.stats()['dropped'] == 2
+
+
+def test_wait_for_room_times_out_on_full_queue(monkeypatch):
+    monkeypatch.setattr(eventlog, "EVENTLOG_QUEUE_SIZE", 1)
+    eventlog.log_action(1, "a")
+
+    async def check():
+        monkeypatch.setattr(eventlog, "_room", asyncio.Event())
+        return await eventlog.wait_for_room(0.01)
+    assert asyncio.run(check()) is False
@@ -0,0 +1,74 @@
+# tests/test_exports.py
+"""Запись выгрузки порциями курсора: поддельный курсор, без БД."""
+import asyncio
+import csv
+
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("dotenv")
+
+import exports  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, rows: list, fail_after: int | None = None):
+        self.rows = rows
+        self.fail_after = fail_after
+        self.fetches = 0
+
+    async def fetch(self, n: int) -> list:
+        if self.fail_after is not None and self.fetches == self.fail_after:
+            raise ConnectionError("соединение потеряно")
+        self.fetches += 1
+        chunk, self.rows = self.rows[:n], self.rows[n:]
+        return chunk
+
+
+ROWS = [(f"Студент {i}", f"ГР-{i % 3}") for i in range(25)]
+
+
+def _export_csv(path, cursor) -> int:
+    async def run():
+        writer = exports._CsvWriter(str(path), exports.REPORTS['without_topic'])
+        try:
+            return await exports._write(writer, cursor)
+        finally:
+            writer.close()
+    return asyncio.run(run())
+
+
+def test_csv_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(exports, "EXPORT_PREFETCH", 10)
+    path = tmp_path / "report.csv"
+    cursor = FakeCursor(list(ROWS))
+    assert _export_csv(path, cursor) == 25
+    # Две полные порции, неполная и пустая в конце
+    assert cursor.fetches == 4
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        lines = list(csv.reader(f, delimiter=';'))
+    assert lines[0] == ["Студент", "Группа"]
+    assert [tuple(line) for line in lines[1:]] == ROWS
+
+
+def test_read_error_waits_for_pending_write(tmp_path, monkeypatch):
+    monkeypatch.setattr(exports, "EXPORT_PREFETCH", 10)
+    with pytest.raises(ConnectionError):
+        _export_csv(tmp_path / "report.csv", FakeCursor(list(ROWS), fail_after=2))
+
+
+@pytest.mark.skipif(exports.openpyxl is None, reason="нет openpyxl")
+def test_xlsx_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(exports, "EXPORT_PREFETCH", 10)
+    path = tmp_path / "report.xlsx"
+
+    async def run():
+        writer = exports._XlsxWriter(str(path), exports.REPORTS['without_topic'])
+        try:
+            return await exports._write(writer, FakeCursor(list(ROWS)))
+        finally:
+            writer.close()
+
+    assert asyncio.run(run()) == 25
+    sheet = exports.openpyxl.load_workbook(path).active
+    assert [tuple(r) for r in sheet.iter_rows(values_only=True)] == [("Студент", "Группа"), *ROWS]
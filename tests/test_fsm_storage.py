@@ -0,0 +1,105 @@
+# tests/test_fsm_storage.py
+"""Сериализация данных FSM и срок жизни диалога в FsmStates.
+
+Тесты TTL идут на настоящей БД: нужны POSTGRES_* в окружении.
+"""
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("aiogram")
+pytest.importorskip("dotenv")
+
+from aiogram.fsm.storage.base import StorageKey  # noqa: E402
+
+import database  # noqa: E402
+import fsm_storage  # noqa: E402
+
+needs_db = pytest.mark.skipif(not os.getenv("POSTGRES_HOST"), reason="нет БД: POSTGRES_HOST не задан")
+
+DATA = {"title": "Тема", "student_id": 7, "score": 4.5, "done": False, "note": None,
+        "choose_map": {"Тема": [1, 2]}}
+
+
+def test_json_is_default():
+    assert isinstance(fsm_storage.PostgresStorage().serializer, fsm_storage.JsonSerializer)
+
+
+def test_json_roundtrip():
+    serializer = fsm_storage.JsonSerializer()
+    assert serializer.loads(serializer.dumps(DATA)) == DATA
+
+
+def test_marshal_roundtrip_keeps_tuples():
+    serializer = fsm_storage.MarshalSerializer()
+    data = {"choose_map": {"Тема": (1, 2)}}
+    raw = serializer.dumps(data)
+    assert raw.startswith(serializer.tag)
+    assert serializer.loads(raw) == data
+
+
+def test_marshal_rejects_foreign_tag():
+    serializer = fsm_storage.MarshalSerializer()
+    raw = serializer.dumps(DATA)
+    foreign = b'M' + bytes((3, 0, serializer.version)) + raw[len(serializer.tag):]
+    with pytest.raises(ValueError):
+        serializer.loads(foreign)
+    # JSON-запись marshal тоже не примет
+    with pytest.raises(ValueError):
+        serializer.loads(fsm_storage.JsonSerializer().dumps(DATA))
+
+
+async def _with_storage(check, ttl: float = 60, serializer=None):
+    await database.init_pool()
+    try:
+        await database.init_db()
+        storage = fsm_storage.PostgresStorage(serializer, ttl=ttl)
+        key = StorageKey(bot_id=1, chat_id=-100500, user_id=-100500)
+        async with database.acquire() as conn:
+            await conn.execute("DELETE FROM FsmStates WHERE chat_id = $1", key.chat_id)
+        try:
+            return await check(storage, key)
+        finally:
+            async with database.acquire() as conn:
+                await conn.execute("DELETE FROM FsmStates WHERE chat_id = $1", key.chat_id)
+    finally:
+        await database.close_pool()
+
+
+@needs_db
+def test_state_and_data_roundtrip():
+    async def check(storage, key):
+        await storage.set_state(key, "Topic:title")
+        await storage.set_data(key, DATA)
+        return await storage.get_state(key), await storage.get_data(key)
+
+    assert asyncio.run(_with_storage(check)) == ("Topic:title", DATA)
+
+
+@needs_db
+def test_expired_dialog_is_empty():
+    async def check(storage, key):
+        await storage.set_state(key, "Topic:title")
+        await storage.set_data(key, DATA)
+        await asyncio.sleep(0.2)
+        expired = await storage.get_state(key), await storage.get_data(key)
+        # Новое состояние не воскрешает данные просроченной записи
+        storage.ttl = 60
+        await storage.set_state(key, "Topic:description")
+        return expired, (await storage.get_state(key), await storage.get_data(key))
+
+    expired, renewed = asyncio.run(_with_storage(check, ttl=0.1))
+    assert expired == (None, {})
+    assert renewed == ("Topic:description", {})
+
+
+@needs_db
+def test_unreadable_data_resets_dialog():
+    async def check(storage, key):
+        await storage.set_data(key, DATA)
+        storage.serializer = fsm_storage.MarshalSerializer()
+        return await storage.get_data(key)
+
+    assert asyncio.run(_with_storage(check)) == {}
@@ -0,0 +1,31 @@
+# tests/test_imports.py
+"""Бот импортируется и собирает диспетчер в чистом интерпретаторе.
+
+Отдельный процесс: в общем процессе pytest модули уже могли подтянуться
+другими тестами в другом порядке, и циклический импорт не проявится.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("aiogram")
+pytest.importorskip("asyncpg")
+pytest.importorskip("dotenv")
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _run(code: str):
+    result = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+
+
+@pytest.mark.parametrize("module", ["bot", "statements", "querytrace", "fsm_storage", "metrics", "webhook"])
+def test_module_imports_first(module):
+    _run(f"import {module}")
+
+
+def test_dispatcher_registers_all_handlers():
+    _run("import bot; bot.create_dispatcher()")
@@ -0,0 +1,55 @@
+# tests/test_keyword_index.py
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("dotenv")
+
+import keyword_index  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def index():
+    keyword_index._index.clear()
+    keyword_index._topic_prefixes.clear()
+    keyword_index._status.clear()
+    keyword_index.add(1, ["Нейронные сети"])
+    keyword_index.add(2, ["нейросети", "Python"])
+    keyword_index.add(3, ["Ёлочные игрушки"], status='closed')
+
+
+def _search(text: str) -> set[int]:
+    return keyword_index.search(keyword_index.parse_query(text))
+
+
+def test_prefix_of_keyword_and_of_word_inside_it():
+    assert _search("нейро") == {1, 2}
+    assert _search("сети") == {1}
+    assert _search("нейронные сети") == {1}
+
+
+def test_substring_in_the_middle_of_a_word_is_not_matched():
+    # Поведение изменилось с LIKE '%сети%': «нейросети» по «сети» не находится
+    assert _search("росети") == set()
+    assert 2 not in _search("сети")
+
+
+def test_and_or_and_normalization():
+    assert _search("нейро + py") == {2}
+    assert _search("сети, елоч") == {1, 3}
+    assert _search("  PYTHON ") == {2}
+
+
+def test_short_terms_are_ignored():
+    assert keyword_index.parse_query("н, + сети") == [["сети"]]
+
+
+def test_replace_and_remove():
+    keyword_index.add(1, ["графы"])
+    assert _search("нейро") == {2}
+    keyword_index.remove(2)
+    assert _search("нейро") == set()
+    assert keyword_index.stats()['topics'] == 2
+
+
+def test_rank_puts_free_and_newer_first():
+    assert keyword_index.rank({1, 2, 3}, limit=2) == [2, 1]
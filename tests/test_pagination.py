@@ -0,0 +1,49 @@
+# tests/test_pagination.py
+"""Редактирование сообщения со списком при листании."""
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiogram")
+pytest.importorskip("asyncpg")
+pytest.importorskip("dotenv")
+
+from aiogram.exceptions import TelegramBadRequest  # noqa: E402
+
+from handlers import pagination  # noqa: E402
+
+
+class FakeMessage:
+    def __init__(self, error: str | None):
+        self.error = error
+        self.sent = []
+
+    async def edit_text(self, text, **kwargs):
+        if self.error:
+            raise TelegramBadRequest(method=None, message=self.error)
+
+    async def answer(self, text, **kwargs):
+        self.sent.append(text)
+
+
+class FakeQuery:
+    def __init__(self, error: str | None = None):
+        self.message = FakeMessage(error)
+
+
+def _edit(query: FakeQuery) -> list:
+    asyncio.run(pagination._edit(query, "страница", None))
+    return query.message.sent
+
+
+def test_not_modified_is_ignored():
+    error = "Bad Request: message is not modified: specified new message content is the same"
+    assert _edit(FakeQuery(error)) == []
+
+
+def test_other_errors_send_a_new_message():
+    assert _edit(FakeQuery("Bad Request: message can't be edited")) == ["страница"]
+
+
+def test_edited_in_place():
+    assert _edit(FakeQuery()) == []
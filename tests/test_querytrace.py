@@ -0,0 +1,44 @@
+# tests/test_querytrace.py
+"""Трассировка запросов на настоящей БД: нужны asyncpg, aiogram и POSTGRES_* в окружении."""
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("aiogram")
+pytest.importorskip("dotenv")
+
+import database  # noqa: E402
+import querytrace  # noqa: E402
+import statements  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not os.getenv("POSTGRES_HOST"), reason="нет БД: POSTGRES_HOST не задан")
+
+
+_ONE = statements.register("tests.one", "SELECT $1::int")
+
+
+async def _acquire_and_fetch(fetch) -> querytrace.QueryTrace:
+    await database.init_pool(connection_class=querytrace.TracedConnection)
+    try:
+        with querytrace.trace() as result:
+            async with database.acquire() as conn:
+                await fetch(conn)
+        return result
+    finally:
+        await database.close_pool()
+
+
+def test_pool_reset_is_not_counted():
+    # Возврат в пул выполняет reset() соединения — это не запрос обновления
+    result = asyncio.run(_acquire_and_fetch(lambda conn: conn.fetchval("SELECT 1")))
+    assert result.queries == 1
+    assert result.shapes == {"SELECT 1": 1}
+
+
+def test_registered_statement_is_counted():
+    # Подготовленный запрос идёт мимо методов соединения — через statements.observe
+    result = asyncio.run(_acquire_and_fetch(lambda conn: _ONE.fetchval(conn, 1)))
+    assert result.queries == 1
+    assert result.shapes == {"SELECT $1::int": 1}
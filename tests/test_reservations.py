@@ -0,0 +1,63 @@
+# tests/test_reservations.py
+"""Исходы закрепления темы по строке, которую вернул запрос захвата."""
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("aiogram")
+pytest.importorskip("dotenv")
+
+from reservations import Claim, _result  # noqa: E402
+
+STUDENT, OTHER, TEACHER = 1, 2, 10
+
+
+def _row(**fields) -> dict:
+    row = {
+        'claimed_id': None, 'topic_id': 5, 'title': "Графы", 'status': 'free',
+        'teacher_id': TEACHER, 'holder_id': None, 'holder_name': None,
+        'own_id': None, 'own_title': None,
+    }
+    row.update(fields)
+    return row
+
+
+def test_claimed():
+    result = _result(_row(claimed_id=5), STUDENT, 'reserved', None)
+    assert result == Claim('claimed', 5, "Графы", STUDENT)
+    assert result.ok
+
+
+def test_not_found():
+    result = _result(_row(topic_id=None, title=None), STUDENT, 'reserved', None)
+    assert result.outcome == 'not_found'
+    assert not result.ok
+
+
+def test_approve_foreign_topic_is_forbidden():
+    row = _row(status='reserved', holder_id=STUDENT)
+    assert _result(row, STUDENT, 'closed', TEACHER + 1).outcome == 'forbidden'
+    assert _result(row, STUDENT, 'closed', None).outcome == 'forbidden'
+
+
+def test_student_has_other_topic():
+    row = _row(own_id=7, own_title="Сети")
+    assert _result(row, STUDENT, 'reserved', None) == Claim('has_topic', 7, "Сети")
+
+
+@pytest.mark.parametrize("status", ['reserved', 'closed'])
+def test_own_topic_is_already(status):
+    row = _row(status=status, holder_id=STUDENT, own_id=5, own_title="Графы")
+    result = _result(row, STUDENT, 'reserved', None)
+    assert result == Claim('already', 5, "Графы", STUDENT)
+    assert result.ok
+
+
+def test_taken_by_other_student():
+    row = _row(status='reserved', holder_id=OTHER, holder_name="Петров")
+    assert _result(row, STUDENT, 'reserved', None) == Claim('taken', 5, "Графы", OTHER, "Петров")
+
+
+def test_proposed_by_other_student_is_taken():
+    # Свободная тема, предложенная другим студентом, ему и остаётся
+    row = _row(holder_id=OTHER, holder_name="Петров")
+    assert _result(row, STUDENT, 'reserved', None).outcome == 'taken'
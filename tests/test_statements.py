@@ -0,0 +1,41 @@
+# tests/test_statements.py
+"""Реестр подготовленных запросов на настоящей БД: нужны asyncpg и POSTGRES_* в окружении."""
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("asyncpg")
+pytest.importorskip("dotenv")
+
+import database  # noqa: E402
+import statements  # noqa: E402
+
+pytestmark = pytest.mark.skipif(not os.getenv("POSTGRES_HOST"), reason="нет БД: POSTGRES_HOST не задан")
+
+
+_DOUBLE = statements.register("tests.double", "SELECT $1::int * 2")
+
+
+async def _reuse_across_acquires() -> tuple[list, int]:
+    await database.init_pool()
+    try:
+        results, prepared = [], set()
+        # Соединение возвращается в пул и выдаётся снова: запрос не готовится заново
+        for value in range(3):
+            async with database.acquire() as conn:
+                results.append(await _DOUBLE.fetchval(conn, value))
+                prepared.add(id(conn.prepared_statements()["tests.double"]))
+        return results, len(prepared)
+    finally:
+        await database.close_pool()
+
+
+def test_statement_survives_pool_release():
+    assert asyncio.run(_reuse_across_acquires()) == ([0, 2, 4], 1)
+
+
+def test_register_conflict():
+    assert statements.register("tests.double", "SELECT $1::int * 2") is _DOUBLE
+    with pytest.raises(ValueError):
+        statements.register("tests.double", "SELECT $1::int * 3")
@@ -0,0 +1,75 @@
+# tests/test_text_router.py
+"""Таблица текстовых маршрутов: порядок поиска и конфликты регистрации."""
+import pytest
+
+pytest.importorskip("aiogram")
+
+from aiogram.fsm.state import State, StatesGroup  # noqa: E402
+
+from text_router import RouteConflictError, TextRouter  # noqa: E402
+
+
+class Dialog(StatesGroup):
+    NAME = State()
+    EMAIL = State()
+
+
+async def menu(message): ...
+async def cancel(message): ...
+async def enter_name(message): ...
+async def other(message): ...
+
+
+def _router() -> TextRouter:
+    router = TextRouter()
+    router.add("📋 Меню", menu)
+    router.add("❌ Отмена", cancel, Dialog)
+    router.fallback(Dialog.NAME, enter_name)
+    return router
+
+
+def _handler(router: TextRouter, text: str, state: State | None = None):
+    route = router.match(text, state.state if state else None)
+    return route.handler.callback if route else None
+
+
+def test_lookup_order():
+    router = _router()
+    # Точный текст в состоянии важнее ввода в состоянии
+    assert _handler(router, "❌ Отмена", Dialog.NAME) is cancel
+    assert _handler(router, "❌ Отмена", Dialog.EMAIL) is cancel
+    # Кнопка меню работает в любом состоянии
+    assert _handler(router, "📋 Меню", Dialog.NAME) is menu
+    assert _handler(router, "Иванов Иван", Dialog.NAME) is enter_name
+    # Вне состояния произвольный текст не обрабатывается
+    assert _handler(router, "❌ Отмена") is None
+    assert _handler(router, "Иванов Иван") is None
+
+
+def test_command_is_not_dialog_input():
+    assert _handler(_router(), "/start", Dialog.NAME) is None
+
+
+def test_same_handler_registers_twice():
+    router = _router()
+    router.add("📋 Меню", menu)
+    router.fallback(Dialog.NAME, enter_name)
+    assert len(router) == 4
+
+
+def test_conflicts():
+    router = _router()
+    with pytest.raises(RouteConflictError):
+        router.add("📋 Меню", other)
+    with pytest.raises(RouteConflictError):
+        router.add("❌ Отмена", other, Dialog.EMAIL)
+    with pytest.raises(RouteConflictError):
+        router.fallback(Dialog.NAME, other)
+    # Тот же текст в другом состоянии — отдельный маршрут
+    router.add("📋 Меню", other, Dialog.EMAIL)
+    assert _handler(router, "📋 Меню", Dialog.EMAIL) is other
+
+
+def test_fallback_needs_state():
+    with pytest.raises(ValueError):
+        TextRouter()._add(None, None, other)
@@ -0,0 +1,55 @@
+# tests/test_webhook.py
+"""Ответы HTTP-сервера webhook; обновления не обрабатываются, только ставятся в очередь."""
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiohttp")
+pytest.importorskip("aiogram")
+pytest.importorskip("dotenv")
+
+from aiohttp.test_utils import TestClient, TestServer  # noqa: E402
+from aiogram import Bot, Dispatcher  # noqa: E402
+
+import webhook  # noqa: E402
+
+SECRET = "test-secret"
+UPDATE = {
+    "update_id": 1,
+    "message": {
+        "message_id": 1, "date": 0, "text": "/start",
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Тест"},
+    },
+}
+
+
+async def _post(body=None, *, data=None, secret: str = SECRET) -> tuple[int, int]:
+    bot = Bot("42:TEST")
+    queue = webhook.UpdateQueue(bot, Dispatcher(), workers=1, size=10)
+    client = TestClient(TestServer(webhook.create_app(bot, queue, path="/hook", secret=SECRET)))
+    await client.start_server()
+    try:
+        response = await client.post("/hook", json=body, data=data,
+                                     headers={webhook.SECRET_HEADER: secret})
+        return response.status, queue.queued()
+    finally:
+        await client.close()
+        await bot.session.close()
+
+
+def test_update_is_queued():
+    assert asyncio.run(_post(UPDATE)) == (200, 1)
+
+
+def test_wrong_secret():
+    assert asyncio.run(_post(UPDATE, secret="other")) == (401, 0)
+
+
+def test_invalid_json_is_bad_request():
+    assert asyncio.run(_post(data=b"{not json")) == (400, 0)
+
+
+def test_invalid_update_is_bad_request():
+    assert asyncio.run(_post({"message": "нет update_id"})) == (400, 0)
+    assert asyncio.run(_post([1, 2, 3])) == (400, 0)
@@ -0,0 +1,151 @@
+# text_router.py
+"""Маршрутизация текстовых сообщений через словарь вместо цепочки фильтров.
+
+Кнопки меню и ввод в состояниях FSM регистрируются в таблице маршрутов,
+и сообщение находит обработчик за одно–три обращения к словарю, сколько бы
+кнопок ни было. Порядок поиска:
+
+1. точный текст в текущем состоянии (например, «❌ Отмена» в диалоге);
+2. точный текст в любом состоянии (кнопки главного меню);
+3. любой текст в текущем состоянии (ввод названия, ФИО и т.п.).
+
+Повторная регистрация того же ключа другим обработчиком — ошибка при
+запуске, а не тихое перекрытие одним модулем другого. По каждому маршруту
+считаются срабатывания (stats()).
+
+Команды (/start и т.п.), callback-запросы и нетекстовые сообщения идут
+через обычные хэндлеры aiogram.
+"""
+import logging
+from dataclasses import dataclass
+from typing import Any, Callable
+
+from aiogram import Dispatcher, F
+from aiogram.dispatcher.event.handler import CallableObject
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import Message
+
+logger = logging.getLogger(__name__)
+
+StateArg = State | type[StatesGroup] | None
+
+
+class RouteConflictError(Exception):
+    pass
+
+
+@dataclass
+class Route:
+    state: str | None   # None — в любом состоянии
+    text: str | None    # None — любой текст в состоянии
+    handler: CallableObject
+    hits: int = 0
+
+    @property
+    def name(self) -> str:
+        callback = self.handler.callback
+        return f"{callback.__module__}.{callback.__qualname__}"
+
+
+def _state_names(state: StateArg) -> list[str | None]:
+    if state is None:
+        return [None]
+    if isinstance(state, State):
+        return [state.state]
+    return [s.state for s in state.__all_states__]
+
+
+class TextRouter:
+    def __init__(self):
+        # (состояние, текст) -> маршрут
+        self._routes: dict[tuple[str | None, str | None], Route] = {}
+
+    def add(self, text: str, callback: Callable, state: StateArg = None):
+        """Точный текст; state — State, StatesGroup (все его состояния) или None (любое)."""
+        for name in _state_names(state):
+            self._add(name, text, callback)
+
+    def fallback(self, state: State | type[StatesGroup], callback: Callable):
+        """Любой текст в состоянии, если для него нет точного маршрута."""
+        for name in _state_names(state):
+            self._add(name, None, callback)
+
+    def text(self, text: str, state: StateArg = None):
+        """Декоратор-аналог dp.message(F.text == text, state)."""
+        def decorator(callback: Callable) -> Callable:
+            self.add(text, callback, state)
+            return callback
+        return decorator
+
+    def any_text(self, state: State | type[StatesGroup]):
+        """Декоратор-аналог dp.message(state) для ввода в состоянии."""
+        def decorator(callback: Callable) -> Callable:
+            self.fallback(state, callback)
+            return callback
+        return decorator
+
+    def _add(self, state: str | None, text: str | None, callback: Callable):
+        if state is None and text is None:
+            raise ValueError("Маршрут без текста нужен конкретному состоянию")
+        key = (state, text)
+        existing = self._routes.get(key)
+        if existing is not None:
+            if existing.handler.callback is callback:
+                return
+            raise RouteConflictError(
+                f"Текст {text!r} в состоянии {state or '*'} уже обрабатывает {existing.name}"
+            )
+        self._routes[key] = Route(state, text, CallableObject(callback))
+
+    def match(self, text: str, raw_state: str | None) -> Route | None:
+        route = None
+        if raw_state is not None:
+            route = self._routes.get((raw_state, text))
+        if route is None:
+            route = self._routes.get((None, text))
+        # Команды в середине диалога не считаем вводом: их ловят свои хэндлеры
+        if route is None and raw_state is not None and not text.startswith('/'):
+            route = self._routes.get((raw_state, None))
+        return route
+
+    async def _filter(self, message: Message, raw_state: str | None = None) -> bool | dict[str, Any]:
+        route = self.match(message.text, raw_state)
+        if route is None:
+            return False
+        return {"route": route}
+
+    async def _dispatch(self, message: Message, route: Route, **data: Any) -> Any:
+        route.hits += 1
+        return await route.handler.call(message, **data)
+
+    def stats(self) -> list[dict[str, Any]]:
+        """Маршруты по убыванию числа срабатываний."""
+        rows = [
+            {'state': r.state, 'text': r.text, 'handler': r.name, 'hits': r.hits}
+            for r in self._routes.values()
+        ]
+        rows.sort(key=lambda r: r['hits'], reverse=True)
+        return rows
+
+    async def _log_stats(self):
+        used = [r for r in self.stats() if r['hits']]
+        if used:
+            logger.info("Срабатывания маршрутов: %s", ", ".join(
+                f"{r['text'] or '<ввод>'}@{r['state'] or '*'}={r['hits']}" for r in used
+            ))
+
+    def __len__(self) -> int:
+        return len(self._routes)
+
+
+def setup(dp: Dispatcher) -> TextRouter:
+    """Подключает таблицу маршрутов к диспетчеру; вызывать до register_handlers модулей."""
+    router = TextRouter()
+    dp.message(F.text, router._filter)(router._dispatch)
+    dp.shutdown.register(router._log_stats)
+    dp["text_router"] = router
+    return router
+
+
+def get(dp: Dispatcher) -> TextRouter:
+    return dp["text_router"]
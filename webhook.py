@@ -0,0 +1,154 @@
+# webhook.py
+"""Приём обновлений через webhook вместо long polling (BOT_MODE=webhook).
+
+Встроенный HTTP-сервер проверяет секретный токен, кладёт обновление в
+очередь и сразу отвечает Telegram. Обработку ведут WEBHOOK_WORKERS задач:
+обновления одного пользователя всегда попадают в одну очередь, поэтому
+обрабатываются по порядку, а разные пользователи — параллельно. Если очереди
+заполнены, сервер отвечает 503 и Telegram повторит доставку позже.
+
+Несколько реплик за балансировщиком работают с одним WEBHOOK_SECRET.
+"""
+import asyncio
+import hashlib
+import hmac
+import logging
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import (
+    API_TOKEN,
+    WEBHOOK_BASE_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_WORKERS,
+    WEBHOOK_QUEUE_SIZE,
+    WEBHOOK_ENQUEUE_TIMEOUT,
+    WEBHOOK_MAX_CONNECTIONS,
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def secret_token() -> str:
+    # Telegram допускает только A-Z, a-z, 0-9, _ и -; hex подходит
+    return WEBHOOK_SECRET or hashlib.sha256(f"webhook:{API_TOKEN}".encode()).hexdigest()
+
+
+def _shard_key(update: Update) -> int:
+    event = update.event
+    user = getattr(event, "from_user", None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, "chat", None)
+    if chat is not None:
+        return chat.id
+    return update.update_id
+
+
+class UpdateQueue:
+    """Ограниченные очереди обработки обновлений, по одной на обработчик."""
+
+    def __init__(self, bot: Bot, dp: Dispatcher,
+                 workers: int = WEBHOOK_WORKERS, size: int = WEBHOOK_QUEUE_SIZE):
+        self.bot = bot
+        self.dp = dp
+        per_worker = max(size // workers, 1)
+        self._queues = [asyncio.Queue(maxsize=per_worker) for _ in range(workers)]
+        self._tasks: list[asyncio.Task] = []
+        self.stats = {'received': 0, 'processed': 0, 'failed': 0, 'rejected': 0}
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker(q)) for q in self._queues]
+
+    async def stop(self):
+        """Дорабатывает то, что уже в очередях, и останавливает обработчики."""
+        for q in self._queues:
+            await q.put(None)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def queued(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    async def put(self, update: Update, timeout: float = WEBHOOK_ENQUEUE_TIMEOUT) -> bool:
+        """False — очередь так и не освободилась, обновление не принято."""
+        self.stats['received'] += 1
+        queue = self._queues[_shard_key(update) % len(self._queues)]
+        try:
+            await asyncio.wait_for(queue.put(update), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.stats['rejected'] += 1
+            return False
+        return True
+
+    async def _worker(self, queue: asyncio.Queue):
+        while (update := await queue.get()) is not None:
+            try:
+                await self.dp.feed_update(self.bot, update)
+                self.stats['processed'] += 1
+            except Exception:
+                self.stats['failed'] += 1
+                logger.exception("Ошибка обработки обновления %s", update.update_id)
+
+
+def create_app(bot: Bot, queue: UpdateQueue, path: str = WEBHOOK_PATH,
+               secret: str | None = None) -> web.Application:
+    secret = secret or secret_token()
+
+    async def handle_update(request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": bot})
+        except ValueError:
+            # Не JSON или не обновление (pydantic.ValidationError — тоже ValueError):
+            # повтор доставки не поможет
+            logger.warning("Отклонено некорректное обновление webhook")
+            return web.Response(status=400)
+        if not await queue.put(update):
+            return web.Response(status=503)
+        return web.Response()
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response({**queue.stats, 'queued': queue.queued()})
+
+    app = web.Application()
+    app.router.add_post(path, handle_update)
+    app.router.add_get("/healthz", health)
+    return app
+
+
+async def run(bot: Bot, dp: Dispatcher):
+    """Аналог dp.start_polling(bot) для режима webhook: работает до отмены."""
+    # Те же события запуска и остановки, что и при поллинге. Запуск — до
+    # приёма обновлений: обработчики рассчитывают на то, что он уже прошёл
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    queue = UpdateQueue(bot, dp)
+    queue.start()
+    runner = web.AppRunner(create_app(bot, queue))
+    try:
+        await runner.setup()
+        await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+        logger.info("Webhook слушает %s:%s%s", WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH)
+
+        if WEBHOOK_BASE_URL:
+            await bot.set_webhook(
+                url=WEBHOOK_BASE_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=secret_token(),
+                allowed_updates=dp.resolve_used_update_types(),
+                max_connections=WEBHOOK_MAX_CONNECTIONS,
+            )
+        await asyncio.Event().wait()
+    finally:
+        # webhook не снимаем: остальные реплики продолжают принимать обновления
+        await runner.cleanup()
+        await queue.stop()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()